@@ -13,6 +13,7 @@ models = [
     QualificationRequirement,
     TaskType,
     Task,
+    QuestionBlob,
     Assignment,
     BonusPayment,
     WorkerBlock,
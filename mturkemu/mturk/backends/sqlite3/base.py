@@ -0,0 +1,49 @@
+# File: mturk/backends/sqlite3/base.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the emulator's sqlite
+# database backend. It is the django sqlite backend with cursors
+# that report the time of each query to the API metrics - see
+# 'mturk/metrics.py'.
+#
+# @note - the time to fetch the rows of a result after the query
+#    is executed is not included.
+#
+
+from django.db.backends.sqlite3 import base
+from django.db.backends.utils import CursorWrapper, CursorDebugWrapper
+
+from mturk.metrics import record_query
+
+import time
+
+class QueryTimerMixin(object):
+
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return( super().execute(sql, params) )
+        finally:
+            record_query(time.perf_counter() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.perf_counter()
+        try:
+            return( super().executemany(sql, param_list) )
+        finally:
+            record_query(time.perf_counter() - start)
+
+class TimedCursorWrapper(QueryTimerMixin, CursorWrapper):
+    pass
+
+class TimedCursorDebugWrapper(QueryTimerMixin, CursorDebugWrapper):
+    pass
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def make_cursor(self, cursor):
+        return( TimedCursorWrapper(cursor, self) )
+
+    def make_debug_cursor(self, cursor):
+        return( TimedCursorDebugWrapper(cursor, self) )
@@ -0,0 +1,140 @@
+# File: mturk/cache.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a thread safe, least
+# recently used cache with a bounded size. The size of the cache is
+# limited by the number of entries and by the total 'cost' of the
+# entries, where the cost is an estimate of the memory used by an
+# entry (for example, the length of the content it was created
+# from). The cache keeps hit, miss and eviction counters so that its
+# effectiveness can be monitored.
+#
+
+from collections import OrderedDict
+import threading
+
+class LRUCache(object):
+    """
+    Least recently used cache.
+    @param maxEntries max number of entries in the cache
+    @param maxCost max total cost of the entries in the cache or
+       None for no limit.
+    """
+    def __init__(self, maxEntries, maxCost=None):
+        if ( maxEntries < 0 ):
+            raise ValueError("Invalid Cache Size: %d" % maxEntries)
+        self.max_entries = maxEntries
+        self.max_cost = maxCost
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._cost = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return( len(self._entries) )
+
+    def __contains__(self, key):
+        return( key in self._entries )
+
+    @property
+    def cost(self):
+        return(self._cost)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, cost = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return(default)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return(value)
+
+    def put(self, key, value, cost=1):
+        """
+        Add an entry to the cache, evicting the least recently used
+        entries as necessary. Entries that are larger than the
+        cache are not stored.
+        """
+        if ( self.max_cost is not None and cost > self.max_cost ):
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if ( old is not None ):
+                self._cost -= old[1]
+            self._entries[key] = (value, cost)
+            self._cost += cost
+            self._evict()
+
+    def _evict(self):
+        while ( len(self._entries) > self.max_entries or
+                ( self.max_cost is not None and self._cost > self.max_cost ) ):
+            key, (value, cost) = self._entries.popitem(last=False)
+            self._cost -= cost
+            self.evictions += 1
+
+    def get_or_create(self, key, create, cost=1):
+        """
+        Get the value for a key, calling 'create()' to make the
+        value if it is not in the cache.
+        @note - 'create' is called without holding the lock, so
+           concurrent misses for the same key may each create it.
+        """
+        sentinel = self._entries
+        value = self.get(key, sentinel)
+        if ( value is sentinel ):
+            value = create()
+            self.put(key, value, cost)
+        return(value)
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if ( entry is not None ):
+                self._cost -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._cost = 0
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        return({
+            "Entries" : len(self._entries),
+            "MaxEntries" : self.max_entries,
+            "Cost" : self._cost,
+            "MaxCost" : self.max_cost,
+            "Hits" : self.hits,
+            "Misses" : self.misses,
+            "Evictions" : self.evictions,
+        })
+
+# Named caches whose statistics are reported by the
+#   'GetCacheStatistics' emulator operation.
+_registry = OrderedDict()
+
+def register_cache(name, cache):
+    _registry[name] = cache
+    return(cache)
+
+def cache_statistics():
+    """
+    @return dict of cache name to the cache's statistics
+    """
+    return( { name : cache.stats() for name, cache in _registry.items() } )
+
+def reset_cache_statistics():
+    for cache in _registry.values():
+        cache.reset_stats()
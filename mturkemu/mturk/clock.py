@@ -0,0 +1,173 @@
+# File: mturk/clock.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the emulator's clock.
+# All of the time dependent behavior of the emulator (task
+# expiration, assignment deadlines, auto approval, qualification
+# retry delays, etc) reads the current time from this clock
+# instead of calling 'timezone.now()' directly. By default the
+# clock follows the real time but it can be frozen, advanced or
+# run faster than real time so that long HIT lifecycles can be
+# simulated in a short test.
+#
+# @note - the clock state is per process. When the emulator is run
+#    with multiple server processes, the clock should only be
+#    modified when running a single process.
+#
+
+from django.utils import timezone
+
+from datetime import timedelta
+import threading
+
+class EmulatorClock(object):
+    """
+    Virtual clock - the virtual time is computed from an anchor
+    point in real time and virtual time:
+       virtual = anchorVirtual + (real - anchorReal) * speed
+    or just 'anchorVirtual' if the clock is frozen.
+    """
+
+    def __init__(self, source=None):
+        """
+        @param source function returning the real time
+        """
+        if ( source is None ):
+            source = timezone.now
+        self._source = source
+        self._lock = threading.Lock()
+        # The state is a tuple so that it can be replaced atomically,
+        #  which allows 'now' to be called without taking the lock.
+        # None means the clock is following the real time.
+        self._state = None
+
+    def _virtual_time(self, state, real):
+        anchorReal, anchorVirtual, speed, frozen = state
+        if ( frozen ):
+            return(anchorVirtual)
+        return( anchorVirtual + (real - anchorReal) * speed )
+
+    def now(self):
+        """
+        @return the current (virtual) time
+        """
+        state = self._state
+        real = self._source()
+        if ( state is None ):
+            return(real)
+        return( self._virtual_time(state, real) )
+
+    def _update(self, virtual=None, speed=None, frozen=None, advance=None):
+        """
+        Re-anchor the clock at the current time with new
+        parameters. Parameters that are None keep their current
+        values.
+        """
+        with self._lock:
+            real = self._source()
+            state = self._state
+            if ( state is None ):
+                state = (real, real, 1.0, False)
+
+            if ( virtual is None ):
+                virtual = self._virtual_time(state, real)
+            if ( advance is not None ):
+                virtual = virtual + advance
+            if ( speed is None ):
+                speed = state[2]
+            if ( frozen is None ):
+                frozen = state[3]
+
+            self._state = (real, virtual, speed, frozen)
+            return(virtual)
+
+    def freeze(self, at=None):
+        """
+        Stop the clock at the passed time or the current time.
+        """
+        return( self._update(virtual = at, frozen = True) )
+
+    def resume(self):
+        """
+        Start a frozen clock running again from the time that
+        it was frozen at.
+        """
+        return( self._update(frozen = False) )
+
+    def advance(self, seconds):
+        """
+        Move the clock forward.
+        @param seconds number of seconds or a timedelta object
+        """
+        if ( not isinstance(seconds, timedelta) ):
+            seconds = timedelta(seconds = seconds)
+        if ( seconds < timedelta(0) ):
+            raise ValueError("Clock can't be moved backwards: %s" % seconds)
+        return( self._update(advance = seconds) )
+
+    def set_time(self, at):
+        """
+        Set the clock to a particular time.
+        """
+        return( self._update(virtual = at) )
+
+    def set_speed(self, speed):
+        """
+        Run the clock at 'speed' times the real time.
+        """
+        speed = float(speed)
+        if ( speed <= 0.0 ):
+            raise ValueError("Invalid Clock Speed: %s" % speed)
+        return( self._update(speed = speed) )
+
+    def reset(self):
+        """
+        Return the clock to the real time.
+        """
+        with self._lock:
+            self._state = None
+
+    @property
+    def speed(self):
+        state = self._state
+        return( 1.0 if state is None else state[2] )
+
+    @property
+    def frozen(self):
+        state = self._state
+        return( False if state is None else state[3] )
+
+    def is_real_time(self):
+        return( self._state is None )
+
+    def real_seconds(self, seconds):
+        """
+        Convert a duration in virtual seconds to a duration in
+        real seconds.
+        @return number of real seconds or None if the clock is
+           frozen and the duration will never pass.
+        """
+        state = self._state
+        if ( state is None ):
+            return(seconds)
+        if ( state[3] ):
+            return(None)
+        return( seconds / state[2] )
+
+    def serialize(self):
+        return({
+            "CurrentTime" : self.now(),
+            "Frozen" : self.frozen,
+            "Speed" : self.speed,
+            "RealTime" : self.is_real_time(),
+        })
+
+# Process wide emulator clock
+clock = EmulatorClock()
+
+def now():
+    """
+    @return current time from the emulator clock
+    """
+    return( clock.now() )
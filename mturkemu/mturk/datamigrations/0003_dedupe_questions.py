@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from mturk.management.commands.DedupeQuestions import dedupe_questions
+
+
+def dedupe(apps, schema_editor):
+    """
+    Move the inline task questions to the question blob table.
+    """
+    dedupe_questions(
+        apps.get_model("mturk", "Task"),
+        apps.get_model("mturk", "QuestionBlob"),
+    )
+
+
+class Migration(migrations.Migration):
+    """
+    Data Migration that deduplicates the question XML of the
+    existing tasks.
+    """
+    dependencies = [
+        ('mturk', '0002_init_data'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe, migrations.RunPython.noop),
+    ]
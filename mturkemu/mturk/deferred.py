@@ -0,0 +1,85 @@
+# File: mturk/deferred.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a per request set of
+# deferred work. Some of the model signal handlers do follow up work
+# on every save - for example, recomputing the state of a task when
+# one of its assignments changes. When an API request saves many
+# objects, the same follow up work would be repeated for each save.
+# Instead, while a 'deferred_work' block is active, the signal
+# handlers add their work to a set keyed by the object it applies
+# to and the work is run once, at the end of the block.
+#
+# The work is run before the block exits, so when the block is
+# inside a transaction the follow up work is part of the same
+# transaction.
+#
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+
+_local = threading.local()
+
+class WorkSet(object):
+    """
+    Ordered set of deferred work items. Each item is identified by
+    a key so that work added multiple times for the same object
+    is only run once.
+    """
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.num_deferred = 0
+        self.num_run = 0
+
+    def add(self, key, func):
+        self.num_deferred += 1
+        if ( key not in self.pending ):
+            self.pending[key] = func
+
+    def run(self):
+        """
+        Run the pending work - work that is deferred while running
+        the pending work is also run before this method returns.
+        """
+        while ( len(self.pending) > 0 ):
+            key, func = self.pending.popitem(last=False)
+            self.num_run += 1
+            func()
+
+def _get_stack():
+    stack = getattr(_local, "stack", None)
+    if ( stack is None ):
+        stack = []
+        _local.stack = stack
+    return(stack)
+
+def defer(key, func):
+    """
+    Defer 'func' until the end of the active 'deferred_work' block
+    or run it immediately if there is no active block.
+    @param key hashable identifying the work, for example,
+       ("task_state", task.pk)
+    """
+    stack = _get_stack()
+    if ( len(stack) == 0 ):
+        func()
+    else:
+        stack[-1].add(key, func)
+
+@contextmanager
+def deferred_work():
+    """
+    Context manager that collects the work deferred inside the
+    block and runs it when the block completes. If the block raises
+    an exception, the deferred work is discarded.
+    """
+    stack = _get_stack()
+    workSet = WorkSet()
+    stack.append(workSet)
+    try:
+        yield workSet
+        workSet.run()
+    finally:
+        stack.pop()
@@ -0,0 +1,431 @@
+# File: mturk/extensions.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the emulator specific
+# API operations. These operations are not part of the MTurk
+# service definition - they are used to control the emulator itself
+# (for example, the emulator clock) from a test harness. They use
+# the same endpoint, request format and credentials as the MTurk
+# API but the 'X-Amz-Target' header uses the emulator's prefix:
+#
+#    X-Amz-Target: MTurkEmulator.<Operation>
+#
+# Only requesters whose user account is a staff account may call
+# the operations that control the emulator. The 'EmulatorClient'
+# class below can be used to make these requests.
+#
+
+from mturk.models import *
+from mturk.fields import *
+from mturk.errors import PermissionDenied, ValidationError, DoesNotExistError
+from mturk.clock import clock
+from mturk.cache import cache_statistics, reset_cache_statistics
+from mturk.population import eligibility_engine, RequirementSpec
+from mturk.scoring import rescore_requests, InvalidRescoreError
+from mturk.snapshot import SnapshotStore, SnapshotError
+
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+
+from datetime import datetime, timezone
+import urllib.request
+import urllib.error
+import json
+
+EXTENSION_TARGET_PREFIX = "MTurkEmulator"
+
+class EmulatorExtensions(object):
+    """
+    Handlers for the emulator specific operations. Like the
+    MTurkHandlers, the requester making the request is passed in
+    the 'EmuRequester' keyword argument.
+    """
+
+    OPERATIONS = [
+        "GetClock",
+        "UpdateClock",
+        "GetEligibleWorkers",
+        "GetCacheStatistics",
+        "RescoreQualificationRequests",
+        "ListSnapshots",
+        "SnapshotState",
+        "RestoreState",
+        "ResetState",
+    ]
+
+    # Operations that replace the database - they are not run in
+    #   the transaction of the request.
+    NON_ATOMIC_OPERATIONS = [
+        "SnapshotState",
+        "RestoreState",
+        "ResetState",
+    ]
+
+    # Operations that any requester may call - the other operations
+    #   require a staff account.
+    REQUESTER_OPERATIONS = [
+        "GetEligibleWorkers",
+        "RescoreQualificationRequests",
+    ]
+
+    # Max number of worker ids in a 'GetEligibleWorkers' response
+    MAX_WORKER_IDS = 10000
+
+    def has_operation(self, name):
+        return( name in self.OPERATIONS )
+
+    def is_atomic(self, name):
+        return( name not in self.NON_ATOMIC_OPERATIONS )
+
+    def dispatch(self, name, **kwargs):
+        """
+        Check that the requester is allowed to make the emulator
+        request and then call the handler for the operation.
+        """
+        requester = kwargs["EmuRequester"]
+        if ( not self.has_operation(name) ):
+            raise ValidationError(["Unknown Emulator Operation: %s" % name])
+        if ( name not in self.REQUESTER_OPERATIONS and
+             not requester.user.is_staff ):
+            raise PermissionDenied()
+        method = getattr(self, name)
+        return( method(**kwargs) )
+
+    def get_number(self, kwargs, name, minVal):
+        val = kwargs.get(name, None)
+        if ( val is None ):
+            return(None)
+        if ( isinstance(val, bool) or not isinstance(val, (int, float)) ):
+            raise ValidationError(["'%s' must be a number" % name])
+        if ( val < minVal ):
+            raise ValidationError(["'%s' must be >= %s" % (name, minVal)])
+        return(val)
+
+    def get_flag(self, kwargs, name):
+        val = kwargs.get(name, False)
+        if ( not isinstance(val, bool) ):
+            raise ValidationError(["'%s' must be a boolean" % name])
+        return(val)
+
+    #######################
+    # Clock Operations
+    #######################
+
+    def GetClock(self, **kwargs):
+        return({ "Clock" : clock.serialize() })
+
+    def UpdateClock(self, **kwargs):
+        """
+        Modify the emulator clock. The modifications are applied in
+        the order:
+           Reset, Time, Speed, Freeze/Resume, AdvanceSeconds
+        If 'RunScheduler' is true, then the lifecycle transitions
+        that are due at the new time are applied before the
+        response is sent.
+        """
+        reset = self.get_flag(kwargs, "Reset")
+        freeze = self.get_flag(kwargs, "Freeze")
+        resume = self.get_flag(kwargs, "Resume")
+        runScheduler = self.get_flag(kwargs, "RunScheduler")
+        timestamp = self.get_number(kwargs, "Time", 0)
+        speed = self.get_number(kwargs, "Speed", 0)
+        advance = self.get_number(kwargs, "AdvanceSeconds", 0)
+
+        if ( freeze and resume ):
+            raise ValidationError(["'Freeze' and 'Resume' are exclusive"])
+        if ( speed is not None and speed <= 0 ):
+            raise ValidationError(["'Speed' must be > 0"])
+
+        if ( reset ):
+            clock.reset()
+        if ( timestamp is not None ):
+            clock.set_time(datetime.fromtimestamp(timestamp, timezone.utc))
+        if ( speed is not None ):
+            clock.set_speed(speed)
+        if ( freeze ):
+            clock.freeze()
+        elif ( resume ):
+            clock.resume()
+        if ( advance is not None ):
+            clock.advance(advance)
+
+        resp = {}
+        # Import here to prevent a circular import with the models
+        from mturk import startup
+        if ( runScheduler ):
+            from mturk.scheduler import LifecycleScheduler
+            resp["Transitions"] = LifecycleScheduler().run_once()
+        elif ( startup.scheduler is not None ):
+            startup.scheduler.wakeup()
+
+        resp["Clock"] = clock.serialize()
+        return(resp)
+
+    def GetCacheStatistics(self, **kwargs):
+        """
+        Report the size and hit/miss/eviction counters of the
+        emulator's caches. If 'Reset' is true, the counters are
+        reset after they are reported.
+        """
+        reset = self.get_flag(kwargs, "Reset")
+        resp = { "Caches" : cache_statistics() }
+        if ( reset ):
+            reset_cache_statistics()
+        return(resp)
+
+    #######################
+    # Snapshot Operations
+    #######################
+
+    def get_snapshot_name(self, kwargs):
+        name = kwargs.get("Name", None)
+        if ( name is None ):
+            raise ValidationError(["'Name' is required"])
+        if ( not isinstance(name, str) ):
+            raise ValidationError(["'Name' must be a string"])
+        return(name)
+
+    def ListSnapshots(self, **kwargs):
+        try:
+            snapshots = SnapshotStore().list()
+        except SnapshotError as exc:
+            raise ValidationError([str(exc)])
+        return({ "Snapshots" : [ info.serialize() for info in snapshots ] })
+
+    def SnapshotState(self, **kwargs):
+        """
+        Save a snapshot of the emulator database with the passed
+        'Name', replacing the snapshot with the same name.
+        """
+        name = self.get_snapshot_name(kwargs)
+        try:
+            info = SnapshotStore().take(name)
+        except SnapshotError as exc:
+            raise ValidationError([str(exc)])
+        return({ "Snapshot" : info.serialize() })
+
+    def RestoreState(self, **kwargs):
+        """
+        Replace the emulator database with the snapshot 'Name'.
+        @note - the credential of the request must exist in the
+           snapshot for the following requests.
+        """
+        name = self.get_snapshot_name(kwargs)
+        try:
+            elapsed = SnapshotStore().restore(name)
+        except SnapshotError as exc:
+            raise ValidationError([str(exc)])
+        return({ "ElapsedSeconds" : elapsed })
+
+    def ResetState(self, **kwargs):
+        """
+        Return the emulator to its commissioned state. If 'Rebuild'
+        is true, the commissioned state is created again instead of
+        being restored from the pristine snapshot.
+        @note - all of the users other than 'mturk' are removed,
+           including the user that made the request.
+        """
+        rebuild = self.get_flag(kwargs, "Rebuild")
+        try:
+            elapsed = SnapshotStore().reset(rebuild)
+        except SnapshotError as exc:
+            raise ValidationError([str(exc)])
+        return({ "ElapsedSeconds" : elapsed, "Clock" : clock.serialize() })
+
+    #######################
+    # Eligibility Operations
+    #######################
+
+    def parse_requirements(self, qualReqs):
+        """
+        Convert the 'QualificationRequirements' argument (in the
+        same form as for CreateHITType) into requirement specs.
+        """
+        if ( not isinstance(qualReqs, list) ):
+            raise ValidationError(["'QualificationRequirements' must be a list"])
+
+        specs = []
+        for qualReq in qualReqs:
+            try:
+                compId = QualComparatorField.convert_display_to_value(
+                    qualReq["Comparator"]
+                )
+                qualId = qualReq["QualificationTypeId"]
+                intValues = tuple( int(x) for x in qualReq.get("IntegerValues", []) )
+                localeIds = []
+                for loc in qualReq.get("LocaleValues", []):
+                    localeIds.extend(
+                        Locale.objects.filter(
+                            country = loc["Country"],
+                            subdivision = loc.get("Subdivision", "")
+                        ).values_list("pk", flat=True)
+                    )
+            except Exception as exc:
+                raise ValidationError(["Invalid Qualification Requirement: %s" % exc])
+
+            try:
+                qual = Qualification.objects.get(aws_id = qualId, dispose = False)
+            except Qualification.DoesNotExist:
+                raise DoesNotExistError("QualificationType", qualId)
+
+            specs.append(
+                RequirementSpec(
+                    qual.pk, compId, intValues, tuple(sorted(localeIds))
+                )
+            )
+        return(specs)
+
+    def GetEligibleWorkers(self, **kwargs):
+        """
+        Determine how many workers meet the qualification
+        requirements of one of the requester's HIT types or of the
+        passed 'QualificationRequirements'. If 'ReturnWorkerIds' is
+        true, the ids of up to 'MaxResults' of the eligible workers
+        are also returned.
+        """
+        requester = kwargs["EmuRequester"]
+        returnIds = self.get_flag(kwargs, "ReturnWorkerIds")
+        maxResults = self.get_number(kwargs, "MaxResults", 1)
+        if ( maxResults is None ):
+            maxResults = 100
+        maxResults = min(int(maxResults), self.MAX_WORKER_IDS)
+
+        hitTypeId = kwargs.get("HITTypeId", None)
+        qualReqs = kwargs.get("QualificationRequirements", None)
+        if ( (hitTypeId is None) == (qualReqs is None) ):
+            raise ValidationError([
+                "Exactly one of 'HITTypeId' or 'QualificationRequirements' is required"
+            ])
+
+        try:
+            if ( hitTypeId is not None ):
+                try:
+                    tasktype = TaskType.objects.get(
+                        aws_id = hitTypeId,
+                        requester = requester,
+                        dispose = False
+                    )
+                except TaskType.DoesNotExist:
+                    raise DoesNotExistError("HITType", hitTypeId)
+                result = eligibility_engine.evaluate_tasktype(tasktype)
+            else:
+                result = eligibility_engine.evaluate(
+                    self.parse_requirements(qualReqs)
+                )
+        except InvalidQualRequirementError as exc:
+            raise ValidationError([str(exc)])
+
+        resp = {
+            "NumberOfWorkers" : result.num_workers,
+            "NumberOfEligibleWorkers" : result.num_eligible,
+        }
+        if ( returnIds ):
+            resp["WorkerIds"] = result.worker_ids(maxResults)
+        return(resp)
+
+    #######################
+    # Scoring Operations
+    #######################
+
+    def RescoreQualificationRequests(self, **kwargs):
+        """
+        Score the test answers of the approved requests of one of
+        the requester's qualification types with its current
+        AnswerKey and update the values of the workers' grants.
+        """
+        requester = kwargs["EmuRequester"]
+        qualId = kwargs.get("QualificationTypeId", None)
+        if ( qualId is None ):
+            raise ValidationError(["'QualificationTypeId' is required"])
+
+        try:
+            qual = Qualification.objects.get(
+                aws_id = qualId,
+                requester = requester,
+                dispose = False
+            )
+        except Qualification.DoesNotExist:
+            raise DoesNotExistError("QualificationType", qualId)
+
+        try:
+            result = rescore_requests(qual)
+        except InvalidRescoreError as exc:
+            raise ValidationError([str(exc)])
+        # The grants were updated in bulk without signals
+        eligibility_engine.invalidate_qual(qual.pk)
+
+        return({
+            "NumberOfRequests" : result.num_requests,
+            "NumberOfGrantsUpdated" : result.num_changed,
+            "NumberOfFailures" : result.num_failed,
+        })
+
+
+class EmulatorClientError(Exception):
+    def __init__(self, status, content):
+        self.status = status
+        self.content = content
+        super().__init__(
+            "Emulator Request Failed: %d: %s" % (status, content)
+        )
+
+class EmulatorClient(object):
+    """
+    Client for the emulator specific operations.
+    Example:
+        emu = EmulatorClient(url, accessKey, secretKey)
+        emu.call("UpdateClock", AdvanceSeconds = 3600, RunScheduler = True)
+    """
+
+    SIGNING_NAME = "mturk-requester"
+
+    def __init__(self, endpointUrl, accessKey, secretKey, region="us-east-1", transport=None):
+        """
+        @param transport optional 'InProcessTransport' object - by
+           default the requests are sent over HTTP.
+        """
+        self.endpoint_url = endpointUrl
+        self.credentials = Credentials(accessKey, secretKey)
+        self.region = region
+        self.transport = transport
+
+    def call(self, operation, **params):
+        """
+        @return dict decoded from the JSON response
+        """
+        data = json.dumps(params)
+        req = AWSRequest(
+            method = "POST",
+            url = self.endpoint_url,
+            data = data,
+            headers = {
+                "X-Amz-Target" : "%s.%s" % (EXTENSION_TARGET_PREFIX, operation),
+                "Content-Type" : "application/x-amz-json-1.1",
+            }
+        )
+        SigV4Auth(self.credentials, self.SIGNING_NAME, self.region).add_auth(req)
+
+        if ( self.transport is not None ):
+            status, headers, content = self.transport.send(
+                "POST", self.endpoint_url, dict(req.headers.items()),
+                data.encode("utf-8")
+            )
+            content = content.decode("utf-8")
+            if ( status >= 400 ):
+                raise EmulatorClientError(status, content)
+            return( json.loads(content) )
+
+        httpReq = urllib.request.Request(
+            self.endpoint_url,
+            data = data.encode("utf-8"),
+            headers = dict(req.headers.items()),
+            method = "POST"
+        )
+        try:
+            with urllib.request.urlopen(httpReq) as httpResp:
+                content = httpResp.read().decode("utf-8")
+        except urllib.error.HTTPError as exc:
+            raise EmulatorClientError(exc.code, exc.read().decode("utf-8"))
+        return( json.loads(content) )
@@ -7,9 +7,13 @@
 #
 
 from django.db import models
+from django.conf import settings
+
+from mturk.clock import clock
 
-import hashlib
 import base64
+import uuid
+import zlib
 
 class RemoveKeysMixin(object):
     def removeKeys(self, kwargs):
@@ -23,31 +27,130 @@ class CustomerIdField(models.CharField, RemoveKeysMixin):
     """
     AWS uses 32 character strings as the ID for
     objects in the database. This field will auto generate
-    this value when the associated model is added to its
-    table.
+    this value when the associated model is inserted into its
+    table. The column is unique and indexed because almost all
+    of the API methods look up objects by this ID.
     @note CustomerId is the nomenclature used by AWS in
     their documentation.
     """
     def __init__(self, *args, **kwargs):
         self.removeKeys(kwargs)
-        #super().__init__(max_length=64, unique=True, blank=True)
-        super().__init__(max_length=64, blank=True)
+        super().__init__(max_length=64, unique=True, blank=True)
+
+    def pre_save(self, model_instance, add):
+        """
+        Assign the ID before the object is inserted so that
+        creating an object only requires a single write.
+        Objects that were created with an explicit ID (for example,
+        the system qualifications) keep that ID.
+        """
+        value = getattr(model_instance, self.attname)
+        if ( value is None or len(value) == 0 ):
+            value = CustomerIdField.generate_id(model_instance)
+            setattr(model_instance, self.attname, value)
+        return(value)
 
     @staticmethod
     def generate_id(model_instance):
-        h = hashlib.md5()
-        content = bytearray(
-            "%s.%d" % (model_instance._meta.model_name, model_instance.id),
-            "utf-8"
-            )
-        h.update(content)
-        dig= h.digest()
-        value = base64.b32encode(dig).decode("utf-8")
+        """
+        Generate a new ID - this does not depend on the primary key
+        of the object so it can be called before the object is
+        inserted. The random content comes from the OS's random
+        source so IDs generated by separate processes will not
+        collide.
+        """
+        content = uuid.uuid4().bytes
+        value = base64.b32encode(content).decode("utf-8")
         value = value.split("=", maxsplit=1)[0]
         value = "A" + value
         return(value)
 
 
+class CreationTimeField(models.DateTimeField):
+    """
+    Timestamp of the creation of an object. This is equivalent
+    to a DateTimeField with 'auto_now_add' except that the time is
+    read from the emulator's clock.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs["editable"] = False
+        kwargs["blank"] = True
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        del kwargs["editable"]
+        del kwargs["blank"]
+        return(name, path, args, kwargs)
+
+    def pre_save(self, model_instance, add):
+        if ( add ):
+            value = clock.now()
+            setattr(model_instance, self.attname, value)
+            return(value)
+        return( super().pre_save(model_instance, add) )
+
+
+class CompressedTextField(models.TextField):
+    """
+    Text field whose large values are stored zlib compressed. The
+    compressed values are stored as base64 text with a prefix so
+    that the column is still a text column and values that were
+    stored before compression was enabled (or that are below the
+    size threshold) are read unchanged. The python value is always
+    the uncompressed string.
+    The threshold is the 'MTURK_COMPRESS_THRESHOLD' setting - the
+    min length in bytes of a value that is compressed, or None to
+    disable compression of new values.
+    """
+    PREFIX = "zlib:"
+    DEFAULT_THRESHOLD = 1024
+
+    @classmethod
+    def get_threshold(cls):
+        return(
+            getattr(settings, "MTURK_COMPRESS_THRESHOLD", cls.DEFAULT_THRESHOLD)
+        )
+
+    @classmethod
+    def compress(cls, value):
+        data = value.encode("utf-8")
+        # Raw values that look like compressed values are always
+        #   compressed so that they can't be misread.
+        isAmbiguous = value.startswith(cls.PREFIX)
+        threshold = cls.get_threshold()
+        if ( not isAmbiguous and
+             ( threshold is None or len(data) < threshold ) ):
+            return(value)
+        packed = cls.PREFIX + base64.b64encode(zlib.compress(data)).decode("ascii")
+        if ( not isAmbiguous and len(packed) >= len(data) ):
+            return(value)
+        return(packed)
+
+    @classmethod
+    def decompress(cls, value):
+        if ( value is None or not value.startswith(cls.PREFIX) ):
+            return(value)
+        packed = base64.b64decode(value[len(cls.PREFIX):])
+        return( zlib.decompress(packed).decode("utf-8") )
+
+    @classmethod
+    def is_compressed(cls, value):
+        return( value is not None and value.startswith(cls.PREFIX) )
+
+    def from_db_value(self, value, expression, connection, context):
+        return( self.decompress(value) )
+
+    def to_python(self, value):
+        return( self.decompress(super().to_python(value)) )
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if ( value is None ):
+            return(value)
+        return( self.compress(value) )
+
+
 class TaskStatusField(models.CharField, RemoveKeysMixin):
     """
     Task status
@@ -14,10 +14,12 @@ from mturk.taskviews import CreateTaskType, CreateTask, QualificationHandler
 from mturk.errors import *
 from mturk.xml.questions import QuestionValidator
 from mturk.fields import *
+from mturk.clock import clock
 from mturk.utils import get_object_or_throw
+from mturk.paging import ListPager
+from mturk.serializers import serialize_list
 
 from datetime import timedelta, datetime
-import re
 
 class MTurkHandlers(object):
 
@@ -29,51 +31,28 @@ class MTurkHandlers(object):
     #    be a DoS capable vulnerability.
     DEF_NUM_RESULTS = 10
 
-    def gen_next_token(self, offset):
+    def get_list_args(self, kwargs, orderField="created"):
         """
-        The next token in the AWS service is a string token but
-        this attempts to simplify this by just setting a offset
-        index encoded in the token string that we can parse to
-        determine the next position to respond with in a list API
-        method.
+        Create the pager for a list API method from the
+        'MaxResults' and 'NextToken' arguments.
+        @param orderField timestamp field that the list is ordered
+            by, newest first.
         """
-        return( "A%010d" % offset )
-
-    def get_offset_from_token(self, token):
-        """
-        Utility to extract the offset in a query from the next
-        token submitted in a list request.
-        """
-        tokenRegex = re.compile("A(\d+)")
-        m = tokenRegex.match(token)
-        if m:
-            offsetStr = m.group(1)
-            offset = int(offsetStr)
-            return(offset)
-        else:
-            raise ValidationError(["Invalid Next Token Format: %s" % token])
-
-    def get_list_args(self, kwargs):
         results = kwargs.get("MaxResults", MTurkHandlers.DEF_NUM_RESULTS)
-        try:
-            token = kwargs["NextToken"]
-            offset = self.get_offset_from_token(token)
-        except KeyError:
-            offset = 0
-        return(results, offset)
+        token = kwargs.get("NextToken", None)
+        return( ListPager(orderField, results, token) )
 
-    def prepare_list_response(self, name, offset, dataList, **kwargs):
+    def prepare_list_response(self, name, pager, dataList, **kwargs):
         """
-        Generate the standard list response for a set of
+        Generate the standard list response for a page of
         data items.
         """
-        cnt = dataList.count()
         resp = {
-            "NumResults" : cnt,
-            name : [ datum.serialize(**kwargs) for datum in dataList ]
+            "NumResults" : len(dataList),
+            name : serialize_list(dataList, **kwargs)
         }
-        if ( cnt > 0 ):
-            nextToken = self.gen_next_token( offset + cnt )
+        nextToken = pager.next_token(dataList)
+        if ( nextToken is not None ):
             resp["NextToken"] = nextToken
         return(resp)
 
@@ -106,8 +85,10 @@ class MTurkHandlers(object):
         if ( assign.is_approved() ):
             raise AssignmentNotSubmittedError()
 
+        fromStatus = assign.status
         assign.approve( kwargs.get("RequesterFeedback", "") )
-        assign.save()
+        if ( not assign.save_transition(fromStatus) ):
+            raise AssignmentNotSubmittedError()
 
         return({})
 
@@ -117,7 +98,7 @@ class MTurkHandlers(object):
 
         stat = kwargs.get("Status", None)
 
-        numResults,offset = self.get_list_args(kwargs)
+        pager = self.get_list_args(kwargs, "granted")
 
         q = Q( qualification__aws_id = qualId )
         q &= Q( dispose = False )
@@ -126,11 +107,9 @@ class MTurkHandlers(object):
         elif ( stat == "Revoked" ):
             q &= Q( active = False )
 
-        grants = QualificationGrant.objects.filter(q).order_by(
-            "-granted"
-        )[offset:(offset+numResults)]
+        grants = pager.page( QualificationGrant.objects.filter(q) )
 
-        resp = self.prepare_list_response("Qualifications", offset, grants)
+        resp = self.prepare_list_response("Qualifications", pager, grants)
 
         return(resp)
 
@@ -157,28 +136,28 @@ class MTurkHandlers(object):
 
         buildQuery &= selQuery
 
-        numResults,offset = self.get_list_args(kwargs)
         # @note - I'm ordering by accepted because this should always
         #   be available no matter the state of the assignment.
-        assignments = task.assignment_set.filter(
-            buildQuery
-        ).order_by("-accepted")[offset:(offset + numResults)]
+        pager = self.get_list_args(kwargs, "accepted")
+        assignments = pager.page( task.assignment_set.filter(buildQuery) )
 
-        resp = self.prepare_list_response("Assignments", offset, assignments)
+        resp = self.prepare_list_response("Assignments", pager, assignments)
 
         return(resp)
 
     def ListWorkerBlocks(self, **kwargs):
         requester = kwargs["EmuRequester"]
 
-        numResults,offset = self.get_list_args(kwargs)
+        pager = self.get_list_args(kwargs)
 
-        blocks = WorkerBlock.objects.filter(
-            requester = requester,
-            active = True
-            ).order_by("-created")[offset:(offset+numResults)]
+        blocks = pager.page(
+            WorkerBlock.objects.filter(
+                requester = requester,
+                active = True
+            )
+        )
 
-        resp = self.prepare_list_response("WorkerBlocks", offset, blocks)
+        resp = self.prepare_list_response("WorkerBlocks", pager, blocks)
         return(resp)
 
     def CreateAdditionalAssignmentsForHIT(self, **kwargs):
@@ -310,7 +289,7 @@ class MTurkHandlers(object):
         ownedByRequester = kwargs.get("MustBeOwnedByCaller", False)
         query = kwargs.get("Query", None)
 
-        numResults,offset = self.get_list_args(kwargs)
+        pager = self.get_list_args(kwargs)
 
         # Build the query
         q = Q(requestable = requestable) & Q(dispose=False)
@@ -326,11 +305,9 @@ class MTurkHandlers(object):
             q &= searchQuery
 
 
-        quals =Qualification.objects.filter(q).order_by(
-            "-created"
-        )[offset:(offset+numResults)]
+        quals = pager.page( Qualification.objects.filter(q) )
 
-        resp = self.prepare_list_response("QualificationTypes", offset, quals)
+        resp = self.prepare_list_response("QualificationTypes", pager, quals)
         return(resp)
 
     def UpdateHITReviewStatus(self, **kwargs):
@@ -413,17 +390,15 @@ class MTurkHandlers(object):
         else:
             q = Q( qualification__requester=requester )
 
-        numResults,offset = self.get_list_args(kwargs)
+        pager = self.get_list_args(kwargs)
 
         # We don't want to include quals that are idle or
         # that have already been approved/rejected
         q &= Q( state = QualReqStatusField.PENDING )
 
-        reqs = QualificationRequest.objects.filter(q).order_by(
-            "-created"
-        )[offset:(offset+numResults)]
+        reqs = pager.page( QualificationRequest.objects.filter(q) )
 
-        resp = self.prepare_list_response("QualificationRequests", offset, reqs)
+        resp = self.prepare_list_response("QualificationRequests", pager, reqs)
         return(resp)
 
     def GetHIT(self, **kwargs):
@@ -510,7 +485,8 @@ class MTurkHandlers(object):
             raise AssignmentAlreadyApprovedError()
 
         assign.reject( kwargs.get("RequesterFeedback", "") )
-        assign.save()
+        if ( not assign.save_transition(AssignmentStatusField.SUBMITTED) ):
+            raise AssignmentNotSubmittedError()
 
         return({})
 
@@ -530,7 +506,7 @@ class MTurkHandlers(object):
                 requester = requester,
             )
 
-        numResults,offset = self.get_list_args(kwargs)
+        pager = self.get_list_args(kwargs)
 
         q = Q(requester = requester) & Q(dispose=False)
         if ( taskTypeId is not None ):
@@ -541,26 +517,26 @@ class MTurkHandlers(object):
         else:
             q &= Q(status = TaskStatusField.REVIEWING)
 
-        tasks = Task.objects.filter(q).order_by(
-            "-created"
-        )[offset:(offset+numResults)]
+        tasks = pager.page( Task.objects.filter(q) )
 
         resp = self.prepare_list_response(
-            "HITs", offset, tasks, includeAnnotation=True
+            "HITs", pager, tasks, includeAnnotation=True
         )
         return(resp)
 
     def ListHITs(self, **kwargs):
         requester = kwargs["EmuRequester"]
-        numResults,offset = self.get_list_args(kwargs)
+        pager = self.get_list_args(kwargs)
 
-        tasks = Task.objects.filter(
-            requester = requester,
-            dispose=False,
-            ).order_by("-created")[offset:(offset+numResults)]
+        tasks = pager.page(
+            Task.objects.filter(
+                requester = requester,
+                dispose=False,
+            )
+        )
 
         resp = self.prepare_list_response(
-            "HITs", offset, tasks, includeAnnotation=True
+            "HITs", pager, tasks, includeAnnotation=True
         )
 
         return(resp)
@@ -580,7 +556,7 @@ class MTurkHandlers(object):
             dispose=False
         )
 
-        currTime = timezone.now()
+        currTime = clock.now()
         if ( expireTime < currTime ):
             # Immediately Expire the Task
             task.status = TaskStatusField.REVIEWABLE
@@ -771,11 +747,10 @@ class MTurkHandlers(object):
             Q( state = QualReqStatusField.IDLE) |
             Q( state = QualReqStatusField.PENDING )
         )
-        qualreqs = QualificationRequest.objects.filter( query )
-        for qualreq in qualreqs:
-            qualreq.state = QualReqStatusField.REJECTED
-            qualreq.reason = "Qualification was deleted"
-            qualreq.save()
+        QualificationRequest.objects.filter( query ).update(
+            state = QualReqStatusField.REJECTED,
+            reason = "Qualification was deleted"
+        )
 
         # Find an TaskType objects that are dependendent on this
         #    qual
@@ -784,9 +759,7 @@ class MTurkHandlers(object):
         # Dispose of the task Type - we don't delete it because
         #    there may be active Tasks that are still leveraging
         #    this task type that we want to complete.
-        for taskType in taskTypes:
-            taskType.dispose = True
-            taskType.save()
+        taskTypes.update(dispose = True)
 
         if ( not inActiveTasks ):
             qual.purge_grants()
@@ -822,7 +795,7 @@ class MTurkHandlers(object):
             #   the sandbox
             raise ValidationError(["Request must have either 'HITId' or 'AssignmentId', not both."])
 
-        numResults,offset = self.get_list_args(kwargs)
+        pager = self.get_list_args(kwargs)
 
         if ( HITId is not None ):
             # Check that the HIT is owned by the requester
@@ -838,10 +811,10 @@ class MTurkHandlers(object):
                 raise PermissionDenied()
             bonusQSet = BonusPayment.objects.filter(assignment = assignment)
 
-        respList = bonusQSet.order_by("-created")[offset:(offset+numResults)]
+        respList = pager.page( bonusQSet )
 
         resp = self.prepare_list_response(
-            "BonusPayments", offset, respList
+            "BonusPayments", pager, respList
         )
         return(resp)
 
@@ -946,16 +919,18 @@ class MTurkHandlers(object):
         #    quals from this list. Check on service.
         qual = get_object_or_throw(Qualification, aws_id=qualId)
 
-        numResults,offset = self.get_list_args(kwargs)
-        tasks = Task.objects.filter(
-            tasktype__qualifications__qualification = qual,
-            dispose=False,
-        ).order_by("-created")[offset:(offset+numResults)]
+        pager = self.get_list_args(kwargs)
+        tasks = pager.page(
+            Task.objects.filter(
+                tasktype__qualifications__qualification = qual,
+                dispose=False,
+            )
+        )
 
         includeAnnots = (qual.requester == requester)
 
         resp = self.prepare_list_response(
-            "HITs", offset, respList, includeAnnotation=includeAnnots
+            "HITs", pager, tasks, includeAnnotation=includeAnnots
         )
 
         return(resp)
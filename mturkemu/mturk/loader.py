@@ -39,7 +39,7 @@ class Loader(object):
         """
         @returns dict object containing the service schema model
         """
-        with open(service_file, "r") as f:
+        with open(service_file, "r", encoding="utf-8") as f:
             content = f.read()
             service = json.loads(content)
             # Check for a valide service model
@@ -0,0 +1,255 @@
+# File: BenchmarkAccept.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a command that
+# measures the throughput of workers accepting assignments when
+# many workers race for the slots of one HIT group. Each simulated
+# worker runs in its own thread with its own database connection
+# and works through the tasks of the group until it gets an
+# assignment or the group is full. At the end, the assignments of
+# each task are counted to check that no task was overbooked.
+#
+# The benchmark objects (users, HIT type and tasks) are created
+# when the command starts and are deleted when it completes unless
+# the '--keep' option is passed.
+#
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection, OperationalError
+
+from mturk.models import *
+from mturk.fields import *
+from mturk.clock import clock
+from mturk.worker.TasksActor import TasksActor, TaskNotAvailableError
+
+from datetime import timedelta
+from decimal import Decimal
+import threading
+import time
+import uuid
+
+import logging
+logger = logging.getLogger("mturk")
+
+class AcceptBenchmark(object):
+    """
+    Race 'numWorkers' threads for the 'numTasks' * 'maxAssigns'
+    assignment slots of one HIT group.
+    """
+
+    # Max number of times an accept is retried when the database
+    #   reports that it is locked (sqlite only allows one writer)
+    MAX_RETRIES = 50
+
+    def __init__(self, numWorkers, numTasks, maxAssigns):
+        self.num_workers = numWorkers
+        self.num_tasks = numTasks
+        self.max_assigns = maxAssigns
+        self.prefix = "bench-%s" % uuid.uuid4().hex[0:8]
+
+        self.requester_user = None
+        self.tasktype = None
+        self.tasks = []
+        self.workers = []
+
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.num_accepted = 0
+        self.num_full = 0
+        self.num_retries = 0
+        self.num_errors = 0
+
+    def setup(self):
+        reqUser = User.objects.create_user(
+            username = "%s-requester" % self.prefix
+        )
+        self.requester_user = reqUser
+        requester = Requester.objects.get(user = reqUser)
+
+        self.tasktype = TaskType.objects.create(
+            requester = requester,
+            assignment_duration = timedelta(hours=1),
+            reward = Decimal("0.01"),
+            title = "Accept Benchmark",
+            description = "Workers racing for assignments",
+        )
+        expires = clock.now() + timedelta(days=1)
+        for i in range(0, self.num_tasks):
+            self.tasks.append(
+                Task.objects.create(
+                    requester = requester,
+                    tasktype = self.tasktype,
+                    max_assignments = self.max_assigns,
+                    expires = expires,
+                )
+            )
+
+        for i in range(0, self.num_workers):
+            user = User.objects.create_user(
+                username = "%s-worker%d" % (self.prefix, i)
+            )
+            self.workers.append(Worker.objects.get(user = user))
+
+    def cleanup(self):
+        # Deleting the requester removes the tasks and their
+        #   assignments so the workers can then be removed.
+        if ( self.requester_user is not None ):
+            self.requester_user.delete()
+        User.objects.filter(
+            pk__in = [ worker.user_id for worker in self.workers ]
+        ).delete()
+
+    def accept(self, actor, taskId):
+        """
+        Attempt to accept an assignment for a task.
+        @return True if the assignment was accepted or False if
+           the task is full.
+        """
+        for attempt in range(0, self.MAX_RETRIES):
+            try:
+                task = Task.objects.get(pk = taskId)
+                actor.accept_task(task)
+                return(True)
+            except TaskNotAvailableError:
+                return(False)
+            except OperationalError:
+                with self._lock:
+                    self.num_retries += 1
+                time.sleep(0.001 * (attempt + 1))
+        raise Exception("Accept Retry Limit Exceeded")
+
+    def run_worker(self, worker, barrier):
+        actor = TasksActor(worker)
+        taskIds = [ task.pk for task in self.tasks ]
+        try:
+            barrier.wait()
+            for taskId in taskIds:
+                start = time.perf_counter()
+                accepted = self.accept(actor, taskId)
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.latencies.append(elapsed)
+                    if ( accepted ):
+                        self.num_accepted += 1
+                    else:
+                        self.num_full += 1
+                if ( accepted ):
+                    break
+        except Exception:
+            logger.exception("Benchmark Worker Failed")
+            with self._lock:
+                self.num_errors += 1
+        finally:
+            connection.close()
+
+    def run(self):
+        """
+        @return elapsed time in seconds
+        """
+        barrier = threading.Barrier(self.num_workers + 1)
+        threads = [
+            threading.Thread(target = self.run_worker, args = (worker, barrier))
+            for worker in self.workers
+        ]
+        for thread in threads:
+            thread.start()
+
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return( time.perf_counter() - start )
+
+    def check_tasks(self):
+        """
+        @return tuple of the number of overbooked tasks and the
+           number of tasks whose counters don't match the
+           assignment table.
+        """
+        overbooked = 0
+        drifted = 0
+        for task in Task.objects.filter(pk__in = [t.pk for t in self.tasks]):
+            count = task.assignment_set.filter(dispose = False).count()
+            if ( count > task.max_assignments ):
+                overbooked += 1
+            if ( len(task.reconcile_counters(fix = False)) > 0 ):
+                drifted += 1
+        return(overbooked, drifted)
+
+    def percentile(self, p):
+        if ( len(self.latencies) == 0 ):
+            return(0.0)
+        values = sorted(self.latencies)
+        index = min(int(len(values) * p), len(values) - 1)
+        return(values[index])
+
+
+class Command(BaseCommand):
+    """
+    Benchmark concurrent assignment accepts
+    """
+    help="Measure the accept throughput of many workers racing for the assignments of one HIT group and check that no task is overbooked."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=100,
+            help="Number of concurrent worker threads"
+        )
+        parser.add_argument(
+            "--tasks", type=int, default=5,
+            help="Number of tasks in the HIT group"
+        )
+        parser.add_argument(
+            "--assignments", type=int, default=10,
+            help="Max assignments of each task"
+        )
+        parser.add_argument(
+            "--keep", action="store_true", default=False,
+            help="Don't delete the benchmark objects when complete"
+        )
+
+    def handle(self, *args, **options):
+        for name in ["workers", "tasks", "assignments"]:
+            if ( options[name] <= 0 ):
+                raise CommandError("Invalid %s: %d" % (name, options[name]))
+
+        bench = AcceptBenchmark(
+            options["workers"], options["tasks"], options["assignments"]
+        )
+        try:
+            bench.setup()
+            elapsed = bench.run()
+            overbooked, drifted = bench.check_tasks()
+        finally:
+            if ( not options["keep"] ):
+                bench.cleanup()
+
+        numSlots = options["tasks"] * options["assignments"]
+        numAttempts = len(bench.latencies)
+        self.stdout.write(
+            "Workers: %d Slots: %d Accepted: %d Full: %d Retries: %d Errors: %d" % (
+                bench.num_workers, numSlots, bench.num_accepted,
+                bench.num_full, bench.num_retries, bench.num_errors
+            )
+        )
+        self.stdout.write(
+            "Elapsed: %.3fs Accepts/sec: %.1f Attempts/sec: %.1f" % (
+                elapsed,
+                bench.num_accepted / elapsed if elapsed > 0 else 0.0,
+                numAttempts / elapsed if elapsed > 0 else 0.0,
+            )
+        )
+        self.stdout.write(
+            "Latency p50: %.2fms p95: %.2fms max: %.2fms" % (
+                bench.percentile(0.50) * 1000,
+                bench.percentile(0.95) * 1000,
+                bench.percentile(1.0) * 1000,
+            )
+        )
+        self.stdout.write(
+            "Overbooked Tasks: %d Drifted Tasks: %d" % (overbooked, drifted)
+        )
+        if ( overbooked > 0 or drifted > 0 ):
+            raise CommandError("Task Slots were Overbooked")
@@ -0,0 +1,176 @@
+# File: BenchmarkStorage.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a command that
+# compares the write, read and serialize latency and the stored
+# size of qualification tests and answer keys with raw storage and
+# with compressed storage (see 'CompressedTextField'). The same
+# generated payloads are written in both modes. The benchmark
+# objects are deleted when the command completes.
+#
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import override_settings
+
+from mturk.models import *
+from mturk.fields import *
+
+from datetime import timedelta
+import random
+import time
+import uuid
+
+# Words for the generated free text answers
+WORDS = [
+    "the", "image", "shows", "a", "red", "blue", "car", "house", "tree",
+    "person", "walking", "near", "street", "with", "two", "dogs", "on",
+    "sunny", "day", "and", "some", "clouds", "in", "background",
+]
+
+def generate_payload(rng, size):
+    """
+    Generate QuestionFormAnswers like XML of about 'size' bytes.
+    """
+    parts = ["<QuestionFormAnswers>"]
+    length = len(parts[0])
+    quesId = 0
+    while ( length < size ):
+        text = " ".join( rng.choice(WORDS) for i in range(0, 20) )
+        part = (
+            "<Answer><QuestionIdentifier>q%d</QuestionIdentifier>"
+            "<FreeText>%s</FreeText></Answer>" % (quesId, text)
+        )
+        parts.append(part)
+        length += len(part)
+        quesId += 1
+    parts.append("</QuestionFormAnswers>")
+    return( "".join(parts) )
+
+
+class StorageBenchmark(object):
+    """
+    Time the storage of 'numObjects' qualifications with payloads
+    of 'size' bytes.
+    """
+    def __init__(self, numObjects, size):
+        self.num_objects = numObjects
+        self.size = size
+        self.prefix = "bench-%s" % uuid.uuid4().hex[0:8]
+        self.requester_user = None
+        self.requester = None
+
+        rng = random.Random(1)
+        self.payloads = [
+            generate_payload(rng, size) for i in range(0, numObjects)
+        ]
+
+    def setup(self):
+        self.requester_user = User.objects.create_user(
+            username = "%s-requester" % self.prefix
+        )
+        self.requester = Requester.objects.get(user = self.requester_user)
+
+    def cleanup(self):
+        if ( self.requester_user is not None ):
+            self.requester_user.delete()
+
+    def stored_bytes(self, pks):
+        table = Qualification._meta.db_table
+        sql = "SELECT %s, %s FROM %s WHERE id IN (%s)" % (
+            Qualification._meta.get_field("test").column,
+            Qualification._meta.get_field("answer").column,
+            table, ",".join( str(pk) for pk in pks )
+        )
+        total = 0
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            for test, answer in cursor.fetchall():
+                total += len(test.encode("utf-8")) + len(answer.encode("utf-8"))
+        return(total)
+
+    def run_mode(self, threshold):
+        """
+        @return dict of the per object write, read and serialize
+           times in seconds and the stored size in bytes.
+        """
+        with override_settings(MTURK_COMPRESS_THRESHOLD = threshold):
+            start = time.perf_counter()
+            pks = []
+            for i, payload in enumerate(self.payloads):
+                qual = Qualification.objects.create(
+                    requester = self.requester,
+                    name = "%s-%d-%s" % (self.prefix, i, threshold),
+                    description = "Storage Benchmark",
+                    test = payload,
+                    test_duration = timedelta(minutes=10),
+                    answer = payload,
+                )
+                pks.append(qual.pk)
+            writeTime = time.perf_counter() - start
+
+            start = time.perf_counter()
+            quals = list(Qualification.objects.filter(pk__in = pks))
+            total = sum( len(q.test) + len(q.answer) for q in quals )
+            readTime = time.perf_counter() - start
+            if ( total != 2 * sum( len(p) for p in self.payloads ) ):
+                raise CommandError("Read Payloads do not Match")
+
+            start = time.perf_counter()
+            for qual in quals:
+                qual.serialize()
+            serializeTime = time.perf_counter() - start
+
+            stored = self.stored_bytes(pks)
+            Qualification.objects.filter(pk__in = pks).delete()
+
+        n = float(self.num_objects)
+        return({
+            "write" : writeTime / n,
+            "read" : readTime / n,
+            "serialize" : serializeTime / n,
+            "stored" : stored,
+        })
+
+
+class Command(BaseCommand):
+    """
+    Benchmark compressed payload storage
+    """
+    help="Compare the write, read and serialize latency and the stored size of large qualification tests and answer keys with raw and compressed storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--objects", type=int, default=200,
+            help="Number of qualifications written in each mode"
+        )
+        parser.add_argument(
+            "--size", type=int, default=16384,
+            help="Size in bytes of each generated payload"
+        )
+
+    def handle(self, *args, **options):
+        for name in ["objects", "size"]:
+            if ( options[name] <= 0 ):
+                raise CommandError("Invalid %s: %d" % (name, options[name]))
+
+        bench = StorageBenchmark(options["objects"], options["size"])
+        modes = [
+            ("Raw", None),
+            ("Compressed", CompressedTextField.get_threshold() or
+             CompressedTextField.DEFAULT_THRESHOLD),
+        ]
+        try:
+            bench.setup()
+            for label, threshold in modes:
+                res = bench.run_mode(threshold)
+                self.stdout.write(
+                    "%s: Write: %.3fms Read: %.3fms Serialize: %.3fms Stored: %d bytes" % (
+                        label, res["write"] * 1000, res["read"] * 1000,
+                        res["serialize"] * 1000, res["stored"]
+                    )
+                )
+        finally:
+            bench.cleanup()
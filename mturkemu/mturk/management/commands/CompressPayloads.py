@@ -0,0 +1,112 @@
+# File: CompressPayloads.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a command to rewrite
+# the stored values of the compressed text fields so that they
+# match the current 'MTURK_COMPRESS_THRESHOLD' setting. Values
+# stored before compression was enabled are read correctly without
+# this command, but they only shrink when they are rewritten. To
+# go back to raw storage, set the threshold to None and run the
+# command again.
+#
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from mturk.models import Qualification, QualificationRequest, Assignment
+
+import logging
+logger = logging.getLogger("mturk")
+
+# Model fields whose values are stored with 'CompressedTextField'
+COMPRESSED_FIELDS = [
+    (Qualification, "test"),
+    (Qualification, "answer"),
+    (QualificationRequest, "answer"),
+    (Assignment, "answer"),
+]
+
+class FieldRewrite(object):
+    """
+    Rewrite the stored values of one compressed field.
+    """
+    def __init__(self, model, name):
+        self.model = model
+        self.field = model._meta.get_field(name)
+        self.num_rows = 0
+        self.num_rewritten = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    @property
+    def label(self):
+        return( "%s.%s" % (self.model.__name__, self.field.name) )
+
+    def stored_rows(self, lastPk, batchSize):
+        """
+        Read the stored (not decompressed) values of a batch of rows.
+        """
+        sql = "SELECT %s, %s FROM %s WHERE %s > %%s ORDER BY %s LIMIT %d" % (
+            self.model._meta.pk.column, self.field.column,
+            self.model._meta.db_table,
+            self.model._meta.pk.column, self.model._meta.pk.column,
+            batchSize
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [lastPk])
+            return( cursor.fetchall() )
+
+    def run(self, batchSize, dryRun=False):
+        lastPk = 0
+        while ( True ):
+            rows = self.stored_rows(lastPk, batchSize)
+            if ( len(rows) == 0 ):
+                break
+            with transaction.atomic():
+                for pk, stored in rows:
+                    lastPk = pk
+                    self.num_rows += 1
+                    value = self.field.decompress(stored)
+                    newStored = self.field.get_prep_value(value)
+                    self.bytes_before += len(stored.encode("utf-8"))
+                    self.bytes_after += len(newStored.encode("utf-8"))
+                    if ( newStored == stored ):
+                        continue
+                    self.num_rewritten += 1
+                    if ( not dryRun ):
+                        self.model.objects.filter(pk = pk).update(
+                            **{ self.field.name : value }
+                        )
+
+
+class Command(BaseCommand):
+    """
+    Rewrite Compressed Payloads
+    """
+    help="Rewrite the stored qualification tests, answer keys and answers so that they are compressed (or not) according to the current MTURK_COMPRESS_THRESHOLD setting."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of rows rewritten in each transaction"
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", default=False,
+            help="Report the rows that would be rewritten without writing them"
+        )
+
+    def handle(self, *args, **options):
+        batchSize = options["batch_size"]
+        if ( batchSize <= 0 ):
+            raise CommandError("Invalid batch size: %d" % batchSize)
+
+        for model, name in COMPRESSED_FIELDS:
+            rewrite = FieldRewrite(model, name)
+            rewrite.run(batchSize, options["dry_run"])
+            self.stdout.write(
+                "%s: Rows: %d Rewritten: %d Bytes: %d -> %d" % (
+                    rewrite.label, rewrite.num_rows, rewrite.num_rewritten,
+                    rewrite.bytes_before, rewrite.bytes_after
+                )
+            )
@@ -0,0 +1,114 @@
+# File: DedupeQuestions.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a command to move the
+# question XML that is stored inline in task rows to the content
+# addressed QuestionBlob table, so that tasks with the same question
+# share one copy of the content. This is also run by a data
+# migration to convert an existing database.
+#
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from mturk.models import Task as db_Task, QuestionBlob as db_QuestionBlob
+from mturk.xml.questions import content_digest
+
+import logging
+logger = logging.getLogger("mturk")
+
+
+class DedupeResult(object):
+    def __init__(self):
+        self.num_tasks = 0
+        self.num_blobs = 0
+        # Bytes of the inline question content that was moved
+        self.inline_bytes = 0
+        # Bytes of the new blobs that were created
+        self.blob_bytes = 0
+
+    @property
+    def bytes_saved(self):
+        return( self.inline_bytes - self.blob_bytes )
+
+
+def dedupe_questions(Task, QuestionBlob, batchSize=500):
+    """
+    General purpose method for moving the inline questions of the
+    tasks to the blob table. The model classes are passed so that
+    this can be used from a data migration.
+    @return DedupeResult object
+    """
+    result = DedupeResult()
+    pending = Task.objects.exclude(question_inline = "").order_by("pk")
+
+    while ( True ):
+        batch = list(pending.values_list("pk", "question_inline")[0:batchSize])
+        if ( len(batch) == 0 ):
+            break
+
+        # Group the tasks of the batch by their content so that
+        #   each distinct question is one update.
+        groups = {}
+        for pk, content in batch:
+            digest, size = content_digest(content)
+            entry = groups.setdefault(digest, (content, size, []))
+            entry[2].append(pk)
+
+        with transaction.atomic():
+            for digest, (content, size, pks) in groups.items():
+                blob, created = QuestionBlob.objects.get_or_create(
+                    digest = digest,
+                    defaults = { "content" : content, "size" : size }
+                )
+                if ( created ):
+                    result.num_blobs += 1
+                    result.blob_bytes += size
+                result.num_tasks += len(pks)
+                result.inline_bytes += size * len(pks)
+
+                Task.objects.filter(pk__in = pks).update(
+                    question_blob = blob, question_inline = ""
+                )
+
+    logger.info(
+        "Moved %d Task Questions to %d New Blobs: %d Bytes Saved" % (
+            result.num_tasks, result.num_blobs, result.bytes_saved
+        )
+    )
+    return(result)
+
+
+class Command(BaseCommand):
+    """
+    Deduplicate Task Questions
+    """
+    help="Move the question XML stored inline in the task rows to the content addressed question blob table and report the bytes saved."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of tasks converted in each transaction"
+        )
+        parser.add_argument(
+            "--purge", action="store_true", default=False,
+            help="Delete the blobs that are not referenced by any task"
+        )
+
+    def handle(self, *args, **options):
+        batchSize = options["batch_size"]
+        if ( batchSize <= 0 ):
+            raise CommandError("Invalid batch size: %d" % batchSize)
+
+        result = dedupe_questions(db_Task, db_QuestionBlob, batchSize)
+        self.stdout.write(
+            "Tasks: %d New Blobs: %d Inline Bytes: %d Bytes Saved: %d" % (
+                result.num_tasks, result.num_blobs,
+                result.inline_bytes, result.bytes_saved
+            )
+        )
+
+        if ( options["purge"] ):
+            numPurged = db_QuestionBlob.purge_unused()
+            self.stdout.write("Purged %d Unused Blobs" % numPurged)
@@ -0,0 +1,82 @@
+# File: EmuSnapshot.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a command that manages
+# the named snapshots of the emulator database:
+#
+#    manage.py EmuSnapshot take <name>
+#    manage.py EmuSnapshot restore <name>
+#    manage.py EmuSnapshot delete <name>
+#    manage.py EmuSnapshot list
+#    manage.py EmuSnapshot reset [--rebuild]
+#
+# The 'reset' action returns the database to the commissioned
+# state - see 'mturk/snapshot.py'.
+#
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mturk.snapshot import SnapshotStore, SnapshotError
+
+class Command(BaseCommand):
+    """
+    Emulator Snapshots
+    """
+    help="Take, restore, delete or list named snapshots of the emulator database, or reset the database to its commissioned state."
+
+    ACTIONS = ["take", "restore", "delete", "list", "reset"]
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "action", choices=self.ACTIONS,
+            help="Snapshot action"
+        )
+        parser.add_argument(
+            "name", nargs="?", default=None,
+            help="Name of the snapshot"
+        )
+        parser.add_argument(
+            "--dir", default=None,
+            help="Snapshot directory - defaults to 'MTURK_SNAPSHOT_DIR'"
+        )
+        parser.add_argument(
+            "--rebuild", action="store_true", default=False,
+            help="Rebuild the pristine snapshot when resetting"
+        )
+
+    def handle(self, *args, **options):
+        action = options["action"]
+        name = options["name"]
+        if ( action in ["take", "restore", "delete"] and name is None ):
+            raise CommandError("A snapshot name is required to %s" % action)
+
+        store = SnapshotStore(options["dir"])
+        try:
+            if ( action == "take" ):
+                info = store.take(name)
+                self.stdout.write(
+                    "Took Snapshot: %s Size: %d" % (info.name, info.size)
+                )
+            elif ( action == "restore" ):
+                elapsed = store.restore(name)
+                self.stdout.write(
+                    "Restored Snapshot: %s in %.1fms" % (name, elapsed * 1000)
+                )
+            elif ( action == "delete" ):
+                store.delete(name)
+                self.stdout.write("Deleted Snapshot: %s" % name)
+            elif ( action == "list" ):
+                for info in store.list():
+                    self.stdout.write(
+                        "%-32s %12d %s" % (
+                            info.name, info.size, info.created.isoformat()
+                        )
+                    )
+            else:
+                elapsed = store.reset(options["rebuild"])
+                self.stdout.write(
+                    "Reset to Commissioned State in %.1fms" % (elapsed * 1000)
+                )
+        except SnapshotError as exc:
+            raise CommandError(str(exc))
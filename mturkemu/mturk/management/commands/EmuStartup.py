@@ -0,0 +1,81 @@
+# File: EmuStartup.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a command that loads
+# the process wide state of the emulator (the service model and the
+# compiled XML schemas) and reports how long it took. With the
+# '--profile' option, the startup of a server process is timed step
+# by step in a new interpreter so that the cost of the imports is
+# included in the report.
+#
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from mturk.startup import warmup
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+class Command(BaseCommand):
+    """
+    Emulator Startup
+    """
+    help="Load the service model and compile the XML schemas and report the time taken. Use '--profile' to break down the import and initialization cost of a new server process."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profile", action="store_true", default=False,
+            help="Time each step of the startup of a new process"
+        )
+
+    def handle(self, *args, **options):
+        if ( options["profile"] ):
+            self.profile()
+            return
+
+        start = time.perf_counter()
+        warmup()
+        self.stdout.write(
+            "Startup Complete: %.1fms" % ((time.perf_counter() - start) * 1000)
+        )
+
+    def profile(self):
+        env = dict(os.environ)
+        env["DJANGO_SETTINGS_MODULE"] = os.environ.get(
+            "DJANGO_SETTINGS_MODULE", "mturkemu.settings"
+        )
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [
+                sys.executable, "-c",
+                "from mturk.startup import main_profile; main_profile()"
+            ],
+            cwd = settings.BASE_DIR,
+            env = env,
+            stdout = subprocess.PIPE,
+            stderr = subprocess.PIPE,
+        )
+        total = time.perf_counter() - start
+        if ( proc.returncode != 0 ):
+            raise CommandError(
+                "Startup Profile Failed: %s" % proc.stderr.decode("utf-8")
+            )
+
+        # The timings are the last line of the output
+        lines = proc.stdout.decode("utf-8").strip().splitlines()
+        timings = json.loads(lines[-1])
+        other = total - sum( seconds for name, seconds in timings )
+        timings.append( ("interpreter and other", other) )
+
+        for name, seconds in timings:
+            self.stdout.write(
+                "%-40s %9.1fms %5.1f%%" % (
+                    name, seconds * 1000, 100.0 * seconds / total
+                )
+            )
+        self.stdout.write("%-40s %9.1fms" % ("Total", total * 1000))
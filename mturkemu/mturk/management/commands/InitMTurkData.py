@@ -13,7 +13,6 @@ from django.contrib.auth.models import User as db_User
 from mturk.models import Worker as db_Worker, Requester as db_Requester, Qualification as db_Qualification, Locale as db_Locale
 from mturk.models import SystemQualType
 
-import time
 import logging
 logger = logging.getLogger("mturk")
 
@@ -39,19 +38,28 @@ def create_initial_data(User, Worker, Requester, Qualification, Locale):
 
 
     # MTurk System will not be allowed to be a worker
-    worker = None
-    while ( True ):
-        try:
-            worker = Worker.objects.get(user__username = "mturk")
-            break
-        except Worker.DoesNotExist:
-            time.sleep(1)
+    # @note - the worker and requester are normally created by the
+    #    user's post_save signal (see 'mturk/user.py') but that
+    #    signal is not sent when the user is created with the
+    #    historical models of a migration, so create them here if
+    #    they are missing.
+    try:
+        worker = Worker.objects.get(user__username = "mturk")
+    except Worker.DoesNotExist:
+        worker = Worker.objects.create(user_id = mturk.pk)
 
     worker.active = False
     worker.save()
 
     # Find the MTurk Requester
-    requester = Requester.objects.get(user = mturk)
+    try:
+        requester = Requester.objects.get(user__username = "mturk")
+    except Requester.DoesNotExist:
+        requester = Requester.objects.create(
+            user_id = mturk.pk,
+            name = "MTurk Emulator",
+            balance = 10000.0
+        )
 
     # Now Let's Create the System Qualification Types
 
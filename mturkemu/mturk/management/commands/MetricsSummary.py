@@ -0,0 +1,75 @@
+# File: MetricsSummary.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a command that fetches
+# the per operation API metrics from a running emulator server and
+# summarizes them - see 'mturk/metrics.py'. The metrics are kept in
+# the memory of the server process, so they are requested from the
+# server's '/metrics' endpoint.
+#
+
+from django.core.management.base import BaseCommand, CommandError
+
+import json
+import urllib.error
+import urllib.request
+
+class Command(BaseCommand):
+    """
+    API Metrics Summary
+    """
+    help="Summarize the per operation request counts, errors, latencies and SQL query counts of a running emulator server."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url", default="http://127.0.0.1:8000/metrics",
+            help="URL of the server's metrics endpoint"
+        )
+        parser.add_argument(
+            "--json", action="store_true", default=False,
+            help="Write the summary as JSON"
+        )
+        parser.add_argument(
+            "--reset", action="store_true", default=False,
+            help="Reset the server's metrics after they are summarized"
+        )
+
+    def request(self, url, data=None):
+        try:
+            with urllib.request.urlopen(url, data=data) as resp:
+                return( json.loads(resp.read().decode("utf-8")) )
+        except (urllib.error.URLError, ValueError) as exc:
+            raise CommandError("Metrics Request Failed: %s" % str(exc))
+
+    def handle(self, *args, **options):
+        url = options["url"]
+        summary = self.request(url + "?format=json")
+        if ( options["reset"] ):
+            self.request(url, data=b"")
+
+        if ( options["json"] ):
+            self.stdout.write(json.dumps(summary, indent=2, sort_keys=True))
+            return
+
+        self.stdout.write(
+            "%-32s %8s %7s %10s %10s %10s %10s %9s" % (
+                "Operation", "Requests", "Errors", "mean ms", "p95 ms",
+                "handler ms", "db ms", "queries"
+            )
+        )
+        for name, op in sorted(summary["Operations"].items()):
+            seconds = op["Seconds"]
+            requests = op["Requests"]
+            self.stdout.write(
+                "%-32s %8d %7d %10.2f %10.2f %10.2f %10.2f %9.1f" % (
+                    name, requests, sum(op["Errors"].values()),
+                    seconds["total"]["Mean"] * 1000,
+                    seconds["total"]["P95"] * 1000,
+                    seconds["handler"]["Mean"] * 1000,
+                    seconds["db"]["Mean"] * 1000,
+                    op["Queries"] / requests if requests > 0 else 0.0,
+                )
+            )
+            for errorType, count in sorted(op["Errors"].items()):
+                self.stdout.write("    %-28s %8d" % (errorType, count))
@@ -0,0 +1,66 @@
+# File: ReconcileTaskCounters.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a command to check
+# the denormalized assignment counters of each task against the
+# assignment table, and optionally repair any counters that have
+# drifted.
+#
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mturk.models import Task
+
+import logging
+logger = logging.getLogger("mturk")
+
+class Command(BaseCommand):
+    """
+    Reconcile the Task assignment counters
+    """
+    help="Check the pending/submitted/completed assignment counters of each task against the assignments in the database and optionally fix them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix", action="store_true", default=False,
+            help="Replace counters that have drifted with the counted values"
+        )
+        parser.add_argument(
+            "--task", type=str, default=None,
+            help="Only check the task with this HIT Id"
+        )
+
+    def handle(self, *args, **options):
+        fix = options["fix"]
+
+        tasks = Task.objects.all().order_by("pk")
+        if ( options["task"] is not None ):
+            tasks = tasks.filter(aws_id = options["task"])
+            if ( not tasks.exists() ):
+                raise CommandError("No Task with Id: %s" % options["task"])
+
+        numChecked = 0
+        numDrifted = 0
+        for task in tasks.iterator():
+            numChecked += 1
+            drift = task.reconcile_counters(fix = fix)
+            if ( len(drift) == 0 ):
+                continue
+
+            numDrifted += 1
+            for name, (stored, counted) in sorted(drift.items()):
+                self.stdout.write(
+                    "%s: %s stored=%d counted=%d" % (
+                        task.aws_id, name, stored, counted
+                    )
+                )
+            if ( fix ):
+                task.check_state_change()
+
+        action = "Repaired" if fix else "Found"
+        self.stdout.write(
+            "Checked %d Tasks: %s %d with Drifted Counters" % (
+                numChecked, action, numDrifted
+            )
+        )
@@ -0,0 +1,54 @@
+# File: RunScheduler.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a command to run the
+# lifecycle scheduler as a separate process from the server.
+#
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mturk.scheduler import LifecycleScheduler
+
+import logging
+logger = logging.getLogger("mturk")
+
+class Command(BaseCommand):
+    """
+    Run the Lifecycle Scheduler
+    """
+    help="Apply HIT expiration, assignment abandonment and auto approval as these events come due."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", default=False,
+            help="Apply the transitions that are due now and then exit"
+        )
+        parser.add_argument(
+            "--interval", type=float,
+            default=getattr(settings, "MTURK_SCHEDULER_INTERVAL", 5),
+            help="Max number of seconds between scheduler runs"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=None,
+            help="Max number of objects transitioned per transaction"
+        )
+
+    def handle(self, *args, **options):
+        if ( options["interval"] <= 0 ):
+            raise CommandError("Invalid Interval: %s" % options["interval"])
+
+        scheduler = LifecycleScheduler(batchSize = options["batch_size"])
+
+        if ( options["once"] ):
+            stats = scheduler.run_once()
+            for name, count in sorted(stats.items()):
+                self.stdout.write("%s: %d" % (name, count))
+            return
+
+        self.stdout.write("Running Lifecycle Scheduler - Ctrl-C to Stop")
+        try:
+            scheduler.run_forever(options["interval"])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,157 @@
+# File: RunSwarm.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a command that runs a
+# swarm of simulated workers against the HITs in the emulator and
+# reports the throughput and latency of each worker operation - see
+# 'mturk/swarm.py'. The profiles of the workers can be loaded from a
+# JSON file that contains a list of profiles in the format of
+# 'WorkerProfile.from_dict'.
+#
+# The swarm's workers are kept when the command completes so that
+# the requester can review their assignments, unless the
+# '--cleanup' option is passed.
+#
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mturk.swarm import *
+
+import json
+
+class Command(BaseCommand):
+    """
+    Simulated Worker Swarm
+    """
+    help="Run a swarm of simulated workers that accept, return, abandon and submit the assignments of the HITs in the emulator and report the throughput of each operation."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=10,
+            help="Number of virtual workers"
+        )
+        parser.add_argument(
+            "--profiles", default=None,
+            help="JSON file with a list of worker profiles"
+        )
+        parser.add_argument(
+            "--arrival", default="0",
+            help="Distribution of the real seconds between worker arrivals, for example 'exp:0.5'"
+        )
+        parser.add_argument(
+            "--work-time", default="0",
+            help="Distribution of the emulator seconds spent on an assignment, for example 'uniform:30,120'"
+        )
+        parser.add_argument(
+            "--think-time", default="0",
+            help="Distribution of the emulator seconds between assignments"
+        )
+        parser.add_argument(
+            "--duration", type=float, default=None,
+            help="Max number of seconds to run"
+        )
+        parser.add_argument(
+            "--max-tasks", type=int, default=None,
+            help="Max number of assignments accepted by each worker"
+        )
+        parser.add_argument(
+            "--wait-when-idle", action="store_true", default=False,
+            help="Workers wait for new HITs instead of stopping when there are none"
+        )
+        parser.add_argument(
+            "--idle-interval", type=float, default=1.0,
+            help="Seconds between checks for new HITs by an idle worker"
+        )
+        parser.add_argument(
+            "--hit-type", action="append", default=None,
+            help="Only work on the HITs of this HIT type id (repeatable)"
+        )
+        parser.add_argument(
+            "--processes", type=int, default=None,
+            help="Split the workers across this many processes instead of running them in threads"
+        )
+        parser.add_argument(
+            "--seed", type=int, default=None,
+            help="Random seed"
+        )
+        parser.add_argument(
+            "--cleanup", action="store_true", default=False,
+            help="Delete the workers and their assignments when complete"
+        )
+        parser.add_argument(
+            "--json", action="store_true", default=False,
+            help="Write the report as JSON"
+        )
+
+    def load_profiles(self, path):
+        if ( path is None ):
+            return(None)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            return( [ WorkerProfile.from_dict(entry) for entry in data ] )
+        except (OSError, ValueError, TypeError, AttributeError) as exc:
+            raise CommandError("Invalid Profiles File: %s" % str(exc))
+
+    def handle(self, *args, **options):
+        try:
+            config = SwarmConfig(
+                options["workers"],
+                profiles = self.load_profiles(options["profiles"]),
+                arrival = parse_distribution(options["arrival"]),
+                workTime = parse_distribution(options["work_time"]),
+                thinkTime = parse_distribution(options["think_time"]),
+                duration = options["duration"],
+                maxTasks = options["max_tasks"],
+                exitWhenIdle = not options["wait_when_idle"],
+                idleInterval = options["idle_interval"],
+                hitTypeIds = options["hit_type"],
+                parallelism = "thread" if options["processes"] is None else "process",
+                numProcesses = options["processes"],
+                seed = options["seed"],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        engine = SwarmEngine(config)
+        try:
+            engine.setup()
+            result = engine.run()
+        except SwarmError as exc:
+            raise CommandError(str(exc))
+        except KeyboardInterrupt:
+            engine.stop()
+            raise CommandError("Interrupted")
+        finally:
+            if ( options["cleanup"] ):
+                engine.cleanup()
+
+        summary = result.summary()
+        if ( options["json"] ):
+            self.stdout.write(json.dumps(summary, indent=2, sort_keys=True))
+            return
+
+        self.stdout.write(
+            "Workers: %d Elapsed: %.3fs Retries: %d" % (
+                config.num_workers, result.elapsed, result.retries
+            )
+        )
+        self.stdout.write(
+            "Outcomes: %s" % " ".join(
+                "%s: %d" % (name, count)
+                for name, count in sorted(result.outcomes.items())
+            )
+        )
+        self.stdout.write(
+            "%-14s %8s %7s %10s %9s %9s %9s" % (
+                "Operation", "Count", "Errors", "Ops/sec", "p50 ms", "p95 ms", "max ms"
+            )
+        )
+        for name, stats in sorted(summary["Operations"].items()):
+            self.stdout.write(
+                "%-14s %8d %7d %10.1f %9.2f %9.2f %9.2f" % (
+                    name, stats["Count"], stats["Errors"], stats["PerSecond"],
+                    stats["P50Ms"], stats["P95Ms"], stats["MaxMs"]
+                )
+            )
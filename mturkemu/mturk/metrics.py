@@ -0,0 +1,331 @@
+# File: mturk/metrics.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the per operation
+# metrics of the API. For each operation, the metrics registry
+# keeps:
+#    - the number of requests,
+#    - the number of errors by error type (the RequestError
+#      subclass or 'ServiceFault'),
+#    - latency histograms of the phases of a request:
+#         validation     - decoding and validating the parameters
+#         handler        - running the operation's handler
+#         serialization  - validating and encoding the response
+#         db             - executing SQL (part of the other phases)
+#         total          - the whole request
+#    - the number of SQL queries.
+# The SQL queries are timed by the cursors of the emulator's
+# database backend (see 'mturk/backends/sqlite3') while a request
+# is being recorded in the thread. With another backend, the DB
+# time and query counts are zero.
+#
+# The metrics are served in the Prometheus text format or as JSON
+# by the '/metrics' endpoint - see 'MetricsView' and the
+# 'MetricsSummary' command.
+#
+
+from django.conf import settings
+
+from mturk.cache import cache_statistics
+
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+# Upper bounds of the histogram buckets of queries per request
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+PHASES = ("validation", "handler", "serialization", "db", "total")
+
+UNKNOWN_OPERATION = "Unknown"
+
+class Histogram(object):
+    """
+    Cumulative histogram with fixed bucket bounds - the last bucket
+    holds the values above the largest bound (+Inf).
+    """
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        @return list of (bound, cumulative count) tuples - the bound
+           of the last bucket is None for +Inf.
+        """
+        ret = []
+        total = 0
+        for bound, count in zip(list(self.bounds) + [None], self.counts):
+            total += count
+            ret.append( (bound, total) )
+        return(ret)
+
+    def quantile(self, q):
+        """
+        @return estimate of the quantile - the upper bound of the
+           bucket that contains it.
+        """
+        if ( self.count == 0 ):
+            return(0.0)
+        target = q * self.count
+        for bound, total in self.cumulative():
+            if ( total >= target ):
+                return( self.bounds[-1] if bound is None else bound )
+        return( self.bounds[-1] )
+
+    def serialize(self):
+        return({
+            "Count" : self.count,
+            "Sum" : self.sum,
+            "Mean" : self.sum / self.count if self.count > 0 else 0.0,
+            "P50" : self.quantile(0.50),
+            "P95" : self.quantile(0.95),
+            "P99" : self.quantile(0.99),
+        })
+
+
+class OperationMetrics(object):
+    def __init__(self):
+        self.requests = 0
+        self.errors = Counter()
+        self.queries = 0
+        self.phases = OrderedDict(
+            (phase, Histogram(LATENCY_BUCKETS)) for phase in PHASES
+        )
+        self.query_counts = Histogram(QUERY_BUCKETS)
+
+    def serialize(self):
+        return({
+            "Requests" : self.requests,
+            "Errors" : dict(self.errors),
+            "Queries" : self.queries,
+            "QueriesPerRequest" : self.query_counts.serialize(),
+            "Seconds" : {
+                phase : hist.serialize() for phase, hist in self.phases.items()
+            },
+        })
+
+
+class QueryTimer(object):
+    """
+    Number and total time of the SQL queries of a request.
+    """
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+_local = threading.local()
+
+def record_query(elapsed):
+    """
+    Called by the database cursors after each query.
+    """
+    timer = getattr(_local, "timer", None)
+    if ( timer is not None ):
+        timer.count += 1
+        timer.seconds += elapsed
+
+
+class RequestRecorder(object):
+    """
+    Measures the phases of one API request in the current thread.
+    """
+    def __init__(self, registry):
+        self.registry = registry
+        self.operation = UNKNOWN_OPERATION
+        self.error = None
+        self.seconds = {}
+        self.timer = QueryTimer()
+        self._start = time.perf_counter()
+        self._prevTimer = getattr(_local, "timer", None)
+        _local.timer = self.timer
+
+    def phase(self, name):
+        return( PhaseTimer(self, name) )
+
+    def finish(self):
+        _local.timer = self._prevTimer
+        self.seconds["total"] = time.perf_counter() - self._start
+        self.seconds["db"] = self.timer.seconds
+        self.registry.record(self)
+
+class PhaseTimer(object):
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return(self)
+
+    def __exit__(self, excType, exc, tb):
+        seconds = self.recorder.seconds
+        seconds[self.name] = (
+            seconds.get(self.name, 0.0) + time.perf_counter() - self.start
+        )
+        return(False)
+
+class NullRecorder(object):
+    """
+    Recorder used when the metrics are disabled.
+    """
+    operation = UNKNOWN_OPERATION
+    error = None
+
+    def phase(self, name):
+        return( NullPhase() )
+
+    def finish(self):
+        pass
+
+class NullPhase(object):
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, excType, exc, tb):
+        return(False)
+
+
+class MetricsRegistry(object):
+    """
+    Process wide per operation metrics.
+    """
+    PREFIX = "mturk"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+        self.started = time.time()
+
+    def start_request(self):
+        """
+        @return recorder for an API request - its 'finish' method
+           must be called when the request completes.
+        """
+        if ( not getattr(settings, "MTURK_METRICS_ENABLED", True) ):
+            return( NullRecorder() )
+        return( RequestRecorder(self) )
+
+    def record(self, recorder):
+        with self._lock:
+            op = self._operations.get(recorder.operation)
+            if ( op is None ):
+                op = OperationMetrics()
+                self._operations[recorder.operation] = op
+            op.requests += 1
+            if ( recorder.error is not None ):
+                op.errors[recorder.error] += 1
+            op.queries += recorder.timer.count
+            op.query_counts.observe(recorder.timer.count)
+            for phase, seconds in recorder.seconds.items():
+                op.phases[phase].observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._operations = {}
+            self.started = time.time()
+
+    def summary(self):
+        with self._lock:
+            return({
+                "UptimeSeconds" : time.time() - self.started,
+                "Operations" : {
+                    name : op.serialize()
+                    for name, op in sorted(self._operations.items())
+                },
+            })
+
+    def prometheus_text(self):
+        """
+        @return the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        def header(name, kind, desc):
+            lines.append("# HELP %s_%s %s" % (self.PREFIX, name, desc))
+            lines.append("# TYPE %s_%s %s" % (self.PREFIX, name, kind))
+        def sample(name, labels, value):
+            labelStr = ",".join(
+                '%s="%s"' % (key, escape_label(val)) for key, val in labels
+            )
+            lines.append("%s_%s{%s} %s" % (self.PREFIX, name, labelStr, format_value(value)))
+        def histogram(name, labels, hist):
+            for bound, total in hist.cumulative():
+                le = "+Inf" if bound is None else format_value(bound)
+                sample(name + "_bucket", labels + [("le", le)], total)
+            sample(name + "_sum", labels, hist.sum)
+            sample(name + "_count", labels, hist.count)
+
+        with self._lock:
+            operations = sorted(self._operations.items())
+
+            header("api_requests_total", "counter", "Number of API requests")
+            for name, op in operations:
+                sample("api_requests_total", [("operation", name)], op.requests)
+
+            header("api_errors_total", "counter", "Number of API errors by error type")
+            for name, op in operations:
+                for errorType, count in sorted(op.errors.items()):
+                    sample(
+                        "api_errors_total",
+                        [("operation", name), ("error_type", errorType)],
+                        count
+                    )
+
+            header("api_db_queries_total", "counter", "Number of SQL queries")
+            for name, op in operations:
+                sample("api_db_queries_total", [("operation", name)], op.queries)
+
+            header("api_phase_seconds", "histogram", "Latency of the phases of an API request")
+            for name, op in operations:
+                for phase, hist in op.phases.items():
+                    histogram(
+                        "api_phase_seconds",
+                        [("operation", name), ("phase", phase)],
+                        hist
+                    )
+
+            header("api_db_queries_per_request", "histogram", "Number of SQL queries per API request")
+            for name, op in operations:
+                histogram(
+                    "api_db_queries_per_request", [("operation", name)],
+                    op.query_counts
+                )
+
+        caches = sorted(cache_statistics().items())
+        for key, desc in [("Hits", "hits"), ("Misses", "misses"), ("Evictions", "evictions")]:
+            header("cache_%s_total" % desc, "counter", "Number of cache %s" % desc)
+            for name, stats in caches:
+                sample("cache_%s_total" % desc, [("cache", name)], stats[key])
+        header("cache_entries", "gauge", "Number of cache entries")
+        for name, stats in caches:
+            sample("cache_entries", [("cache", name)], stats["Entries"])
+
+        return( "\n".join(lines) + "\n" )
+
+def escape_label(value):
+    return(
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    )
+
+def format_value(value):
+    if ( isinstance(value, float) ):
+        return( repr(value) )
+    return( str(value) )
+
+metrics = MetricsRegistry()
@@ -5,15 +5,16 @@
 #    This file contains the models for the MTurk Emulator.
 #
 
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Q, F
 from django.core.validators import validate_comma_separated_integer_list
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_init, post_delete
 from django.dispatch import receiver
-from django.utils import timezone
 
 from mturk.fields import *
+from mturk.clock import clock
+from mturk.deferred import defer
 from mturk.xml.questions import *
 from mturk.xml.quesformanswer import QFormAnswer
 
@@ -21,28 +22,6 @@ from datetime import timedelta
 import random
 import string
 
-@receiver(post_save, dispatch_uid="aws_id_creation")
-def create_aws_id(sender, instance, **kwargs):
-    """
-    Create the AWS ID for objects that have this field
-    This method is called post object save, and will
-    cause a second save operation only on creation.
-    @note - I think there may be a nicer way to do this with
-       a model manager that applies to all objects of a particular
-       abstract base type including the AWS ID - but for now
-       this works even if it has a slight performance penalty.
-    """
-    # Applies only to objects with an
-    # AWS Id parameter
-    try:
-        aws_id = instance.aws_id
-    except:
-        return
-
-    if ( len(aws_id) == 0 ):
-        instance.aws_id = CustomerIdField.generate_id(instance)
-        instance.save()
-
 class Worker(models.Model):
     """
     Workers implement the tasks created by Requesters
@@ -50,11 +29,12 @@ class Worker(models.Model):
     aws_id = CustomerIdField()
     active = models.BooleanField(default=True)
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    created = models.DateTimeField(auto_now=False, auto_now_add = True)
+    created = CreationTimeField()
 
     # HIT Statistics
 
     returned_hits = models.IntegerField(default=0)
+    abandoned_hits = models.IntegerField(default=0)
 
     def is_blocked(self, requester):
         """
@@ -79,7 +59,7 @@ class Requester(models.Model):
     MAX_NAME_LEN = 256
     name = models.CharField(max_length = MAX_NAME_LEN, blank=True)
     active = models.BooleanField(default=True)
-    created = models.DateTimeField(auto_now=False, auto_now_add = True)
+    created = CreationTimeField()
     balance = models.DecimalField(max_digits=8, decimal_places=2)
 
     def get_balance(self):
@@ -184,7 +164,13 @@ class Qualification(KeywordMixinModel):
 
     aws_id = CustomerIdField()
     requester = models.ForeignKey(Requester, on_delete=models.CASCADE)
-    created = models.DateTimeField(auto_now=False, auto_now_add = True)
+    created = CreationTimeField()
+
+    class Meta:
+        # Index for the keyset paging of the list methods
+        index_together = [
+            ("requestable", "dispose", "created"),
+        ]
 
     MAX_NAME_LEN = 256
     name = models.CharField(max_length=MAX_NAME_LEN)
@@ -206,9 +192,9 @@ class Qualification(KeywordMixinModel):
 
     # We store the text QuestionForm and answer answerKey objects
     # in string format so that they can be read and parsed later when
-    # they are needed.
-    test = models.TextField(blank=True)
-    answer = models.TextField(blank=True)
+    # they are needed. Large objects are stored compressed.
+    test = CompressedTextField(blank=True)
+    answer = CompressedTextField(blank=True)
     test_duration = models.DurationField(null=True)
 
     # Dispose is a flag indicating that this object needs to
@@ -241,19 +227,38 @@ class Qualification(KeywordMixinModel):
 
         return(False, taskTypes)
 
+    def dispose_if_unused(self):
+        """
+        Dispose of this qualification if it is in the disposing state
+        and is not referenced by any active tasks.
+        """
+        if ( not self.is_disposing() ):
+            return
+        inActiveTasks, _ = self.is_ref_in_active_tasks()
+        if ( not inActiveTasks ):
+            self.purge_grants()
+            # Now we can delete
+            self.dispose = True
+            self.save()
+
     def purge_grants(self):
         """
         This qualification is being disposed of - so we need to remove
         any active grants
         """
 
-        grants = QualificationGrant.objects.filter(
+        # @note - the bulk update skips the grant save signals that
+        #    invalidate the eligibility engine's cached grants of
+        #    this qualification, so the cache is invalidated here.
+        QualificationGrant.objects.filter(
             qualification = self,
             dispose=False
-            )
-        for grant in grants:
-            grant.dispose = True
-            grant.save()
+            ).update(dispose = True)
+
+        # Imported here because the population module imports the
+        #   models.
+        from mturk.population import eligibility_engine
+        eligibility_engine.invalidate_qual(self.pk)
 
 
 
@@ -304,7 +309,12 @@ class QualificationRequest(models.Model):
     aws_id = CustomerIdField()
     worker = models.ForeignKey(Worker, on_delete=models.CASCADE)
     qualification = models.ForeignKey(Qualification, on_delete=models.CASCADE)
-    created = models.DateTimeField(auto_now=False, auto_now_add = True)
+    created = CreationTimeField()
+
+    class Meta:
+        index_together = [
+            ("qualification", "state", "created"),
+        ]
 
     last_request = models.DateTimeField()
 
@@ -313,8 +323,9 @@ class QualificationRequest(models.Model):
     state = QualReqStatusField()
 
     # Answer contains the response data from the Worker when they
-    # complete the Qualification test.
-    answer = models.TextField(blank=True)
+    # complete the Qualification test. Large answers are stored
+    # compressed.
+    answer = CompressedTextField(blank=True)
     last_submitted = models.DateTimeField(null=True)
 
     #rejected = models.BooleanField(default=False)
@@ -359,8 +370,14 @@ class QualificationGrant(models.Model):
     worker = models.ForeignKey(Worker, on_delete=models.CASCADE)
     qualification = models.ForeignKey(Qualification, on_delete=models.CASCADE)
 
-    granted = models.DateTimeField(auto_now=False, auto_now_add = True)
+    granted = CreationTimeField()
     value = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = [
+            ("qualification", "dispose", "granted"),
+        ]
+
     # Locale is optional for certain types of qualifications
     locale = models.ForeignKey(Locale, on_delete=models.PROTECT, null=True)
 
@@ -518,23 +535,64 @@ class QualificationRequirement(models.Model):
         """
         Check if a particular grant meets the specifications of this
         qual requirement.
+        @note - checking a worker against all of the requirements of
+           a task type is faster with the compiled requirements - see
+           'mturk/requirements.py'
         """
-        check_methods = {
-            QualComparatorField.LESS_THAN: self.check_lt,
-            QualComparatorField.LESS_THAN_OR_EQUAL: self.check_lte,
-            QualComparatorField.GREATER_THAN: self.check_gt,
-            QualComparatorField.GREATER_THAN_OR_EQUAL: self.check_gte,
-            QualComparatorField.EQUAL_TO: self.check_equal,
-            QualComparatorField.NOT_EQUAL_TO: self.check_not_equal,
-            QualComparatorField.EXISTS: self.check_exists,
-            QualComparatorField.DOES_NOT_EXIST: self.check_does_not_exist,
-            QualComparatorField.IN_SET: self.check_in_set,
-            QualComparatorField.NOT_IN_SET: self.check_not_in_set,
-        }
-
-        method = check_methods[self.comparator]
+        method = getattr(self, self.CHECK_METHODS[self.comparator])
         return( method(grant) )
 
+    CHECK_METHODS = {
+        QualComparatorField.LESS_THAN: "check_lt",
+        QualComparatorField.LESS_THAN_OR_EQUAL: "check_lte",
+        QualComparatorField.GREATER_THAN: "check_gt",
+        QualComparatorField.GREATER_THAN_OR_EQUAL: "check_gte",
+        QualComparatorField.EQUAL_TO: "check_equal",
+        QualComparatorField.NOT_EQUAL_TO: "check_not_equal",
+        QualComparatorField.EXISTS: "check_exists",
+        QualComparatorField.DOES_NOT_EXIST: "check_does_not_exist",
+        QualComparatorField.IN_SET: "check_in_set",
+        QualComparatorField.NOT_IN_SET: "check_not_in_set",
+    }
+
+class QuestionBlob(models.Model):
+    """
+    Content addressed storage of the question XML of tasks. Tasks
+    created from the same template have byte-identical questions so
+    each distinct question is stored once, keyed by a hash of its
+    content.
+    """
+    digest = models.CharField(max_length=40, unique=True)
+    content = models.TextField()
+    # Length of the content in bytes
+    size = models.IntegerField(default=0)
+    created = CreationTimeField()
+
+    def __str__(self):
+        return("QuestionBlob %s: %d bytes" % (self.digest, self.size))
+
+    @classmethod
+    def intern(cls, content):
+        """
+        @return the blob for this content, creating it if
+           necessary.
+        """
+        digest, size = content_digest(content)
+        blob, created = cls.objects.get_or_create(
+            digest = digest,
+            defaults = { "content" : content, "size" : size }
+        )
+        return(blob)
+
+    @classmethod
+    def purge_unused(cls):
+        """
+        Delete the blobs that are not referenced by any task.
+        @return number of blobs deleted
+        """
+        num, counts = cls.objects.filter(task__isnull = True).delete()
+        return(num)
+
 class TaskType(KeywordMixinModel):
     """
     TaskTypes make it easier to create a particular Task with common
@@ -573,14 +631,14 @@ class TaskType(KeywordMixinModel):
     def active_task_count(self):
         activeTasks = self.task_set.filter(
             status = TaskStatusField.ASSIGNABLE,
-            expires__gt = timezone.now()
+            expires__gt = clock.now()
         )
         return(activeTasks.count())
 
     def first_active_task(self):
         activeTasks = self.task_set.filter(
             status = TaskStatusField.ASSIGNABLE,
-            expires__gt = timezone.now()
+            expires__gt = clock.now()
         )
         return(activeTasks[0])
 
@@ -629,9 +687,18 @@ class Task(models.Model):
     status = TaskStatusField()
 
     max_assignments = models.IntegerField(default=0)
-    created = models.DateTimeField(auto_now=False, auto_now_add = True)
+    created = CreationTimeField()
     expires = models.DateTimeField(null=True)
 
+    class Meta:
+        index_together = [
+            ("requester", "dispose", "created"),
+            # Due time index for the lifecycle scheduler
+            ("status", "dispose", "expires"),
+            # Worker task feed - see 'mturk/worker/TaskFeed.py'
+            ("tasktype", "status", "dispose", "expires"),
+        ]
+
     MAX_ANNOTATION_LEN = 256
     annotation = models.CharField(max_length=MAX_ANNOTATION_LEN)
 
@@ -641,14 +708,35 @@ class Task(models.Model):
     MAX_UNIQUE_LEN = 64
     unique=models.CharField(max_length=MAX_UNIQUE_LEN, blank=True)
 
-    # Note: question is an XML string field containing the
-    #   content that will be presented to the worker. This XML is
-    #   validated before creation, but it is not parsed or acted
-    #   upon until shown to the worker.
-    question = models.TextField()
+    # Note: question is an XML string containing the content that
+    #   will be presented to the worker. This XML is validated
+    #   before creation, but it is not parsed or acted upon until
+    #   shown to the worker. The content is stored in the
+    #   QuestionBlob table and shared by all of the tasks with the
+    #   same question - see the 'question' property.
+    question_blob = models.ForeignKey(
+        QuestionBlob, null=True, blank=True, on_delete=models.PROTECT
+    )
+    # Tasks created before the blob table have their question
+    #   stored inline until it is moved to the blob table with the
+    #   'DedupeQuestions' command.
+    question_inline = models.TextField(blank=True, db_column="question")
 
     reviewstatus = TaskReviewStatusField()
 
+    # Denormalized counts of the assignments of this task in each
+    # of the states that affect the task's state. These are
+    # maintained by the Assignment signal handlers below with
+    # atomic F() updates so they must not be written by a normal
+    # 'save' of a Task object - see 'save' below.
+    # @note - use the 'ReconcileTaskCounters' command to check
+    #    these values against the assignment table.
+    num_pending = models.IntegerField(default=0)
+    num_submitted = models.IntegerField(default=0)
+    num_completed = models.IntegerField(default=0)
+
+    COUNTER_FIELDS = ("num_pending", "num_submitted", "num_completed")
+
     # @todo - assignment policy
     # @todo - hit policy
     # @todo - HITLayoutId handling.
@@ -656,14 +744,50 @@ class Task(models.Model):
     # For Delete Operation
     dispose = models.BooleanField(default=False)
 
+    def save(self, *args, **kwargs):
+        """
+        Updates of an existing task exclude the assignment counters
+        so that a stale task object can't overwrite the changes
+        made by the assignment signal handlers.
+        """
+        isUpdate = (
+            self.pk is not None and
+            kwargs.get("update_fields") is None and
+            not kwargs.get("force_insert", False)
+        )
+        if ( isUpdate ):
+            kwargs["update_fields"] = [
+                f.name for f in self._meta.concrete_fields
+                if ( not f.primary_key and f.name not in self.COUNTER_FIELDS )
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def question(self):
+        if ( self.question_blob_id is not None ):
+            return(self.question_blob.content)
+        return(self.question_inline)
+
+    @question.setter
+    def question(self, content):
+        if ( len(content) > 0 ):
+            self.question_blob = QuestionBlob.intern(content)
+        else:
+            self.question_blob = None
+        self.question_inline = ""
+
     def is_questionform(self):
         q = QuestionValidator()
         quesType = q.determine_type( self.question )
         return( quesType == "QuestionForm" )
 
     # Status Accessors
-    def is_expired(self):
-        return( timezone.now() > self.expires )
+    def is_expired(self, now=None):
+        if ( self.expires is None ):
+            return(False)
+        if ( now is None ):
+            now = clock.now()
+        return( now > self.expires )
 
     def is_assignable(self):
         return(self.status == TaskStatusField.ASSIGNABLE )
@@ -693,34 +817,130 @@ class Task(models.Model):
 
         return(True)
 
-    def check_state_change(self):
+    def check_state_change(self, now=None):
         """
         This method checks the number of assignments for a task
         given its state and manages the state transitions
         @note - this method is invoked primarily in a post_save
-          signal event on assignment save.
+          signal event on assignment save, after the assignment
+          counters have been updated, and by the lifecycle
+          scheduler when the task expires.
         """
-        # @todo - we aren't handling task expiration especially
-        #    well here yet.
         available, pending, completed, submitted = self.compute_assignment_stats()
         #print("State Change: %d/%d/%d/%d" % (available, pending, completed,submitted))
-        if ( self.is_assignable() ):
+        newStatus = None
+        isOpen = ( self.is_assignable() or self.is_unassignable() )
+        if ( isOpen and self.is_expired(now) ):
+            # Expired tasks can't be assigned again but workers
+            # can still submit the assignments they have accepted.
+            if ( pending > 0 ):
+                if ( not self.is_unassignable() ):
+                    newStatus = TaskStatusField.UNASSIGNABLE
+            else:
+                newStatus = TaskStatusField.REVIEWABLE
+
+        elif ( self.is_assignable() ):
             if ( available == 0 and submitted >= self.max_assignments):
-                self.status = TaskStatusField.REVIEWABLE
-                self.save()
+                newStatus = TaskStatusField.REVIEWABLE
             elif ( available == 0 ):
-                self.status = TaskStatusField.UNASSIGNABLE
-                self.save()
+                newStatus = TaskStatusField.UNASSIGNABLE
 
         elif ( self.is_unassignable() ):
             if ( available == 0 and submitted >= self.max_assignments ):
-                self.status = TaskStatusField.REVIEWABLE
-                self.save()
+                newStatus = TaskStatusField.REVIEWABLE
             elif ( available > 0 ):
                 # Worker could have returned a task making it
                 # assignable again.
-                self.status = TaskStatusField.ASSIGNABLE
-                self.save()
+                newStatus = TaskStatusField.ASSIGNABLE
+
+        if ( newStatus is not None ):
+            self.status = newStatus
+            self.save(update_fields=["status"])
+
+    def apply_counter_change(self, oldField, newField):
+        """
+        Move an assignment from one counter to another. Either field
+        may be None if the assignment was not (or is no longer)
+        counted. The update is done in the database with F()
+        expressions so concurrent updates are not lost.
+        @note - the counters of this object are not reloaded - see
+           'update_state'.
+        """
+        changes = {}
+        if ( oldField is not None ):
+            changes[oldField] = F(oldField) - 1
+        if ( newField is not None ):
+            changes[newField] = F(newField) + 1
+        if ( len(changes) == 0 ):
+            return
+
+        Task.objects.filter(pk = self.pk).update(**changes)
+
+    def reserve_slot(self, now=None):
+        """
+        Reserve one of the available assignment slots of this task
+        for a new assignment. The reservation is a single
+        conditional UPDATE that increments the pending counter only
+        if the task is still assignable and not full, so concurrent
+        accepts can never assign more than 'max_assignments'.
+        @note - the new assignment must be created in the same
+           transaction with 'reserved_slot' set - see
+           'TasksActor.accept_task'.
+        @return True if a slot was reserved
+        """
+        if ( now is None ):
+            now = clock.now()
+        numUpdated = Task.objects.filter(
+            Q(expires__isnull = True) | Q(expires__gte = now),
+            pk = self.pk,
+            status = TaskStatusField.ASSIGNABLE,
+            dispose = False,
+            num_pending__lt = (
+                F("max_assignments") - F("num_submitted") - F("num_completed")
+            ),
+        ).update( num_pending = F("num_pending") + 1 )
+        return( numUpdated == 1 )
+
+    def update_state(self, now=None):
+        """
+        Reload the assignment counters and then check for a
+        state change.
+        """
+        self.refresh_from_db(fields = self.COUNTER_FIELDS)
+        self.check_state_change(now)
+
+    def count_assignments(self):
+        """
+        Count the assignments of this task directly from the
+        assignment table.
+        @return dict of counter field name to count
+        """
+        return({
+            "num_pending" : self.pending_assignments().count(),
+            "num_submitted" : self.submitted_assignments().count(),
+            "num_completed" : self.completed_assignments().count(),
+        })
+
+    def reconcile_counters(self, fix=True):
+        """
+        Compare the assignment counters to the assignment table.
+        @param fix if true, the stored counters are replaced with
+            the counted values.
+        @return dict of the counter fields that have drifted, mapping
+            to a tuple of (stored, counted)
+        """
+        counts = self.count_assignments()
+        drift = {}
+        for name, count in counts.items():
+            stored = getattr(self, name)
+            if ( stored != count ):
+                drift[name] = (stored, count)
+
+        if ( fix and len(drift) > 0 ):
+            Task.objects.filter(pk = self.pk).update(**counts)
+            for name, count in counts.items():
+                setattr(self, name, count)
+        return(drift)
 
     def has_quals(self):
         return( self.tasktype.has_quals() )
@@ -798,15 +1018,15 @@ class Task(models.Model):
 
     @property
     def completed_assignment_count(self):
-        return(self.completed_assignments().count())
+        return(self.num_completed)
 
     @property
     def pending_assignment_count(self):
-        return( self.pending_assignments().count() )
+        return(self.num_pending)
 
     @property
     def submitted_assignment_count(self):
-        return( self.submitted_assignments().count())
+        return(self.num_submitted)
 
     def compute_assignment_stats(self):
         completed = self.completed_assignment_count
@@ -882,16 +1102,14 @@ def task_handle_post_delete(sender, instance, **kwargs):
 
     # This task is being disposed - we will check to
     # see if there are any of the qualifications in its tasktypes
-    # that need to be cleaned up
-    for qualreq in task.tasktype.qualifications.all():
-        qual = qualreq.qualification
-        if ( qual.is_disposing() ):
-            inActiveTasks, _ = qual.is_ref_in_active_tasks()
-            if ( not inActiveTasks ):
-                qual.purge_grants()
-                # Now we can delete
-                qual.dispose = True
-                qual.save()
+    # that need to be cleaned up. A request that disposes of many
+    # tasks only checks each qualification once.
+    def check_quals():
+        for qualreq in task.tasktype.qualifications.all():
+            qual = qualreq.qualification
+            if ( qual.is_disposing() ):
+                defer(("qual_dispose", qual.pk), qual.dispose_if_unused)
+    defer(("task_dispose", task.pk), check_quals)
 
 
 class Assignment(models.Model):
@@ -913,10 +1131,22 @@ class Assignment(models.Model):
     rejected=models.DateTimeField(null=True)
     deadline=models.DateTimeField(null=True)
 
+    class Meta:
+        index_together = [
+            ("task", "dispose", "accepted"),
+            # Due time indices for the lifecycle scheduler
+            ("status", "dispose", "deadline"),
+            ("status", "dispose", "auto_approve"),
+        ]
+
+    # Set on a new assignment whose slot has already been counted
+    #   by 'Task.reserve_slot' - not stored in the database.
+    reserved_slot = False
+
     # QuestionFormAnswers object that encodes all
     #   of the data that a worker has submitted for a
-    #   particular assignment.
-    answer = models.TextField()
+    #   particular assignment. Large answers are stored compressed.
+    answer = CompressedTextField()
 
     # Need to  figure out how to store the answers to a
     # assignment
@@ -933,7 +1163,7 @@ class Assignment(models.Model):
         return( self.status == AssignmentStatusField.SUBMITTED )
 
     def approve(self, reason=""):
-        self.approved = timezone.now()
+        self.approved = clock.now()
         self.status = AssignmentStatusField.APPROVED
         self.feedback = reason
 
@@ -941,7 +1171,7 @@ class Assignment(models.Model):
         return( self.status == AssignmentStatusField.APPROVED )
 
     def reject(self, reason=""):
-        self.rejected = timezone.now()
+        self.rejected = clock.now()
         self.status = AssignmentStatusField.REJECTED
         self.feedback = reason
 
@@ -951,6 +1181,51 @@ class Assignment(models.Model):
     def is_decided(self):
         return( self.is_approved() or self.is_rejected() )
 
+    def counter_field(self):
+        """
+        @return name of the Task counter field that this assignment
+           is counted in or None if it is not counted.
+        """
+        return( Assignment.counter_for(self.status, self.dispose) )
+
+    @staticmethod
+    def counter_for(status, dispose=False):
+        if ( dispose ):
+            return(None)
+        if ( status == AssignmentStatusField.ACCEPTED ):
+            return("num_pending")
+        elif ( status == AssignmentStatusField.SUBMITTED ):
+            return("num_submitted")
+        elif ( status in [AssignmentStatusField.APPROVED, AssignmentStatusField.REJECTED] ):
+            return("num_completed")
+        return(None)
+
+    def save_transition(self, fromStatus):
+        """
+        Save a state change of this assignment only if the stored
+        assignment is still in the state that the change was
+        checked against. The lifecycle scheduler abandons and auto
+        approves assignments with bulk updates, so an assignment
+        loaded before the scheduler ran is stale and saving it
+        would undo the scheduler's transition and count the
+        assignment twice.
+        @param fromStatus status of the assignment when the change
+           was checked - the assignment must not be disposed.
+        @return true if the change was saved, false if the stored
+           assignment is no longer in that state.
+        """
+        with transaction.atomic():
+            # The conditional update claims the row so the
+            # scheduler can't transition it before the save.
+            claimed = Assignment.objects.filter(
+                pk = self.pk, status = fromStatus, dispose = False
+            ).update(status = self.status, dispose = self.dispose)
+            if ( claimed == 0 ):
+                return(False)
+            self._counter_field = Assignment.counter_for(fromStatus)
+            self.save()
+        return(True)
+
     def get_answer_display(self):
         """
         Parse the QuestionFormAnswer object if it exists and
@@ -1015,15 +1290,67 @@ class Assignment(models.Model):
     def __str__(self):
         return("<%s...,STAT=%s" % (self.aws_id[0:6], self.status))
 
+# Marker for assignment objects whose counter field at load
+# time is not known (for example, loaded with deferred fields)
+UNKNOWN_COUNTER = "unknown"
+
+@receiver(post_init, sender=Assignment, dispatch_uid="mturk_assignmt_init")
+def assignment_track_counter(sender, instance, **kwargs):
+    """
+    Keep track of which task counter the assignment was counted in
+    when it was loaded so that on save we can move it to the
+    correct counter.
+    """
+    assignment = instance
+    if ( "status" in assignment.__dict__ and "dispose" in assignment.__dict__ ):
+        assignment._counter_field = assignment.counter_field()
+    else:
+        assignment._counter_field = UNKNOWN_COUNTER
+
 @receiver(post_save, sender=Assignment, dispatch_uid="mturk_assignmt_save")
-def task_state_update(sender, instance, **kwargs):
+def task_state_update(sender, instance, created, **kwargs):
     """
-    Check for state update of the task associated with an Assignment
-    whenever an assignmnent is updated.
+    Update the assignment counters of the task associated with
+    an Assignment and check for a state update of the task
+    whenever the assignment's counted state changes.
     """
     assignment = instance
+    if ( created and not assignment.reserved_slot ):
+        oldField = None
+    else:
+        oldField = assignment._counter_field
+    newField = assignment.counter_field()
+    assignment._counter_field = newField
+
+    if ( oldField == newField ):
+        return
+
     task = assignment.task
-    task.check_state_change()
+    if ( oldField == UNKNOWN_COUNTER ):
+        task.reconcile_counters()
+    else:
+        task.apply_counter_change(oldField, newField)
+    # The state check is only done once per task in a request that
+    # changes many assignments.
+    defer(("task_state", task.pk), task.update_state)
+
+@receiver(post_delete, sender=Assignment, dispatch_uid="mturk_assignmt_delete")
+def task_counter_delete(sender, instance, **kwargs):
+    """
+    Remove a deleted assignment from its task's counters.
+    @note - when the task itself is being deleted this update
+       will not match any rows.
+    """
+    assignment = instance
+    oldField = assignment._counter_field
+    if ( oldField == UNKNOWN_COUNTER ):
+        task = Task.objects.filter(pk = assignment.task_id).first()
+        if ( task is not None ):
+            task.reconcile_counters()
+    elif ( oldField is not None ):
+        Task.objects.filter(pk = assignment.task_id).update(
+            **{oldField : F(oldField) - 1}
+        )
 
 class BonusPayment(models.Model):
     """
@@ -1034,15 +1361,20 @@ class BonusPayment(models.Model):
     assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE)
     MAX_REASON_LEN=256
     reason=models.CharField(max_length=MAX_REASON_LEN,blank=True)
-    created=models.DateTimeField(auto_now=False, auto_now_add = True)
+    created=CreationTimeField()
     amount = models.DecimalField(max_digits=8, decimal_places=2)
 
+    class Meta:
+        index_together = [
+            ("assignment", "created"),
+        ]
+
     MAX_UNIQUE_LEN=64
     unique = models.CharField(max_length = MAX_UNIQUE_LEN, blank=True)
 
     def serialize(self):
         ret = {
-            "WorkerId": self.worker.awd_id,
+            "WorkerId": self.worker.aws_id,
             "BonusAmount" : "%.02f" % self.amount,
             "AssignmentId" : self.assignment.aws_id,
             "GrantTime" : self.created
@@ -1059,9 +1391,14 @@ class WorkerBlock(models.Model):
 
     worker=models.ForeignKey(Worker, on_delete=models.CASCADE)
     requester = models.ForeignKey(Requester, on_delete=models.CASCADE)
-    created=models.DateTimeField(auto_now=False, auto_now_add = True)
+    created=CreationTimeField()
 
     active = models.BooleanField(default=False)
+
+    class Meta:
+        index_together = [
+            ("requester", "active", "created"),
+        ]
     MAX_REASON_LEN = 256
     reason = models.CharField(max_length=MAX_REASON_LEN)
 
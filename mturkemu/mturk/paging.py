@@ -0,0 +1,129 @@
+# File: mturk/paging.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the paging scheme
+# used by the List* API methods. Instead of encoding an OFFSET in
+# the 'NextToken', which requires the database to scan and discard
+# all of the earlier rows on each page, the token encodes the
+# sort key (a timestamp and the primary key as a tie breaker) of the
+# last object returned. The next page is then selected with a
+# seek on that key, which can be satisfied by an index.
+#
+# Tokens of the form "A%010d" (which encode an offset) are still
+# accepted so that clients holding tokens from an older version
+# of the emulator can continue paging.
+#
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from mturk.errors import ValidationError
+
+import base64
+import json
+import re
+
+class ListPager(object):
+    """
+    Select a page of objects from a queryset ordered by a
+    timestamp field (descending) and generate the token for the
+    next page.
+    """
+
+    # Prefix for cursor tokens - distinguishes them from the
+    # offset tokens, which start with 'A'.
+    CURSOR_PREFIX = "C"
+    OFFSET_REGEX = re.compile("^A(\d+)$")
+
+    def __init__(self, orderField, numResults, token=None):
+        """
+        @param orderField name of the timestamp field that the list
+           is ordered by, newest first.
+        @param numResults maximum number of objects in a page
+        @param token 'NextToken' from the request or None for the
+           first page.
+        """
+        self.order_field = orderField
+        self.num_results = numResults
+        self.offset = 0
+        self.cursor = None
+
+        if ( token is not None ):
+            self.parse_token(token)
+
+    def parse_token(self, token):
+        m = self.OFFSET_REGEX.match(token)
+        if ( m ):
+            self.offset = int(m.group(1))
+        elif ( token.startswith(self.CURSOR_PREFIX) ):
+            self.cursor = self.decode_cursor(token[len(self.CURSOR_PREFIX):])
+        else:
+            raise ValidationError(["Invalid Next Token Format: %s" % token])
+
+    def decode_cursor(self, content):
+        try:
+            padding = "=" * (-len(content) % 4)
+            data = base64.urlsafe_b64decode(content + padding)
+            cursor = json.loads(data.decode("utf-8"))
+            if ( cursor["f"] != self.order_field ):
+                raise ValueError("Token for a different list")
+            value = cursor["v"]
+            if ( value is not None ):
+                value = parse_datetime(value)
+                if ( value is None ):
+                    raise ValueError("Invalid Timestamp")
+            pk = int(cursor["k"])
+        except (ValueError, TypeError, KeyError, UnicodeDecodeError):
+            raise ValidationError(["Invalid Next Token: %s" % content])
+        return( (value, pk) )
+
+    def encode_cursor(self, obj):
+        value = getattr(obj, self.order_field)
+        if ( value is not None ):
+            value = value.isoformat()
+        cursor = {"f" : self.order_field, "v" : value, "k" : obj.pk}
+        content = json.dumps(cursor, separators=(",",":")).encode("utf-8")
+        content = base64.urlsafe_b64encode(content).decode("utf-8")
+        return( self.CURSOR_PREFIX + content.rstrip("=") )
+
+    def seek_query(self):
+        """
+        Generate the filter that selects objects after the cursor
+        in the list ordering.
+        """
+        value, pk = self.cursor
+        if ( value is None ):
+            # @note - objects with a null sort key are ordered
+            #    after all others in a descending sort.
+            q = Q(**{"%s__isnull" % self.order_field : True})
+            return( q & Q(pk__lt = pk) )
+
+        older = Q(**{"%s__lt" % self.order_field : value})
+        same = Q(**{self.order_field : value}) & Q(pk__lt = pk)
+        return( older | same )
+
+    def page(self, queryset):
+        """
+        Select the page of objects from the queryset.
+        @return list of objects in this page
+        """
+        queryset = queryset.order_by(
+            "-%s" % self.order_field, "-pk"
+        )
+        if ( self.cursor is not None ):
+            queryset = queryset.filter(self.seek_query())
+            start = 0
+        else:
+            start = self.offset
+        return( list(queryset[start:(start + self.num_results)]) )
+
+    def next_token(self, items):
+        """
+        @return token for the page following the passed page
+           or None if this is the last page.
+        @note - a page that is not full must be the last page.
+        """
+        if ( len(items) == 0 or len(items) < self.num_results ):
+            return(None)
+        return( self.encode_cursor(items[-1]) )
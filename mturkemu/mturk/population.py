@@ -0,0 +1,397 @@
+# File: mturk/population.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the eligibility engine
+# that determines how many of the workers in the emulator meet a
+# set of qualification requirements. Checking each worker with
+# 'QualificationRequirement.check_grant' is far too slow for a
+# large worker table, so the grants are loaded into columnar numpy
+# arrays:
+#    - a worker index of the pks and ids of all of the workers,
+#    - for each qualification, a column of the grant value, the
+#      grant locale and a mask of the workers that have a grant.
+# The columns for the qualifications of a requirement set are
+# combined into a worker x qualification matrix and each
+# requirement is evaluated as a vectorized mask over all of the
+# workers.
+#
+# The worker index and the qualification columns are cached and
+# are invalidated by the Worker and QualificationGrant signals.
+#
+# @note - bulk updates of the grants (for example, when a
+#    qualification is disposed) don't send signals so the columns
+#    are also reloaded after 'MTURK_ELIGIBILITY_CACHE_SECONDS'.
+#
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from mturk.models import *
+from mturk.fields import *
+
+from collections import namedtuple
+import numpy as np
+import threading
+import time
+
+# Locale value for a grant without a locale
+NO_LOCALE = -1
+
+class RequirementSpec(namedtuple(
+        "RequirementSpec",
+        ["qual_id", "comparator", "int_values", "locale_ids"]
+)):
+    """
+    Requirement to evaluate - the 'qual_id' is the pk of the
+    qualification and the values are tuples.
+    """
+
+    @classmethod
+    def from_model(cls, qualreq):
+        return(
+            cls(
+                qualreq.qualification_id,
+                qualreq.comparator,
+                tuple(qualreq.get_int_values()),
+                tuple(sorted(loc.pk for loc in qualreq.locale_values.all())),
+            )
+        )
+
+    @classmethod
+    def from_tasktype(cls, tasktype):
+        qualreqs = tasktype.qualifications.all().prefetch_related(
+            "locale_values"
+        )
+        return( [ cls.from_model(q) for q in qualreqs ] )
+
+
+class WorkerIndex(object):
+    """
+    Ordered arrays of the workers in the emulator. The row of a
+    worker in the index is the row of the worker in the grant
+    matrices.
+    """
+    def __init__(self, pks, awsIds, active):
+        """
+        @param pks sorted int64 array of worker pks
+        @param awsIds object array of the worker ids
+        @param active bool array of the worker's active flags
+        """
+        self.pks = pks
+        self.aws_ids = awsIds
+        self.active = active
+
+    @classmethod
+    def load(cls):
+        rows = Worker.objects.order_by("pk").values_list(
+            "pk", "aws_id", "active"
+        )
+        pks = []
+        awsIds = []
+        active = []
+        for pk, awsId, isActive in rows.iterator():
+            pks.append(pk)
+            awsIds.append(awsId)
+            active.append(isActive)
+        return(
+            cls(
+                np.array(pks, dtype=np.int64),
+                np.array(awsIds, dtype=object),
+                np.array(active, dtype=bool),
+            )
+        )
+
+    def __len__(self):
+        return( len(self.pks) )
+
+    def find_rows(self, workerPks):
+        """
+        @return tuple of the rows of the passed worker pks and a mask
+           of the pks that are in the index.
+        """
+        workerPks = np.asarray(workerPks, dtype=np.int64)
+        rows = np.searchsorted(self.pks, workerPks)
+        rows = np.minimum(rows, max(len(self.pks) - 1, 0))
+        if ( len(self.pks) == 0 ):
+            return( rows, np.zeros(len(workerPks), dtype=bool) )
+        return( rows, self.pks[rows] == workerPks )
+
+
+class GrantColumn(object):
+    """
+    The grants of all of the workers for one qualification.
+    """
+    def __init__(self, values, locales, exists):
+        self.values = values
+        self.locales = locales
+        self.exists = exists
+        self.loaded = time.monotonic()
+
+    @classmethod
+    def load(cls, qualId, index):
+        grants = QualificationGrant.objects.filter(
+            qualification_id = qualId,
+            active = True,
+            dispose = False
+        ).order_by("granted").values_list("worker_id", "value", "locale_id")
+
+        workerPks = []
+        values = []
+        locales = []
+        for workerId, value, localeId in grants.iterator():
+            workerPks.append(workerId)
+            values.append(value)
+            locales.append(NO_LOCALE if localeId is None else localeId)
+
+        numWorkers = len(index)
+        col = cls(
+            np.zeros(numWorkers, dtype=np.int64),
+            np.full(numWorkers, NO_LOCALE, dtype=np.int64),
+            np.zeros(numWorkers, dtype=bool),
+        )
+        rows, found = index.find_rows(workerPks)
+        rows = rows[found]
+        # For a worker with more than one grant the latest grant wins.
+        col.values[rows] = np.array(values, dtype=np.int64)[found]
+        col.locales[rows] = np.array(locales, dtype=np.int64)[found]
+        col.exists[rows] = True
+        return(col)
+
+
+class GrantMatrix(object):
+    """
+    Worker x qualification matrices of the grants for a set of
+    qualifications.
+    @param qualIds tuple of qualification pks - the column of a
+       qualification is its position in this tuple.
+    @param values int64 matrix of the grant values
+    @param locales int64 matrix of the grant locale pks
+    @param exists bool matrix - true where the worker has a grant
+    """
+    def __init__(self, qualIds, values, locales, exists):
+        self.qual_ids = tuple(qualIds)
+        self.columns = { qualId : i for i, qualId in enumerate(self.qual_ids) }
+        self.values = values
+        self.locales = locales
+        self.exists = exists
+
+    @classmethod
+    def from_columns(cls, qualIds, columns, numWorkers):
+        if ( len(qualIds) == 0 ):
+            shape = (numWorkers, 0)
+            return(
+                cls(
+                    qualIds,
+                    np.zeros(shape, dtype=np.int64),
+                    np.zeros(shape, dtype=np.int64),
+                    np.zeros(shape, dtype=bool),
+                )
+            )
+        return(
+            cls(
+                qualIds,
+                np.column_stack([ col.values for col in columns ]),
+                np.column_stack([ col.locales for col in columns ]),
+                np.column_stack([ col.exists for col in columns ]),
+            )
+        )
+
+    def requirement_mask(self, spec):
+        """
+        Evaluate a requirement for all of the workers.
+        @return bool array - true for the workers that meet the
+           requirement.
+        """
+        col = self.columns[spec.qual_id]
+        exists = self.exists[:, col]
+        comparator = spec.comparator
+
+        if ( comparator == QualComparatorField.EXISTS ):
+            return( exists.copy() )
+        if ( comparator == QualComparatorField.DOES_NOT_EXIST ):
+            return( ~exists )
+
+        values = self.values[:, col]
+        locales = self.locales[:, col]
+        intValues = spec.int_values
+        localeIds = spec.locale_ids
+
+        if ( comparator == QualComparatorField.LESS_THAN ):
+            mask = values < self.first(intValues)
+        elif ( comparator == QualComparatorField.LESS_THAN_OR_EQUAL ):
+            mask = values <= self.first(intValues)
+        elif ( comparator == QualComparatorField.GREATER_THAN ):
+            mask = values > self.first(intValues)
+        elif ( comparator == QualComparatorField.GREATER_THAN_OR_EQUAL ):
+            mask = values >= self.first(intValues)
+        elif ( comparator in [QualComparatorField.EQUAL_TO,
+                              QualComparatorField.NOT_EQUAL_TO] ):
+            if ( len(intValues) > 0 ):
+                mask = values == intValues[0]
+            else:
+                mask = locales == self.first(localeIds)
+            if ( comparator == QualComparatorField.NOT_EQUAL_TO ):
+                mask = ~mask
+        elif ( comparator in [QualComparatorField.IN_SET,
+                              QualComparatorField.NOT_IN_SET] ):
+            if ( len(localeIds) > 0 ):
+                mask = np.isin(locales, localeIds)
+            else:
+                mask = np.isin(values, self.all(intValues))
+            if ( comparator == QualComparatorField.NOT_IN_SET ):
+                mask = ~mask
+        else:
+            raise ValueError("Invalid Comparator: %s" % comparator)
+
+        # Workers without a grant never meet a value comparison
+        return( mask & exists )
+
+    def first(self, vals):
+        if ( len(vals) == 0 ):
+            raise InvalidQualRequirementError()
+        return(vals[0])
+
+    def all(self, vals):
+        if ( len(vals) == 0 ):
+            raise InvalidQualRequirementError()
+        return( np.array(vals, dtype=np.int64) )
+
+    def eligible_mask(self, specs, active=None):
+        """
+        @param specs list of RequirementSpec objects
+        @param active optional bool array - workers that are not
+           active are not eligible.
+        @return bool array - true for the workers that meet all of
+           the requirements.
+        """
+        numWorkers = self.exists.shape[0]
+        if ( active is None ):
+            mask = np.ones(numWorkers, dtype=bool)
+        else:
+            mask = active.copy()
+        for spec in specs:
+            mask &= self.requirement_mask(spec)
+        return(mask)
+
+
+class EligibilityResult(object):
+    def __init__(self, index, mask):
+        self.index = index
+        self.mask = mask
+
+    @property
+    def num_workers(self):
+        return( int(np.count_nonzero(self.index.active)) )
+
+    @property
+    def num_eligible(self):
+        return( int(np.count_nonzero(self.mask)) )
+
+    def worker_ids(self, limit=None):
+        ids = self.index.aws_ids[self.mask]
+        if ( limit is not None ):
+            ids = ids[0:limit]
+        return( ids.tolist() )
+
+
+class EligibilityEngine(object):
+    """
+    Determine the workers that meet a set of qualification
+    requirements.
+    """
+    def __init__(self, maxAge=None):
+        """
+        @param maxAge number of seconds that a loaded qualification
+           column is used before it is reloaded.
+        """
+        if ( maxAge is None ):
+            maxAge = getattr(settings, "MTURK_ELIGIBILITY_CACHE_SECONDS", 60)
+        self.max_age = maxAge
+        self._lock = threading.RLock()
+        self._index = None
+        self._columns = {}
+
+    def get_index(self):
+        with self._lock:
+            if ( self._index is None ):
+                self._index = WorkerIndex.load()
+                self._columns.clear()
+            return(self._index)
+
+    def get_column(self, qualId, index):
+        with self._lock:
+            col = self._columns.get(qualId)
+            if ( col is not None and
+                 time.monotonic() - col.loaded > self.max_age ):
+                col = None
+            if ( col is None ):
+                col = GrantColumn.load(qualId, index)
+                self._columns[qualId] = col
+            return(col)
+
+    def get_matrix(self, qualIds):
+        """
+        @return tuple of the worker index and the grant matrix of
+           the passed qualifications.
+        """
+        with self._lock:
+            index = self.get_index()
+            qualIds = tuple(sorted(set(qualIds)))
+            columns = [ self.get_column(qualId, index) for qualId in qualIds ]
+        return(
+            index, GrantMatrix.from_columns(qualIds, columns, len(index))
+        )
+
+    def evaluate(self, specs):
+        """
+        @param specs list of RequirementSpec objects
+        @return EligibilityResult object
+        """
+        index, matrix = self.get_matrix([ spec.qual_id for spec in specs ])
+        mask = matrix.eligible_mask(specs, index.active)
+        return( EligibilityResult(index, mask) )
+
+    def evaluate_tasktype(self, tasktype):
+        return( self.evaluate(RequirementSpec.from_tasktype(tasktype)) )
+
+    def invalidate_workers(self):
+        with self._lock:
+            self._index = None
+            self._columns.clear()
+
+    def invalidate_qual(self, qualId):
+        with self._lock:
+            self._columns.pop(qualId, None)
+
+    def update_worker(self, worker):
+        """
+        Update the active flag of an indexed worker.
+        @return False if the worker is not in the index
+        """
+        with self._lock:
+            if ( self._index is None ):
+                return(True)
+            rows, found = self._index.find_rows([worker.pk])
+            if ( not found[0] ):
+                return(False)
+            self._index.active[rows[0]] = worker.active
+            return(True)
+
+eligibility_engine = EligibilityEngine()
+
+
+@receiver(post_save, sender=Worker, dispatch_uid="mturk_eligibility_worker")
+def eligibility_worker_update(sender, instance, created, **kwargs):
+    if ( created or not eligibility_engine.update_worker(instance) ):
+        eligibility_engine.invalidate_workers()
+
+@receiver(post_delete, sender=Worker, dispatch_uid="mturk_eligibility_worker_delete")
+def eligibility_worker_delete(sender, instance, **kwargs):
+    eligibility_engine.invalidate_workers()
+
+@receiver(post_save, sender=QualificationGrant, dispatch_uid="mturk_eligibility_grant")
+@receiver(post_delete, sender=QualificationGrant, dispatch_uid="mturk_eligibility_grant_delete")
+def eligibility_grant_update(sender, instance, **kwargs):
+    eligibility_engine.invalidate_qual(instance.qualification_id)
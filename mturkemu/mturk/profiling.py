@@ -0,0 +1,198 @@
+# File: mturk/profiling.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the on demand profiling
+# of API requests. A selected request runs its handler under cProfile
+# and tracemalloc and writes two files to 'MTURK_PROFILE_DIR':
+#    <operation>-<request id>.pstats     - cProfile statistics, for
+#                                          the 'pstats' module or a
+#                                          viewer like snakeviz
+#    <operation>-<request id>.alloc.txt  - the top allocation sites
+#                                          of the handler
+# where the request id is the 'x-amzn-requestid' of the response.
+#
+# A request is selected if:
+#    - a staff requester sends the 'X-Emu-Profile' header with a true
+#      value ("1", "true", "yes"), or
+#    - it is picked by the sampling rate 'MTURK_PROFILE_RATE', the
+#      fraction of the API requests that are profiled. The default of
+#      zero profiles only the requests with the header.
+#
+# @note - cProfile only sees the thread of the request, but
+#    tracemalloc traces the whole process. The allocation sites of
+#    concurrent requests may appear in the allocation report of a
+#    profiled request.
+#
+
+from django.conf import settings
+
+from mturk.errors import PermissionDenied
+
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger("mturk")
+
+PROFILE_HEADER = "HTTP_X_EMU_PROFILE"
+PROFILE_HEADER_VALUES = ["1", "true", "yes"]
+
+class RequestProfile(object):
+    """
+    Profile of the handler of one API request.
+    """
+    def __init__(self, profiler, operation, requestId):
+        self.profiler = profiler
+        self.operation = operation
+        self.request_id = requestId
+        self.name = "%s-%s" % (
+            re.sub(r"[^A-Za-z0-9_]", "_", operation), requestId
+        )
+        self.paths = []
+
+    def __enter__(self):
+        self.profiler.start_tracing()
+        self.baseline = tracemalloc.take_snapshot()
+        self.profile = cProfile.Profile()
+        self.start = time.perf_counter()
+        self.profile.enable()
+        return(self)
+
+    def __exit__(self, excType, exc, tb):
+        self.profile.disable()
+        self.elapsed = time.perf_counter() - self.start
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            self.profiler.stop_tracing()
+
+        error = None if excType is None else excType.__name__
+        try:
+            self.write(snapshot, current, peak, error)
+        except OSError as exc:
+            # A failed profile must not fail the request
+            logger.warning("Failed to Write Profile '%s': %s" % (self.name, str(exc)))
+        return(False)
+
+    def write(self, snapshot, current, peak, error):
+        directory = self.profiler.directory
+        os.makedirs(directory, exist_ok=True)
+
+        statsPath = os.path.join(directory, self.name + ".pstats")
+        self.profile.dump_stats(statsPath)
+        self.paths.append(statsPath)
+
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+        stats = snapshot.filter_traces(filters).compare_to(
+            self.baseline.filter_traces(filters), "lineno"
+        )
+        allocPath = os.path.join(directory, self.name + ".alloc.txt")
+        with open(allocPath, "w") as f:
+            f.write("Operation: %s\n" % self.operation)
+            f.write("Request Id: %s\n" % self.request_id)
+            f.write("Error: %s\n" % error)
+            f.write("Handler Seconds: %.6f\n" % self.elapsed)
+            f.write("Traced Memory: current=%d peak=%d\n" % (current, peak))
+            f.write("\nTop %d Allocation Sites:\n" % self.profiler.top_allocations)
+            for stat in stats[:self.profiler.top_allocations]:
+                f.write("%s\n" % stat)
+        self.paths.append(allocPath)
+
+
+class NullProfile(object):
+    """
+    Profile of a request that is not selected.
+    """
+    name = None
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, excType, exc, tb):
+        return(False)
+
+
+class RequestProfiler(object):
+    """
+    Selects the API requests that are profiled - see the description
+    at the top of this file.
+    """
+    def __init__(self, rng=None):
+        self.rng = rng if rng is not None else random.Random()
+        self._lock = threading.Lock()
+        self._tracing = 0
+        self._started = False
+
+    @property
+    def directory(self):
+        return( settings.MTURK_PROFILE_DIR )
+
+    @property
+    def rate(self):
+        return( getattr(settings, "MTURK_PROFILE_RATE", 0.0) )
+
+    @property
+    def top_allocations(self):
+        return( getattr(settings, "MTURK_PROFILE_TOP_ALLOCATIONS", 25) )
+
+    def requested(self, request, requester):
+        """
+        @return true if the request asks to be profiled with the
+           profile header
+        @throws PermissionDenied if the header is sent by a requester
+           that is not staff
+        """
+        value = request.META.get(PROFILE_HEADER, None)
+        if ( value is None ):
+            return(False)
+        if ( not requester.user.is_staff ):
+            raise PermissionDenied()
+        return( value.strip().lower() in PROFILE_HEADER_VALUES )
+
+    def sampled(self):
+        rate = self.rate
+        if ( rate <= 0.0 ):
+            return(False)
+        with self._lock:
+            return( self.rng.random() < rate )
+
+    def select(self, request, requester, operation, requestId):
+        """
+        @return context manager that profiles the handler of the
+           request - a RequestProfile if the request is selected and
+           otherwise a NullProfile.
+        """
+        if ( self.requested(request, requester) or self.sampled() ):
+            return( RequestProfile(self, operation, requestId) )
+        return( NullProfile() )
+
+    def start_tracing(self):
+        """
+        Concurrent profiles share the process wide tracemalloc. It is
+        started by the first profile and stopped by the last one,
+        unless it was already started by someone else.
+        """
+        with self._lock:
+            if ( self._tracing == 0 and not tracemalloc.is_tracing() ):
+                tracemalloc.start()
+                self._started = True
+            self._tracing += 1
+
+    def stop_tracing(self):
+        with self._lock:
+            self._tracing -= 1
+            if ( self._tracing == 0 and self._started ):
+                tracemalloc.stop()
+                self._started = False
+
+profiler = RequestProfiler()
@@ -17,6 +17,7 @@ from django.contrib import messages
 from mturk.models import *
 from mturk.utils import *
 from mturk.fields import *
+from mturk.population import eligibility_engine
 
 class RequesterHomePage(LoginRequiredMixin, MTurkBaseView):
     """
@@ -295,10 +296,18 @@ class RequesterTaskInfoPage(LoginRequiredMixin, MTurkBaseView):
         task_id = int(task_id)
         task = get_object_or_404(Task, pk = task_id, requester=requester)
 
+        try:
+            eligibility = eligibility_engine.evaluate_tasktype(task.tasktype)
+        except InvalidQualRequirementError:
+            # CreateHIT accepts requirements that can't be evaluated,
+            # for example a comparator without values.
+            eligibility = None
+
         cxt = {
             "active": "tasks",
             "requester": requester,
             "task" : task,
+            "eligibility" : eligibility,
         }
 
         return( render(request, "requester/task_info.html", cxt) )
@@ -346,7 +355,9 @@ class RequesterTaskApproveAll(LoginRequiredMixin, MTurkBaseView):
         if ( assignments.count() > 0 ):
             for assignment in assignments:
                 assignment.approve("Bulk Assignment Approval")
-                assignment.save()
+                # Assignments auto approved since they were loaded
+                # are skipped.
+                assignment.save_transition(AssignmentStatusField.SUBMITTED)
 
             messages.info(
                 request,
@@ -375,7 +386,9 @@ class RequesterTaskRejectAll(LoginRequiredMixin, MTurkBaseView):
         if ( assignments.count() > 0 ):
             for assignment in assignments:
                 assignment.reject("Bulk Assignment Rejection")
-                assignment.save()
+                # Assignments auto approved since they were loaded
+                # are skipped.
+                assignment.save_transition(AssignmentStatusField.SUBMITTED)
 
             messages.info(
                 request,
@@ -407,7 +420,12 @@ class RequesterTaskApproveAssignment(LoginRequiredMixin, MTurkBaseView):
             raise SuspiciousOperation("Attempt to Approve Assignment in Wrong State")
 
         assignment.approve("Approved via Web Interface")
-        assignment.save()
+        if ( not assignment.save_transition(AssignmentStatusField.SUBMITTED) ):
+            # The assignment was auto approved after it was loaded
+            messages.error(
+                request,
+                "Failed to Approve Assignment: it is no longer submitted"
+                )
 
         return(redirect("requester-task-info", task_id=task_id) )
 
@@ -429,7 +447,12 @@ class RequesterTaskRejectAssignment(LoginRequiredMixin, MTurkBaseView):
             raise SuspiciousOperation("Attempt to Reject Assignment in Wrong State")
 
         assignment.reject("Rejected via Web Interface")
-        assignment.save()
+        if ( not assignment.save_transition(AssignmentStatusField.SUBMITTED) ):
+            # The assignment was auto approved after it was loaded
+            messages.error(
+                request,
+                "Failed to Reject Assignment: it is no longer submitted"
+                )
 
         return(redirect("requester-task-info", task_id=task_id) )
 
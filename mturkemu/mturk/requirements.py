@@ -0,0 +1,279 @@
+# File: mturk/requirements.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the compiled
+# qualification requirements of a task type. Checking whether a
+# worker can accept a task with the QualificationRequirement models
+# costs a query per requirement for the worker's grant plus more
+# queries for the requirement's locales. Instead, the requirements
+# of a task type are compiled once into an immutable predicate
+# that is evaluated against a map of the worker's grants loaded in
+# a single query.
+#
+# The compiled requirements are cached per task type and the cache
+# entries are invalidated when the requirements of a task type
+# change.
+#
+# @note - the cache is per process - the requirements of a task
+#    type are not modified by the API after the task type is
+#    created, so this is only an issue when the requirements are
+#    edited in the admin site of another process.
+#
+
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from mturk.models import *
+from mturk.fields import *
+
+import operator
+import threading
+
+class CompiledRequirement(object):
+    """
+    Immutable form of a single QualificationRequirement. The
+    comparison is evaluated against the grant's (value, localeId)
+    tuple or None if the worker has no grant.
+    """
+    __slots__ = ("qual_id", "required_to_preview", "_test")
+
+    # Integer comparators that compare the grant value against
+    #   the first integer value of the requirement.
+    INT_COMPARATORS = {
+        QualComparatorField.LESS_THAN: operator.lt,
+        QualComparatorField.LESS_THAN_OR_EQUAL: operator.le,
+        QualComparatorField.GREATER_THAN: operator.gt,
+        QualComparatorField.GREATER_THAN_OR_EQUAL: operator.ge,
+    }
+
+    def __init__(self, qualId, comparator, intValues, localeIds, requiredToPreview):
+        """
+        @param intValues tuple of the integer values of the requirement
+        @param localeIds tuple of the pks of the locale values of the
+           requirement
+        """
+        object.__setattr__(self, "qual_id", qualId)
+        object.__setattr__(self, "required_to_preview", requiredToPreview)
+        object.__setattr__(
+            self, "_test", self.compile(comparator, intValues, localeIds)
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Compiled requirements are immutable")
+
+    @classmethod
+    def from_model(cls, qualreq):
+        """
+        @note - the requirement's 'locale_values' should be
+           prefetched.
+        """
+        return(
+            cls(
+                qualreq.qualification_id,
+                qualreq.comparator,
+                tuple(qualreq.get_int_values()),
+                tuple(sorted(loc.pk for loc in qualreq.locale_values.all())),
+                qualreq.required_to_preview,
+            )
+        )
+
+    def compile(self, comparator, intValues, localeIds):
+        """
+        Create the function that tests a grant against this
+        requirement.
+        """
+        if ( comparator == QualComparatorField.EXISTS ):
+            return( lambda grant: grant is not None )
+        if ( comparator == QualComparatorField.DOES_NOT_EXIST ):
+            return( lambda grant: grant is None )
+
+        if ( comparator in self.INT_COMPARATORS ):
+            if ( len(intValues) == 0 ):
+                test = self.invalid
+            else:
+                op = self.INT_COMPARATORS[comparator]
+                target = intValues[0]
+                test = lambda grant: op(grant[0], target)
+        elif ( comparator in [QualComparatorField.EQUAL_TO,
+                              QualComparatorField.NOT_EQUAL_TO] ):
+            if ( len(intValues) > 0 ):
+                target = intValues[0]
+                test = lambda grant: grant[0] == target
+            elif ( len(localeIds) > 0 ):
+                target = localeIds[0]
+                test = lambda grant: grant[1] == target
+            else:
+                test = self.invalid
+        elif ( comparator in [QualComparatorField.IN_SET,
+                              QualComparatorField.NOT_IN_SET] ):
+            if ( len(localeIds) > 0 ):
+                targets = frozenset(localeIds)
+                test = lambda grant: grant[1] in targets
+            elif ( len(intValues) > 0 ):
+                targets = frozenset(intValues)
+                test = lambda grant: grant[0] in targets
+            else:
+                test = self.invalid
+        else:
+            raise ValueError("Invalid Comparator: %s" % comparator)
+
+        negate = comparator in [
+            QualComparatorField.NOT_EQUAL_TO, QualComparatorField.NOT_IN_SET
+        ]
+        # A worker without a grant never meets a value comparison
+        if ( negate ):
+            return( lambda grant: grant is not None and not test(grant) )
+        return( lambda grant: grant is not None and test(grant) )
+
+    @staticmethod
+    def invalid(grant):
+        raise InvalidQualRequirementError()
+
+    def check(self, grant):
+        return( self._test(grant) )
+
+def load_grant_map(worker, qualIds=None):
+    """
+    Load a worker's active grants in one query.
+    @param qualIds optional list of qualification pks to load
+       the grants for. By default, all of the grants are loaded.
+    @return dict of qualification pk to a tuple of the grant's
+       (value, locale pk)
+    """
+    grants = QualificationGrant.objects.filter(
+        worker = worker,
+        active = True,
+        dispose = False,
+    )
+    if ( qualIds is not None ):
+        grants = grants.filter(qualification_id__in = qualIds)
+
+    grantMap = {}
+    for qualId, value, localeId in grants.values_list(
+            "qualification_id", "value", "locale_id"):
+        grantMap[qualId] = (value, localeId)
+    return(grantMap)
+
+class CompiledRequirements(object):
+    """
+    Immutable predicate for all of the qualification requirements
+    of a task type.
+    """
+    __slots__ = ("requirements", "qual_ids")
+
+    def __init__(self, requirements):
+        object.__setattr__(self, "requirements", tuple(requirements))
+        object.__setattr__(
+            self, "qual_ids",
+            frozenset(req.qual_id for req in self.requirements)
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Compiled requirements are immutable")
+
+    @classmethod
+    def from_tasktype(cls, tasktype):
+        qualreqs = tasktype.qualifications.all().prefetch_related(
+            "locale_values"
+        )
+        return( cls([ CompiledRequirement.from_model(q) for q in qualreqs ]) )
+
+    def load_grants(self, worker):
+        """
+        Load the worker's active grants for the qualifications of
+        these requirements in one query.
+        @return dict of qualification pk to a tuple of the grant's
+           (value, locale pk)
+        """
+        if ( len(self.qual_ids) == 0 ):
+            return({})
+        return( load_grant_map(worker, self.qual_ids) )
+
+    def evaluate(self, grantMap, preview=False):
+        """
+        Check a worker's grants against the requirements.
+        @param grantMap dict returned by 'load_grants'
+        @param preview if true, only the requirements that are
+           required to preview the task are checked.
+        """
+        for req in self.requirements:
+            if ( preview and not req.required_to_preview ):
+                continue
+            if ( not req.check(grantMap.get(req.qual_id)) ):
+                return(False)
+        return(True)
+
+    def check_worker(self, worker, preview=False):
+        return( self.evaluate(self.load_grants(worker), preview) )
+
+
+class RequirementsCache(object):
+    """
+    Cache of the compiled requirements of each task type.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Incremented on each invalidation so that requirements
+        #   compiled before an invalidation are not cached.
+        self._generation = 0
+
+    def get(self, tasktype):
+        entry = self._entries.get(tasktype.pk)
+        if ( entry is None ):
+            generation = self._generation
+            entry = CompiledRequirements.from_tasktype(tasktype)
+            with self._lock:
+                if ( generation == self._generation ):
+                    self._entries[tasktype.pk] = entry
+        return(entry)
+
+    def invalidate(self, tasktypeId=None):
+        """
+        Remove the compiled requirements of a task type or of all
+        task types if 'tasktypeId' is None.
+        """
+        with self._lock:
+            self._generation += 1
+            if ( tasktypeId is None ):
+                self._entries.clear()
+            else:
+                self._entries.pop(tasktypeId, None)
+
+requirements_cache = RequirementsCache()
+
+def get_requirements(tasktype):
+    """
+    @return CompiledRequirements object for the task type
+    """
+    return( requirements_cache.get(tasktype) )
+
+
+@receiver(m2m_changed, sender=TaskType.qualifications.through, dispatch_uid="mturk_reqs_tasktype")
+def invalidate_tasktype_reqs(sender, instance, reverse, **kwargs):
+    if ( kwargs["action"] not in ["post_add", "post_remove", "post_clear"] ):
+        return
+    if ( reverse ):
+        requirements_cache.invalidate()
+    else:
+        requirements_cache.invalidate(instance.pk)
+
+@receiver(m2m_changed, sender=QualificationRequirement.locale_values.through, dispatch_uid="mturk_reqs_locales")
+def invalidate_locale_reqs(sender, **kwargs):
+    if ( kwargs["action"] in ["post_add", "post_remove", "post_clear"] ):
+        requirements_cache.invalidate()
+
+@receiver(post_save, sender=QualificationRequirement, dispatch_uid="mturk_reqs_save")
+@receiver(post_delete, sender=QualificationRequirement, dispatch_uid="mturk_reqs_delete")
+def invalidate_reqs(sender, instance, **kwargs):
+    # A new requirement is not part of a task type until it is
+    #   added to the task type's qualifications.
+    if ( kwargs.get("created", False) ):
+        return
+    # A requirement may be shared by many task types
+    requirements_cache.invalidate()
+
+@receiver(post_delete, sender=TaskType, dispatch_uid="mturk_reqs_tasktype_delete")
+def invalidate_deleted_tasktype(sender, instance, **kwargs):
+    requirements_cache.invalidate(instance.pk)
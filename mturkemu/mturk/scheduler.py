@@ -0,0 +1,323 @@
+# File: mturk/scheduler.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the lifecycle
+# scheduler. The scheduler applies the time based state changes
+# of the tasks and assignments:
+#    1) Tasks that are still assignable when they expire are
+#       closed to new workers.
+#    2) Assignments that are not submitted before their deadline
+#       are abandoned.
+#    3) Submitted assignments that are not reviewed before their
+#       auto approval time are approved.
+#
+# Each of these is a job that selects the objects that are due
+# with a query on an index of (status, dispose, due time), so the
+# earliest due objects are found without scanning the table. Due
+# objects are transitioned in batches with bulk updates and the
+# assignment counters of the affected tasks are adjusted to match.
+#
+# The scheduler can be run in a background thread of the server
+# process (see 'MTURK_SCHEDULER_ENABLED') or as a separate process
+# with the 'RunScheduler' management command.
+#
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import F
+
+from mturk.models import *
+from mturk.fields import *
+from mturk.clock import clock
+
+from collections import Counter
+import threading
+import logging
+logger = logging.getLogger("mturk")
+
+class LifecycleJob(object):
+    """
+    Base class for a scheduler job that transitions objects
+    of a model whose due time field has passed.
+    """
+    name = None
+    model = None
+    due_field = None
+    # Filter selecting the objects that this job applies to - this
+    #   must match the leading columns of the due time index.
+    state = {}
+
+    def due_objects(self, now):
+        q = {"%s__lte" % self.due_field : now}
+        q.update(self.state)
+        return( self.model.objects.filter(**q).order_by(self.due_field) )
+
+    def next_due(self):
+        """
+        @return the earliest due time of the objects for this
+           job or None if there are no objects pending.
+        """
+        q = {"%s__isnull" % self.due_field : False}
+        q.update(self.state)
+        return(
+            self.model.objects.filter(**q).order_by(
+                self.due_field
+            ).values_list(self.due_field, flat=True).first()
+        )
+
+    def run_batch(self, now, batchSize):
+        """
+        Transition a batch of due objects.
+        @return tuple of the number of objects transitioned and a
+           list of the pks of the tasks that need a state check.
+        """
+        raise NotImplementedError()
+
+class TaskExpiryJob(LifecycleJob):
+    """
+    Close tasks that have expired while still assignable. Tasks
+    without pending assignments become reviewable, tasks with
+    pending assignments become unassignable until those
+    assignments are resolved - see 'Task.check_state_change'.
+    """
+    name = "expire"
+    model = Task
+    due_field = "expires"
+    state = {"status" : TaskStatusField.ASSIGNABLE, "dispose" : False}
+
+    def run_batch(self, now, batchSize):
+        pks = list(
+            self.due_objects(now).select_for_update().values_list(
+                "pk", flat=True
+            )[:batchSize]
+        )
+        if ( len(pks) == 0 ):
+            return(0, [])
+
+        openTasks = Task.objects.filter(
+            pk__in = pks, status = TaskStatusField.ASSIGNABLE
+        )
+        openTasks.filter(num_pending = 0).update(
+            status = TaskStatusField.REVIEWABLE
+        )
+        openTasks.update(status = TaskStatusField.UNASSIGNABLE)
+        # The state of these tasks has been completely determined
+        # so there are no further changes to check.
+        return(len(pks), [])
+
+class AssignmentJob(LifecycleJob):
+    """
+    Base for the jobs that transition assignments from one counted
+    state to another.
+    """
+    model = Assignment
+    old_counter = None
+    new_counter = None
+
+    def transition(self, pks):
+        """
+        Apply the transition to the passed assignments.
+        """
+        raise NotImplementedError()
+
+    def record(self, rows):
+        """
+        Record statistics for the assignments that were transitioned.
+        """
+        pass
+
+    def run_batch(self, now, batchSize):
+        rows = list(
+            self.due_objects(now).select_for_update().values_list(
+                "pk", "task_id", "worker_id"
+            )[:batchSize]
+        )
+        if ( len(rows) == 0 ):
+            return(0, [])
+
+        # The due rows are locked for this transaction so all of
+        # them will be updated.
+        self.transition([ pk for pk,_,_ in rows ])
+        self.record(rows)
+
+        taskCounts = Counter([ taskId for _,taskId,_ in rows ])
+        for taskId, count in taskCounts.items():
+            changes = { self.old_counter : F(self.old_counter) - count }
+            if ( self.new_counter is not None ):
+                changes[self.new_counter] = F(self.new_counter) + count
+            Task.objects.filter(pk = taskId).update(**changes)
+
+        return( len(rows), list(taskCounts.keys()) )
+
+class AssignmentAbandonJob(AssignmentJob):
+    """
+    Assignments that pass their deadline without being
+    submitted are abandoned - the worker loses the assignment
+    and the slot becomes available to other workers.
+    """
+    name = "abandon"
+    due_field = "deadline"
+    state = {"status" : AssignmentStatusField.ACCEPTED, "dispose" : False}
+    old_counter = "num_pending"
+    new_counter = None
+
+    def transition(self, pks):
+        Assignment.objects.filter(pk__in = pks).update(dispose = True)
+
+    def record(self, rows):
+        workerCounts = Counter([ workerId for _,_,workerId in rows ])
+        for workerId, count in workerCounts.items():
+            Worker.objects.filter(pk = workerId).update(
+                abandoned_hits = F("abandoned_hits") + count
+            )
+
+class AssignmentAutoApproveJob(AssignmentJob):
+    """
+    Submitted assignments that the requester has not reviewed
+    by the auto approval time are approved.
+    """
+    name = "approve"
+    due_field = "auto_approve"
+    state = {"status" : AssignmentStatusField.SUBMITTED, "dispose" : False}
+    old_counter = "num_submitted"
+    new_counter = "num_completed"
+
+    def transition(self, pks):
+        Assignment.objects.filter(pk__in = pks).update(
+            status = AssignmentStatusField.APPROVED,
+            approved = F("auto_approve"),
+        )
+
+
+class LifecycleScheduler(object):
+    """
+    Apply the time based state transitions of the tasks and
+    assignments.
+    @param now function returning the current time - by default
+        this is the emulator clock.
+    @param batchSize max number of objects transitioned in one
+        database transaction.
+    """
+
+    def __init__(self, now=None, batchSize=None):
+        if ( now is None ):
+            now = clock.now
+        if ( batchSize is None ):
+            batchSize = getattr(settings, "MTURK_SCHEDULER_BATCH_SIZE", 500)
+        self.now = now
+        self.batch_size = batchSize
+
+        self.jobs = [
+            TaskExpiryJob(),
+            AssignmentAbandonJob(),
+            AssignmentAutoApproveJob(),
+        ]
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+    def next_due(self):
+        """
+        @return earliest due time of all pending transitions or
+            None if there are no pending transitions.
+        """
+        dueTimes = [ job.next_due() for job in self.jobs ]
+        dueTimes = [ t for t in dueTimes if t is not None ]
+        if ( len(dueTimes) == 0 ):
+            return(None)
+        return( min(dueTimes) )
+
+    def run_job(self, job, now):
+        """
+        Run a job until there are no more due objects.
+        @return number of objects transitioned
+        """
+        total = 0
+        while ( True ):
+            with transaction.atomic():
+                count, taskIds = job.run_batch(now, self.batch_size)
+                for task in Task.objects.filter(pk__in = taskIds):
+                    task.check_state_change(now)
+            total += count
+            if ( count < self.batch_size ):
+                break
+        return(total)
+
+    def run_once(self):
+        """
+        Apply all transitions that are due now.
+        @return dict of job name to number of objects transitioned
+        """
+        now = self.now()
+        stats = {}
+        for job in self.jobs:
+            stats[job.name] = self.run_job(job, now)
+        return(stats)
+
+    def wait_time(self, interval):
+        """
+        Determine how long to wait before the next run - this is the
+        real time until the next transition is due, limited to the
+        polling interval so that newly created objects with earlier
+        due times are not missed.
+        """
+        nextDue = self.next_due()
+        if ( nextDue is None ):
+            return(interval)
+        delay = (nextDue - self.now()).total_seconds()
+        if ( self.now == clock.now ):
+            delay = clock.real_seconds(max(delay, 0.0))
+            if ( delay is None ):
+                # Clock is frozen
+                return(interval)
+        return( min(max(delay, 0.0), interval) )
+
+    def wakeup(self):
+        """
+        Run the background thread now instead of waiting for the
+        next due time - for example, after the clock has changed.
+        """
+        self._wakeup.set()
+
+    def run_forever(self, interval):
+        """
+        Run the scheduler until 'stop' is called.
+        @param interval max number of seconds between runs.
+        """
+        while ( not self._stop.is_set() ):
+            try:
+                stats = self.run_once()
+                if ( sum(stats.values()) > 0 ):
+                    logger.info("Scheduler Transitions: %s" % stats)
+                delay = self.wait_time(interval)
+            except Exception:
+                logger.exception("Scheduler Run Failed")
+                delay = interval
+            finally:
+                close_old_connections()
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def start(self, interval=None):
+        """
+        Start the scheduler in a background thread.
+        """
+        if ( interval is None ):
+            interval = getattr(settings, "MTURK_SCHEDULER_INTERVAL", 5)
+        if ( self._thread is not None ):
+            raise Exception("Scheduler is already running")
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target = self.run_forever, args = (interval,),
+            name = "mturk-scheduler", daemon = True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        if ( self._thread is not None ):
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,106 @@
+# File: mturk/scoring.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the batch scoring of
+# the stored qualification test answers. When the answer key of a
+# qualification is updated, the answers that workers submitted for
+# the approved requests are scored again with the new answer key
+# and the values of the workers' grants are updated. The answer key
+# is compiled once and the grants are updated with one query for
+# each distinct score, so re-scoring does not depend on the number
+# of requests for the number of queries.
+#
+
+from django.db import transaction
+
+from mturk.models import *
+from mturk.fields import *
+from mturk.xml.answerkey import get_answer_key, read_stored_answers
+
+import time
+import logging
+logger = logging.getLogger("mturk")
+
+class RescoreResult(object):
+    def __init__(self):
+        self.num_requests = 0
+        self.num_changed = 0
+        self.num_failed = 0
+        self.elapsed = 0.0
+
+class InvalidRescoreError(Exception):
+    def __init__(self, qual):
+        super().__init__(
+            "Qualification %s does not have an AnswerKey" % qual.aws_id
+        )
+
+def rescore_requests(qual, batchSize=500):
+    """
+    Score the stored test answers of the approved requests for a
+    qualification with its current answer key and update the
+    values of the workers' active grants.
+    @param batchSize max number of grants in each update query
+    @return RescoreResult object
+    """
+    if ( len(qual.answer) == 0 ):
+        raise InvalidRescoreError(qual)
+
+    start = time.perf_counter()
+    result = RescoreResult()
+    answerKey = get_answer_key(qual.answer)
+
+    grantValues = dict(
+        QualificationGrant.objects.filter(
+            qualification = qual,
+            active = True,
+            dispose = False,
+        ).values_list("worker_id", "value")
+    )
+
+    # The latest request of a worker wins
+    scores = {}
+    reqs = QualificationRequest.objects.filter(
+        qualification = qual,
+        state = QualReqStatusField.APPROVED,
+    ).exclude(
+        answer = ""
+    ).order_by("last_submitted", "pk").values_list("worker_id", "answer")
+
+    for workerId, content in reqs.iterator():
+        result.num_requests += 1
+        try:
+            scores[workerId] = answerKey.score_answers(
+                read_stored_answers(content)
+            )
+        except Exception as exc:
+            logger.error("Qualification Test Scoring Fails: %s" % str(exc))
+            result.num_failed += 1
+
+    # Group the workers whose grant value changed by the new value
+    updates = {}
+    for workerId, score in scores.items():
+        oldValue = grantValues.get(workerId)
+        if ( oldValue is None or oldValue == score ):
+            continue
+        updates.setdefault(score, []).append(workerId)
+        result.num_changed += 1
+
+    with transaction.atomic():
+        for score, workerIds in updates.items():
+            for i in range(0, len(workerIds), batchSize):
+                QualificationGrant.objects.filter(
+                    qualification = qual,
+                    worker_id__in = workerIds[i:i+batchSize],
+                    active = True,
+                    dispose = False,
+                ).update(value = score)
+
+    result.elapsed = time.perf_counter() - start
+    logger.info(
+        "Rescored %d Requests for %s: %d Grants Changed, %d Failed" % (
+            result.num_requests, qual.aws_id,
+            result.num_changed, result.num_failed
+        )
+    )
+    return(result)
@@ -0,0 +1,81 @@
+# File: mturk/serializers.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the batch serializers
+# used to generate the responses of the List* API methods. The
+# 'serialize' methods of the models follow their related objects
+# lazily which results in several queries per object in a page.
+# Here we load the related objects for all the objects in a page
+# at once, so that serializing a page takes a fixed number of
+# queries no matter how many objects are in the page.
+#
+
+from django.db.models import prefetch_related_objects
+
+from mturk.models import *
+
+class BatchSerializer(object):
+    """
+    Serializer for a list of objects of a particular model type.
+    @param related list of related object lookups (in the
+       'prefetch_related' format) that the model's serialize
+       method accesses.
+    """
+    def __init__(self, related):
+        self.related = tuple(related)
+
+    def load(self, objList):
+        """
+        Load the related objects for all of the objects in
+        the list. The objects are cached on the model objects
+        so that the 'serialize' method does not need to hit the
+        database.
+        """
+        if ( len(objList) > 0 and len(self.related) > 0 ):
+            prefetch_related_objects(objList, *self.related)
+
+    def serialize(self, objList, **kwargs):
+        objList = list(objList)
+        self.load(objList)
+        return( [ obj.serialize(**kwargs) for obj in objList ] )
+
+TASKTYPE_RELATED = (
+    "tasktype",
+    "tasktype__keywords",
+    "tasktype__qualifications__qualification",
+    "tasktype__qualifications__locale_values",
+)
+
+SERIALIZERS = {
+    Task : BatchSerializer(("question_blob",) + TASKTYPE_RELATED),
+    Assignment : BatchSerializer(["worker", "task"]),
+    Qualification : BatchSerializer(["keywords"]),
+    QualificationGrant : BatchSerializer(
+        ["worker", "qualification", "locale"]
+    ),
+    QualificationRequest : BatchSerializer(["worker", "qualification"]),
+    BonusPayment : BatchSerializer(["worker", "assignment"]),
+    WorkerBlock : BatchSerializer(["worker"]),
+}
+
+def get_serializer(model):
+    try:
+        return( SERIALIZERS[model] )
+    except KeyError:
+        # Models without related objects don't need any
+        # preloading.
+        return( BatchSerializer([]) )
+
+def serialize_list(objList, **kwargs):
+    """
+    Serialize a page of objects of the same model type.
+    @param objList list of model objects
+    @param kwargs arguments passed to the model's serialize method
+    @return list of dict objects
+    """
+    objList = list(objList)
+    if ( len(objList) == 0 ):
+        return([])
+    serializer = get_serializer(type(objList[0]))
+    return( serializer.serialize(objList, **kwargs) )
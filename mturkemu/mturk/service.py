@@ -0,0 +1,139 @@
+# File: mturk/service.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a process wide
+# registry for the botocore mturk service model. Loading the
+# service definition requires searching the python path,
+# parsing a large json file and constructing the botocore
+# model objects - we only want to do this once per process
+# and then share the results across all of the API requests.
+#
+
+from django.conf import settings
+
+from mturk.loader import Loader
+from mturk.validators import ShapeCompiler, OperationValidator, OutputSampler
+from mturk.extensions import EmulatorExtensions
+
+from botocore.model import ServiceModel
+import threading
+import logging
+logger = logging.getLogger("mturk")
+
+class MTurkService(object):
+    """
+    Container for the loaded mturk service definition, the
+    operation models, and the handler object that implements
+    the operations.
+    @note - objects of this type are shared across threads so
+       they must be treated as read-only after construction.
+    """
+
+    def __init__(self, serviceFile):
+
+        self.service_file = serviceFile
+        self.definition = Loader.load_service_defs(serviceFile)
+        self.target_prefix = self.definition["metadata"]["targetPrefix"]
+        self.model = ServiceModel(self.definition, "mturk")
+
+        # Operation models are normally constructed lazily by the
+        # service model on each access - we construct them all now
+        # so that request processing is just a dict lookup.
+        self.operations = {}
+        for name in self.model.operation_names:
+            self.operations[name] = self.model.operation_model(name)
+
+        # Compile the input/output validators for each operation.
+        # The compiler is shared so that common shapes are only
+        # compiled once.
+        compiler = ShapeCompiler()
+        self.validators = {}
+        for name, opModel in self.operations.items():
+            self.validators[name] = OperationValidator(opModel, compiler)
+
+        self.output_sampler = OutputSampler(
+            getattr(settings, "MTURK_OUTPUT_VALIDATION_RATE", 1)
+        )
+
+        # Import here to prevent a circular import between the
+        # models and the service registry.
+        from mturk.handlers import MTurkHandlers
+        self.handlers = MTurkHandlers()
+        self.extensions = EmulatorExtensions()
+
+    def has_operation(self, name):
+        return( name in self.operations )
+
+    def operation_model(self, name):
+        return( self.operations[name] )
+
+    def get_validator(self, name):
+        return( self.validators[name] )
+
+    def get_handler(self, name):
+        return( getattr(self.handlers, name) )
+
+    def get_extension(self, name):
+        """
+        @return handler for an emulator specific operation
+        """
+        def method(**kwargs):
+            return( self.extensions.dispatch(name, **kwargs) )
+        return(method)
+
+
+class ServiceRegistry(object):
+    """
+    Process wide registry of the mturk service. The service is
+    loaded lazily on first use or explicitly via the 'warmup'
+    method at server startup.
+    """
+
+    _lock = threading.Lock()
+    _service = None
+
+    @staticmethod
+    def get_service_file():
+        serviceFile = getattr(settings, "MTURK_SERVICE_FILE", None)
+        if ( serviceFile is None ):
+            serviceFile = Loader.find_mturk_service_file()
+        if ( serviceFile is None ):
+            raise Exception("Unable to find the mturk service definition file")
+        return(serviceFile)
+
+    @classmethod
+    def get(cls):
+        """
+        @return MTurkService object for this process
+        """
+        service = cls._service
+        if ( service is not None ):
+            return(service)
+
+        with cls._lock:
+            # Another thread may have loaded the service while
+            # we were waiting for the lock.
+            if ( cls._service is None ):
+                serviceFile = cls.get_service_file()
+                cls._service = MTurkService(serviceFile)
+                logger.info("Loaded MTurk Service Model: %s" % serviceFile)
+            return(cls._service)
+
+    @classmethod
+    def warmup(cls):
+        """
+        Load the service model now - this is intended to be
+        called at server startup so that preforked worker
+        processes inherit the loaded model.
+        """
+        return(cls.get())
+
+    @classmethod
+    def reset(cls):
+        """
+        Drop the loaded service - the next call to 'get' will
+        reload the service definition.
+        """
+        with cls._lock:
+            cls._service = None
@@ -0,0 +1,321 @@
+# File: mturk/snapshot.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of named snapshots of the
+# emulator database. A snapshot is a copy of the whole sqlite
+# database in the 'MTURK_SNAPSHOT_DIR' directory, so a test harness
+# can seed the emulator once (for example, with thousands of HITs),
+# take a snapshot and then restore it before each test instead of
+# rebuilding the data with 'migrate' and 'InitMTurkData'.
+#
+# The databases are copied with sqlite's online backup API when the
+# python sqlite3 module provides it (python 3.7 and later).
+# Otherwise, snapshots are written with 'VACUUM INTO' and restored
+# by copying the tables of the attached snapshot in one
+# transaction.
+#
+# The 'pristine' snapshot is the commissioned state of the emulator
+# - the database after the migrations and 'create_initial_data'.
+# It is built the first time that the emulator is reset and is
+# rebuilt when the migrations of the database change.
+#
+# @note - snapshots replace the whole database and can't be taken
+#    or restored inside a transaction.
+#
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection
+
+from mturk.clock import clock
+from mturk.requirements import requirements_cache
+from mturk.population import eligibility_engine
+
+from collections import namedtuple
+from datetime import datetime, timezone
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import logging
+logger = logging.getLogger("mturk")
+
+PRISTINE_SNAPSHOT = "pristine"
+SNAPSHOT_EXT = ".sqlite3"
+
+class SnapshotError(Exception):
+    pass
+
+class SnapshotInfo(namedtuple("SnapshotInfo", ["name", "path", "size", "created"])):
+
+    def serialize(self):
+        return({
+            "Name" : self.name,
+            "Size" : self.size,
+            "CreationTime" : self.created,
+        })
+
+def migration_state(conn):
+    """
+    @param conn sqlite3 connection
+    @return tuple of the (app, name) of the applied migrations
+    """
+    try:
+        rows = conn.execute(
+            "SELECT app, name FROM django_migrations ORDER BY app, name"
+        ).fetchall()
+    except sqlite3.DatabaseError as exc:
+        raise SnapshotError("Invalid Snapshot Database: %s" % str(exc))
+    return( tuple( tuple(row) for row in rows ) )
+
+def invalidate_process_caches():
+    """
+    Drop the process wide state that is derived from the contents
+    of the database. The caches keyed by a hash of the content
+    (questions, validation outcomes, answer keys) remain valid.
+    """
+    requirements_cache.invalidate()
+    eligibility_engine.invalidate_workers()
+    ContentType.objects.clear_cache()
+
+    # Import here to prevent a circular import with the models
+    from mturk import startup
+    if ( startup.scheduler is not None ):
+        startup.scheduler.wakeup()
+
+
+class SnapshotStore(object):
+    """
+    Directory of named snapshots of the 'default' database.
+    """
+
+    NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+    # Only one snapshot operation at a time in this process
+    _lock = threading.Lock()
+
+    def __init__(self, directory=None):
+        if ( directory is None ):
+            directory = getattr(
+                settings, "MTURK_SNAPSHOT_DIR",
+                os.path.join(settings.BASE_DIR, "snapshots")
+            )
+        self.directory = directory
+
+    def check_name(self, name):
+        if ( not isinstance(name, str) or
+             self.NAME_PATTERN.match(name) is None or
+             name.endswith(SNAPSHOT_EXT) ):
+            raise SnapshotError("Invalid Snapshot Name: %s" % name)
+
+    def path(self, name):
+        self.check_name(name)
+        return( os.path.join(self.directory, name + SNAPSHOT_EXT) )
+
+    def exists(self, name):
+        return( os.path.isfile(self.path(name)) )
+
+    def info(self, name):
+        path = self.path(name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            raise SnapshotError("Snapshot Does Not Exist: %s" % name)
+        return(
+            SnapshotInfo(
+                name, path, st.st_size,
+                datetime.fromtimestamp(st.st_mtime, timezone.utc)
+            )
+        )
+
+    def list(self):
+        """
+        @return list of SnapshotInfo objects ordered by name
+        """
+        if ( not os.path.isdir(self.directory) ):
+            return([])
+        names = [
+            fname[0:-len(SNAPSHOT_EXT)]
+            for fname in os.listdir(self.directory)
+            if fname.endswith(SNAPSHOT_EXT)
+        ]
+        return([
+            self.info(name) for name in sorted(names)
+            if self.NAME_PATTERN.match(name) is not None
+        ])
+
+    def delete(self, name):
+        path = self.path(name)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            raise SnapshotError("Snapshot Does Not Exist: %s" % name)
+
+    def get_connection(self):
+        """
+        @return the sqlite3 connection of the 'default' database
+        """
+        if ( connection.vendor != "sqlite" ):
+            raise SnapshotError(
+                "Snapshots require the sqlite database backend"
+            )
+        if ( connection.in_atomic_block ):
+            raise SnapshotError(
+                "Snapshots can not be used inside a transaction"
+            )
+        connection.ensure_connection()
+        return(connection.connection)
+
+    def take(self, name):
+        """
+        Write a snapshot of the database, replacing the snapshot
+        with the same name.
+        @return SnapshotInfo object
+        """
+        if ( name == PRISTINE_SNAPSHOT ):
+            raise SnapshotError("Snapshot Name is Reserved: %s" % name)
+        return( self._write(name) )
+
+    def _write(self, name):
+        path = self.path(name)
+        tmpPath = path + ".tmp"
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            conn = self.get_connection()
+            if ( os.path.exists(tmpPath) ):
+                os.remove(tmpPath)
+            try:
+                if ( hasattr(conn, "backup") ):
+                    dst = sqlite3.connect(tmpPath)
+                    try:
+                        conn.backup(dst)
+                    finally:
+                        dst.close()
+                else:
+                    conn.execute("VACUUM INTO ?", (tmpPath,))
+                os.replace(tmpPath, path)
+            except Exception:
+                if ( os.path.exists(tmpPath) ):
+                    os.remove(tmpPath)
+                raise
+        logger.info("Took Snapshot: %s" % name)
+        return( self.info(name) )
+
+    def restore(self, name):
+        """
+        Replace the contents of the database with a snapshot.
+        @return number of seconds to restore the snapshot
+        """
+        path = self.path(name)
+        if ( not os.path.isfile(path) ):
+            raise SnapshotError("Snapshot Does Not Exist: %s" % name)
+
+        start = time.perf_counter()
+        with self._lock:
+            conn = self.get_connection()
+            src = sqlite3.connect(path)
+            try:
+                if ( migration_state(src) != migration_state(conn) ):
+                    raise SnapshotError(
+                        "Snapshot '%s' was taken with different migrations" % name
+                    )
+                if ( hasattr(src, "backup") ):
+                    src.backup(conn)
+                else:
+                    self.copy_tables(conn, path)
+            finally:
+                src.close()
+        invalidate_process_caches()
+
+        elapsed = time.perf_counter() - start
+        logger.info("Restored Snapshot: %s in %.3fs" % (name, elapsed))
+        return(elapsed)
+
+    def copy_tables(self, conn, path):
+        """
+        Replace the rows of each table with the rows of the attached
+        snapshot in one transaction.
+        @note - the snapshot's schema must match the database's.
+        """
+        conn.execute("ATTACH DATABASE ? AS snapshot", (path,))
+        try:
+            tables = [
+                row[0] for row in conn.execute(
+                    "SELECT name FROM snapshot.sqlite_master WHERE type = 'table' "
+                    "AND name NOT LIKE 'sqlite_%' ORDER BY name"
+                )
+            ]
+            hasSequence = conn.execute(
+                "SELECT COUNT(*) FROM snapshot.sqlite_master "
+                "WHERE name = 'sqlite_sequence'"
+            ).fetchone()[0] > 0
+            if ( hasSequence ):
+                tables.append("sqlite_sequence")
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in tables:
+                    conn.execute('DELETE FROM main."%s"' % table)
+                    conn.execute(
+                        'INSERT INTO main."%s" SELECT * FROM snapshot."%s"' %
+                        (table, table)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.execute("DETACH DATABASE snapshot")
+
+    def is_pristine_current(self):
+        """
+        @return True if the pristine snapshot exists and was taken
+           with the migrations of the database.
+        """
+        path = self.path(PRISTINE_SNAPSHOT)
+        if ( not os.path.isfile(path) ):
+            return(False)
+        src = sqlite3.connect(path)
+        try:
+            return( migration_state(src) == migration_state(self.get_connection()) )
+        except SnapshotError:
+            return(False)
+        finally:
+            src.close()
+
+    def commission(self):
+        """
+        Remove all of the data from the database, create the
+        commissioning data and save the result as the pristine
+        snapshot.
+        """
+        # Import here to prevent a circular import with the models
+        from django.contrib.auth.models import User
+        from mturk.models import Worker, Requester, Qualification, Locale
+        from mturk.management.commands.InitMTurkData import create_initial_data
+
+        self.get_connection()
+        call_command("flush", interactive=False, verbosity=0)
+        invalidate_process_caches()
+        create_initial_data(User, Worker, Requester, Qualification, Locale)
+        return( self._write(PRISTINE_SNAPSHOT) )
+
+    def reset(self, rebuild=False):
+        """
+        Return the emulator to its commissioned state. The emulator
+        clock is returned to the real time.
+        @param rebuild if true, the pristine snapshot is rebuilt
+           even if it is current.
+        @return number of seconds to reset the database
+        """
+        start = time.perf_counter()
+        if ( rebuild or not self.is_pristine_current() ):
+            self.commission()
+        else:
+            self.restore(PRISTINE_SNAPSHOT)
+        clock.reset()
+        return( time.perf_counter() - start )
@@ -0,0 +1,103 @@
+# File: mturk/startup.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the server startup
+# hook. Expensive process wide state is initialized here so that
+# it is ready before the first request arrives. When the WSGI
+# application is preloaded by a preforking server (for example,
+# gunicorn's '--preload'), this state is shared by the workers.
+#
+
+# @note - this module is imported by 'profile_startup' before
+#    django is setup, so the mturk modules are imported in the
+#    functions that use them.
+
+from django.conf import settings
+
+import importlib
+import json
+import os
+import time
+import logging
+logger = logging.getLogger("mturk")
+
+# Lifecycle scheduler running in this process, if any.
+scheduler = None
+
+def start_scheduler():
+    """
+    Start the lifecycle scheduler in a background thread of
+    this process.
+    """
+    global scheduler
+    if ( scheduler is not None ):
+        return(scheduler)
+
+    from mturk.scheduler import LifecycleScheduler
+    scheduler = LifecycleScheduler()
+    scheduler.start()
+    logger.info("Started Lifecycle Scheduler")
+    return(scheduler)
+
+def warmup():
+    """
+    Load the process wide state for the mturk API - the service
+    model and the compiled XML schemas.
+    """
+    from mturk.service import ServiceRegistry
+    from mturk.xml.schemas import SchemaRegistry
+    ServiceRegistry.warmup()
+    SchemaRegistry.warmup()
+
+def server_startup():
+    """
+    Warm up the process wide state for the mturk API.
+    """
+    warmup()
+    if ( getattr(settings, "MTURK_SCHEDULER_ENABLED", False) ):
+        start_scheduler()
+    logger.info("MTurk Emulator Startup Complete")
+
+def profile_startup():
+    """
+    Time each step of the startup of a server process.
+    @note - this must be called in a new interpreter, before
+       django is setup - modules that are already imported are
+       not counted.
+    @return list of (step name, seconds) tuples
+    """
+    timings = []
+    def timed(name, func):
+        start = time.perf_counter()
+        ret = func()
+        timings.append( (name, time.perf_counter() - start) )
+        return(ret)
+
+    for module in ["lxml.etree", "numpy", "botocore.model"]:
+        timed("import %s" % module, lambda: importlib.import_module(module))
+
+    import django
+    timed("django.setup", django.setup)
+    timed(
+        "import urls",
+        lambda: importlib.import_module(settings.ROOT_URLCONF)
+    )
+
+    from mturk.service import ServiceRegistry
+    from mturk.xml.schemas import SchemaRegistry
+    timed("load service model", ServiceRegistry.warmup)
+    for name in SchemaRegistry.names():
+        timed(
+            "compile schema %s" % name,
+            lambda: SchemaRegistry.get_parser(name)
+        )
+    return(timings)
+
+def main_profile():
+    """
+    Entry point of the profiling subprocess of the 'EmuStartup'
+    command - the timings are written to stdout as json.
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mturkemu.settings")
+    print( json.dumps(profile_startup()) )
@@ -0,0 +1,650 @@
+# File: mturk/swarm.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a swarm of simulated
+# workers that generate sustained worker traffic for load testing
+# the requester side of an application (for example, polling for
+# submitted assignments and reviewing them). Each virtual worker:
+#    - arrives after a delay from the inter-arrival distribution,
+#    - requests the qualifications of its profile (and takes their
+#      tests with generated answers),
+#    - repeatedly browses the HIT groups that it can work on,
+#      accepts the next task of a random group, works on it for a
+#      time from the work time distribution and then returns,
+#      abandons or submits the assignment with generated answers,
+#    - waits for a time from the think time distribution.
+# The workers act through the WorkerActor, like the worker pages.
+#
+# The work and think times are in emulator seconds and are scaled
+# by the emulator clock's speed. The virtual workers run in threads
+# or are split across forked processes, each with its own database
+# connection. The latency of each operation is recorded and the
+# results of the workers are merged into a per operation report.
+#
+# Example:
+#    config = SwarmConfig(
+#        50, thinkTime = ExponentialDistribution(30.0), duration = 600
+#    )
+#    engine = SwarmEngine(config)
+#    engine.setup()
+#    result = engine.run()
+#
+
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction, OperationalError
+
+from mturk.models import *
+from mturk.fields import *
+from mturk.clock import clock
+from mturk.worker.actor import WorkerActor
+from mturk.worker.TasksActor import TaskNotAvailableError
+from mturk.xml.answergen import AnswerGenerator
+
+from collections import Counter
+import multiprocessing
+import random
+import threading
+import time
+import uuid
+
+import logging
+logger = logging.getLogger("mturk")
+
+class SwarmError(Exception):
+    pass
+
+#######################
+# Distributions
+#######################
+
+class ConstantDistribution(object):
+    def __init__(self, value):
+        if ( value < 0 ):
+            raise ValueError("Invalid Duration: %s" % value)
+        self.value = value
+
+    def sample(self, rng):
+        return(self.value)
+
+class UniformDistribution(object):
+    def __init__(self, low, high):
+        if ( low < 0 or high < low ):
+            raise ValueError("Invalid Uniform Range: %s,%s" % (low, high))
+        self.low = low
+        self.high = high
+
+    def sample(self, rng):
+        return( rng.uniform(self.low, self.high) )
+
+class ExponentialDistribution(object):
+    def __init__(self, mean):
+        if ( mean < 0 ):
+            raise ValueError("Invalid Mean: %s" % mean)
+        self.mean = mean
+
+    def sample(self, rng):
+        if ( self.mean == 0 ):
+            return(0.0)
+        return( rng.expovariate(1.0 / self.mean) )
+
+def parse_distribution(spec):
+    """
+    Parse a distribution of durations in seconds:
+       "<seconds>" or "const:<seconds>"
+       "uniform:<low>,<high>"
+       "exp:<mean>"
+    """
+    kind, sep, args = spec.partition(":")
+    if ( len(sep) == 0 ):
+        kind, args = "const", spec
+    try:
+        values = [ float(arg) for arg in args.split(",") ]
+    except ValueError:
+        raise ValueError("Invalid Distribution: %s" % spec)
+
+    if ( kind == "const" and len(values) == 1 ):
+        return( ConstantDistribution(values[0]) )
+    if ( kind == "uniform" and len(values) == 2 ):
+        return( UniformDistribution(*values) )
+    if ( kind == "exp" and len(values) == 1 ):
+        return( ExponentialDistribution(values[0]) )
+    raise ValueError("Invalid Distribution: %s" % spec)
+
+#######################
+# Configuration
+#######################
+
+class WorkerProfile(object):
+    """
+    Behavior and qualifications of a group of virtual workers.
+    @param weight relative number of workers with this profile
+    @param grants dict of qualification type id to the value of a
+       grant that the workers are given when they are created.
+    @param requestQuals list of the qualification type ids that
+       the workers request when they arrive.
+    @param returnRate probability that an accepted assignment is
+       returned.
+    @param abandonRate probability that an accepted assignment is
+       abandoned - it is left to the scheduler to expire.
+    """
+    def __init__(self, name="default", weight=1.0, grants=None, requestQuals=None,
+                 returnRate=0.0, abandonRate=0.0):
+        if ( weight <= 0 ):
+            raise ValueError("Invalid Profile Weight: %s" % weight)
+        if ( returnRate < 0 or abandonRate < 0 or
+             returnRate + abandonRate > 1.0 ):
+            raise ValueError("Invalid Return/Abandon Rates")
+        self.name = name
+        self.weight = weight
+        self.grants = dict(grants or {})
+        self.request_quals = list(requestQuals or [])
+        self.return_rate = returnRate
+        self.abandon_rate = abandonRate
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create a profile from a dict in the format:
+           {
+              "Name" : "careful",
+              "Weight" : 2,
+              "Grants" : { "<QualificationTypeId>" : 90 },
+              "RequestQualifications" : [ "<QualificationTypeId>" ],
+              "ReturnRate" : 0.1,
+              "AbandonRate" : 0.05
+           }
+        """
+        return(
+            cls(
+                name = data.get("Name", "default"),
+                weight = data.get("Weight", 1.0),
+                grants = data.get("Grants", None),
+                requestQuals = data.get("RequestQualifications", None),
+                returnRate = data.get("ReturnRate", 0.0),
+                abandonRate = data.get("AbandonRate", 0.0),
+            )
+        )
+
+class SwarmConfig(object):
+    """
+    @param numWorkers number of virtual workers
+    @param profiles list of WorkerProfile objects
+    @param arrival distribution of the time between the arrivals
+       of the workers in real seconds
+    @param workTime distribution of the time between accepting and
+       completing an assignment in emulator seconds
+    @param thinkTime distribution of the time between assignments
+       in emulator seconds
+    @param duration max number of real seconds to run
+    @param maxTasks max number of assignments accepted by a worker
+    @param exitWhenIdle if true, a worker stops when there are no
+       HIT groups that it can work on. Otherwise, it checks again
+       every 'idleInterval' real seconds.
+    @param hitTypeIds optional list of the HIT type ids that the
+       workers work on.
+    @param parallelism "thread" or "process"
+    @param numProcesses number of processes when the parallelism is
+       "process" - the workers are split across the processes.
+    @param seed random seed for reproducible runs
+    """
+
+    PARALLELISM = ["thread", "process"]
+
+    def __init__(self, numWorkers, profiles=None, arrival=None, workTime=None,
+                 thinkTime=None, duration=None, maxTasks=None,
+                 exitWhenIdle=True, idleInterval=1.0, hitTypeIds=None,
+                 parallelism="thread", numProcesses=None, seed=None):
+        if ( numWorkers <= 0 ):
+            raise ValueError("Invalid Number of Workers: %d" % numWorkers)
+        if ( parallelism not in self.PARALLELISM ):
+            raise ValueError("Invalid Parallelism: %s" % parallelism)
+        if ( not exitWhenIdle and duration is None and maxTasks is None ):
+            raise ValueError(
+                "A duration or max tasks is required if the workers don't exit when idle"
+            )
+        self.num_workers = numWorkers
+        self.profiles = profiles or [ WorkerProfile() ]
+        self.arrival = arrival or ConstantDistribution(0)
+        self.work_time = workTime or ConstantDistribution(0)
+        self.think_time = thinkTime or ConstantDistribution(0)
+        self.duration = duration
+        self.max_tasks = maxTasks
+        self.exit_when_idle = exitWhenIdle
+        self.idle_interval = idleInterval
+        self.hit_type_ids = hitTypeIds
+        self.parallelism = parallelism
+        if ( numProcesses is None ):
+            numProcesses = multiprocessing.cpu_count()
+        self.num_processes = max(1, min(numProcesses, numWorkers))
+        self.seed = seed
+
+#######################
+# Results
+#######################
+
+class OperationStats(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latencies = []
+
+    def record(self, elapsed, ok):
+        self.count += 1
+        if ( not ok ):
+            self.errors += 1
+        self.latencies.append(elapsed)
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.latencies.extend(other.latencies)
+
+    def percentile(self, p):
+        if ( len(self.latencies) == 0 ):
+            return(0.0)
+        values = sorted(self.latencies)
+        index = min(int(len(values) * p), len(values) - 1)
+        return(values[index])
+
+    def summary(self, elapsed):
+        return({
+            "Count" : self.count,
+            "Errors" : self.errors,
+            "PerSecond" : self.count / elapsed if elapsed > 0 else 0.0,
+            "P50Ms" : self.percentile(0.50) * 1000,
+            "P95Ms" : self.percentile(0.95) * 1000,
+            "MaxMs" : self.percentile(1.0) * 1000,
+        })
+
+class SwarmResult(object):
+    """
+    Operation statistics and assignment outcomes of a swarm run.
+    """
+    def __init__(self):
+        self.operations = {}
+        self.outcomes = Counter()
+        self.retries = 0
+        self.elapsed = 0.0
+
+    def record(self, name, elapsed, ok):
+        stats = self.operations.get(name)
+        if ( stats is None ):
+            stats = OperationStats()
+            self.operations[name] = stats
+        stats.record(elapsed, ok)
+
+    def merge(self, other):
+        for name, stats in other.operations.items():
+            if ( name not in self.operations ):
+                self.operations[name] = OperationStats()
+            self.operations[name].merge(stats)
+        self.outcomes.update(other.outcomes)
+        self.retries += other.retries
+
+    @property
+    def num_errors(self):
+        return( sum( stats.errors for stats in self.operations.values() ) )
+
+    def summary(self):
+        return({
+            "ElapsedSeconds" : self.elapsed,
+            "Retries" : self.retries,
+            "Outcomes" : dict(self.outcomes),
+            "Operations" : {
+                name : stats.summary(self.elapsed)
+                for name, stats in sorted(self.operations.items())
+            },
+        })
+
+#######################
+# Workers
+#######################
+
+class VirtualWorker(object):
+    """
+    Simulated worker that runs in one thread.
+    """
+
+    # Max number of times an operation is retried when the database
+    #   reports that it is locked (sqlite only allows one writer)
+    MAX_RETRIES = 100
+    # Max number of HIT groups considered on each browse
+    BROWSE_LIMIT = 20
+    # A worker stops after this many consecutive failed operations
+    MAX_FAILURES = 10
+
+    def __init__(self, config, workerPk, profile, seed, stopEvent):
+        self.config = config
+        self.worker_pk = workerPk
+        self.profile = profile
+        self.rng = random.Random(seed)
+        self.answers = AnswerGenerator(self.rng)
+        self.stop_event = stopEvent
+        self.result = SwarmResult()
+        self.deadline = None
+
+    def call(self, name, func):
+        """
+        Run and time a worker operation, retrying it while the
+        database is locked. Each attempt is one transaction, so
+        'func' must load the objects that it modifies.
+        """
+        for attempt in range(0, self.MAX_RETRIES):
+            start = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    value = func()
+            except OperationalError:
+                self.result.retries += 1
+                # Randomized backoff so that the workers that collided
+                #   don't retry together.
+                time.sleep(self.rng.uniform(0, 0.002 * (attempt + 1)))
+                continue
+            except Exception:
+                self.result.record(name, time.perf_counter() - start, False)
+                raise
+            self.result.record(name, time.perf_counter() - start, True)
+            return(value)
+        self.result.record(name, 0.0, False)
+        raise SwarmError("Retry Limit Exceeded: %s" % name)
+
+    def is_done(self, numTasks):
+        if ( self.stop_event.is_set() ):
+            return(True)
+        if ( self.deadline is not None and time.monotonic() >= self.deadline ):
+            return(True)
+        maxTasks = self.config.max_tasks
+        return( maxTasks is not None and numTasks >= maxTasks )
+
+    def wait(self, seconds):
+        """
+        Wait for a number of real seconds or until the run ends.
+        """
+        if ( self.deadline is not None ):
+            seconds = min(seconds, self.deadline - time.monotonic())
+        if ( seconds > 0 ):
+            self.stop_event.wait(seconds)
+
+    def pause(self, dist):
+        """
+        Wait for a duration in emulator seconds from a distribution.
+        """
+        seconds = clock.real_seconds(dist.sample(self.rng))
+        # A frozen clock doesn't advance so don't wait for it
+        if ( seconds is not None ):
+            self.wait(seconds)
+
+    def run(self, startTime, arrival):
+        """
+        @param startTime time.monotonic() value of the start of the run
+        @param arrival number of real seconds after the start that
+           the worker arrives.
+        """
+        if ( self.config.duration is not None ):
+            self.deadline = startTime + self.config.duration
+        try:
+            self.wait(startTime + arrival - time.monotonic())
+            if ( self.is_done(0) ):
+                return(self.result)
+            actor = WorkerActor(Worker.objects.get(pk = self.worker_pk))
+            self.request_quals(actor)
+            self.work(actor)
+        except Exception:
+            logger.exception("Virtual Worker Failed")
+            self.result.outcomes["Failed"] += 1
+        finally:
+            connection.close()
+        return(self.result)
+
+    def request_quals(self, actor):
+        quals = Qualification.objects.filter(
+            aws_id__in = self.profile.request_quals,
+            dispose = False
+        )
+        for qual in quals:
+            def request():
+                req = actor.create_qual_request(qual)
+                actor.process_qual_request(qual, req)
+                return(req)
+            try:
+                req = self.call("request_qual", request)
+                if ( qual.has_test and req.is_idle() ):
+                    data = self.answers.generate_content(qual.test)
+                    self.call(
+                        "submit_test",
+                        lambda: actor.submit_test_answer(
+                            QualificationRequest.objects.get(pk = req.pk), data
+                        )
+                    )
+            except Exception as exc:
+                logger.info("Qualification Request Failed: %s" % str(exc))
+
+    def browse(self, actor):
+        groups = actor.list_task_groups()
+        if ( self.config.hit_type_ids is not None ):
+            groups = groups.filter(aws_id__in = self.config.hit_type_ids)
+        return( list(groups[0:self.BROWSE_LIMIT]) )
+
+    def accept(self, actor, task):
+        """
+        @return Assignment object or None if the task is full
+        """
+        try:
+            return( actor.accept_task(Task.objects.get(pk = task.pk)) )
+        except TaskNotAvailableError:
+            return(None)
+
+    def work(self, actor):
+        numTasks = 0
+        failures = 0
+        while ( not self.is_done(numTasks) ):
+            try:
+                groups = self.call("browse", lambda: self.browse(actor))
+                if ( len(groups) == 0 ):
+                    self.result.outcomes["Idle"] += 1
+                    if ( self.config.exit_when_idle ):
+                        break
+                    self.wait(self.config.idle_interval)
+                    continue
+
+                tasktype = self.rng.choice(groups)
+                task = self.call("next_task", lambda: actor.next_task(tasktype))
+                if ( task is None ):
+                    continue
+                assignment = self.call("accept", lambda: self.accept(actor, task))
+                if ( assignment is None ):
+                    self.result.outcomes["Full"] += 1
+                    continue
+                numTasks += 1
+
+                self.pause(self.config.work_time)
+                self.complete(actor, task, assignment)
+                failures = 0
+            except Exception as exc:
+                logger.info("Virtual Worker Operation Failed: %s" % str(exc))
+                failures += 1
+                if ( failures >= self.MAX_FAILURES ):
+                    raise
+            self.pause(self.config.think_time)
+
+    def complete(self, actor, task, assignment):
+        """
+        Return, abandon or submit an accepted assignment.
+        """
+        profile = self.profile
+        choice = self.rng.random()
+        if ( choice < profile.return_rate ):
+            self.call("return", lambda: actor.return_task(task))
+            self.result.outcomes["Returned"] += 1
+        elif ( choice < profile.return_rate + profile.abandon_rate ):
+            self.result.outcomes["Abandoned"] += 1
+        else:
+            data = self.answers.generate_content(task.question)
+            self.call(
+                "submit", lambda: actor.complete_assignment(
+                    Assignment.objects.get(pk = assignment.pk), data
+                )
+            )
+            self.result.outcomes["Submitted"] += 1
+
+#######################
+# Engine
+#######################
+
+def run_workers(config, plan, startTime, stopEvent=None):
+    """
+    Run virtual workers in threads.
+    @param plan list of (worker pk, profile index, arrival, seed)
+       tuples
+    @return SwarmResult object
+    """
+    if ( stopEvent is None ):
+        stopEvent = threading.Event()
+    workers = [
+        VirtualWorker(config, workerPk, config.profiles[profileIndex], seed, stopEvent)
+        for workerPk, profileIndex, arrival, seed in plan
+    ]
+    threads = [
+        threading.Thread(target = worker.run, args = (startTime, entry[2]))
+        for worker, entry in zip(workers, plan)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    result = SwarmResult()
+    for worker in workers:
+        result.merge(worker.result)
+    return(result)
+
+def _run_process(args):
+    config, plan, startTime = args
+    try:
+        return( run_workers(config, plan, startTime) )
+    finally:
+        connections.close_all()
+
+
+class SwarmEngine(object):
+    """
+    Create the virtual workers and run them.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.prefix = "swarm-%s" % uuid.uuid4().hex[0:8]
+        self.rng = random.Random(config.seed)
+        # List of (worker pk, profile index) tuples
+        self.workers = []
+        self._stop = threading.Event()
+
+    def setup(self):
+        """
+        Create the workers and give them the grants of their
+        profiles.
+        """
+        profileQuals = []
+        for profile in self.config.profiles:
+            quals = {}
+            for qualId, value in profile.grants.items():
+                try:
+                    quals[qualId] = Qualification.objects.get(
+                        aws_id = qualId, dispose = False
+                    )
+                except Qualification.DoesNotExist:
+                    raise SwarmError("Invalid Qualification Type: %s" % qualId)
+            profileQuals.append(quals)
+
+        weights = [ profile.weight for profile in self.config.profiles ]
+        for i in range(0, self.config.num_workers):
+            profileIndex = self.choose_profile(weights)
+            user = User.objects.create_user(
+                username = "%s-worker%d" % (self.prefix, i)
+            )
+            worker = Worker.objects.get(user = user)
+            profile = self.config.profiles[profileIndex]
+            for qualId, value in profile.grants.items():
+                QualificationGrant.objects.create(
+                    worker = worker,
+                    qualification = profileQuals[profileIndex][qualId],
+                    value = value,
+                )
+            self.workers.append( (worker.pk, profileIndex) )
+
+    def choose_profile(self, weights):
+        pick = self.rng.uniform(0, sum(weights))
+        for i, weight in enumerate(weights):
+            pick -= weight
+            if ( pick <= 0 ):
+                return(i)
+        return( len(weights) - 1 )
+
+    def cleanup(self):
+        """
+        Delete the workers and their assignments and requests.
+        @note - tasks whose assignments were all submitted are
+           still reviewable.
+        """
+        users = User.objects.filter(username__startswith = self.prefix + "-")
+        # The assignments protect the workers - deleting them
+        #   removes them from the counters of their tasks and the
+        #   tasks may then be assignable again.
+        assignments = Assignment.objects.filter(worker__user__in = users)
+        taskIds = set(assignments.values_list("task_id", flat=True))
+        assignments.delete()
+        for task in Task.objects.filter(pk__in = taskIds):
+            task.update_state()
+        users.delete()
+
+    def plan(self):
+        """
+        @return list of (worker pk, profile index, arrival, seed)
+           tuples
+        """
+        plan = []
+        arrival = 0.0
+        for workerPk, profileIndex in self.workers:
+            plan.append(
+                (workerPk, profileIndex, arrival, self.rng.getrandbits(32))
+            )
+            arrival += self.config.arrival.sample(self.rng)
+        return(plan)
+
+    def stop(self):
+        """
+        Stop the workers of a threaded run.
+        """
+        self._stop.set()
+
+    def run(self):
+        """
+        @return SwarmResult object
+        """
+        if ( len(self.workers) == 0 ):
+            raise SwarmError("The swarm has not been set up")
+        plan = self.plan()
+        startTime = time.monotonic()
+        if ( self.config.parallelism == "thread" ):
+            result = run_workers(self.config, plan, startTime, self._stop)
+        else:
+            result = self.run_processes(plan, startTime)
+        result.elapsed = time.monotonic() - startTime
+        return(result)
+
+    def run_processes(self, plan, startTime):
+        numProcs = self.config.num_processes
+        chunks = [ plan[i::numProcs] for i in range(0, numProcs) ]
+        # The forked processes must not share the parent's database
+        #   connections.
+        connections.close_all()
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(numProcs) as pool:
+            results = pool.map(
+                _run_process,
+                [ (self.config, chunk, startTime) for chunk in chunks ]
+            )
+        result = SwarmResult()
+        for procResult in results:
+            result.merge(procResult)
+        return(result)
@@ -260,11 +260,10 @@ class CreateTask(object):
             validQuestionTypes = [
                 "HTMLQuestion" , "ExternalQuestion", "QuestionForm"
             ]
-            name = ques.determine_type(quesData)
+            name = ques.check(quesData, validQuestionTypes)
             if ( name not in validQuestionTypes ):
                 raise TaskQuestionInvalidError()
 
-            ques.validate(name, quesData)
             createParams["question"] = quesData
         except KeyError:
             try:
@@ -349,11 +348,10 @@ class QualificationHandler(object):
                         ["Qualification cannot have AutoGranted 'True' and have a Test QuestionForm"]
                     )
 
-            name = q.determine_type(test)
+            name = q.check(test, ["QuestionForm"])
             if ( name not in ["QuestionForm"]):
                 raise QualTestInvalidError()
 
-            q.validate(name, test)
             dur = timedelta(seconds=testDuration)
             return(test, dur)
         except KeyError:
@@ -366,11 +364,10 @@ class QualificationHandler(object):
             if ( len(answerKey) > 65535 ):
                 raise AnswerTooLongError()
 
-            name = q.determine_type(answerKey)
+            name = q.check(answerKey, ["AnswerKey"])
             if ( name not in ["AnswerKey"]):
                 raise QualAnswerInvalidError()
 
-            q.validate(name, answerKey)
             return(answerKey)
         except KeyError:
             return(None)
@@ -10,3 +10,4 @@ from mturk.testsuite.api.basics import *
 from mturk.testsuite.api.qualifications import *
 from mturk.testsuite.api.workers import *
 from mturk.testsuite.api.tasks import *
+from mturk.testsuite.api.lifecycle import *
@@ -6,9 +6,30 @@
 # requester API interface.
 #
 
-from mturk.testsuite.utils import RequesterLiveTestCase
+from mturk.testsuite.utils import RequesterTestCase, RequesterLiveTestCase, load_quesform, load_answerkey
+from mturk.service import ServiceRegistry
+from mturk.validators import OutputSampler
+from mturk.models import Qualification, TaskType
+from mturk.cache import LRUCache
+from mturk.xml.questions import QuestionValidator, question_cache, validation_cache
+from mturk.errors import ValidationError
+from mturk.extensions import EmulatorClientError
+from mturk.xml.schemas import SchemaRegistry
+from mturk.metrics import metrics
 
-class RequesterBasics(RequesterLiveTestCase):
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.test import Client, override_settings
+
+from io import StringIO
+import os
+import pstats
+import tempfile
+
+from botocore.exceptions import ParamValidationError
+from botocore.validate import validate_parameters
+
+class RequesterBasics(RequesterTestCase):
 
     def test_basic_access(self):
         """
@@ -20,3 +41,372 @@ class RequesterBasics(RequesterLiveTestCase):
 
         balance = resp["AvailableBalance"]
         self.assertEqual(balance, "10000.00")
+
+    def test_service_registry(self):
+        """
+        The service model is loaded once and shared by all of the
+        API requests in the process.
+        """
+        service = ServiceRegistry.get()
+        self.assertTrue( service.has_operation("GetAccountBalance") )
+
+        resp = self.client.get_account_balance()
+        self.is_ok(resp)
+        resp = self.client.get_account_balance()
+        self.is_ok(resp)
+
+        self.assertTrue( ServiceRegistry.get() is service )
+
+    def test_compiled_validators(self):
+        """
+        The compiled validators must report the same errors as
+        botocore's generic parameter validation.
+        """
+        service = ServiceRegistry.get()
+
+        cases = [
+            ("GetAccountBalance", {}),
+            ("GetHIT", {}),
+            ("GetHIT", {"HITId" : 1234}),
+            ("ListHITs", {"MaxResults" : 0, "Blarg" : True}),
+            ("CreateHIT", {
+                "MaxAssignments" : "1",
+                "LifetimeInSeconds" : 1000,
+                "AssignmentDurationInSeconds" : 100,
+                "Reward" : "0.10",
+                "Title" : "",
+                "Description" : "asdf",
+                "QualificationRequirements" : [
+                    {"Comparator" : "Exists", "IntegerValues": ["a"]},
+                ],
+            }),
+        ]
+
+        for target, params in cases:
+            opModel = service.operation_model(target)
+            validator = service.get_validator(target)
+
+            try:
+                validate_parameters(params, opModel.input_shape)
+                expReport = None
+            except ParamValidationError as exc:
+                expReport = str(exc)
+
+            try:
+                validator.validate_input(params)
+                obsReport = None
+            except ParamValidationError as exc:
+                obsReport = str(exc)
+
+            self.assertEqual(obsReport, expReport)
+
+    def test_output_sampler(self):
+        sampler = OutputSampler(0)
+        self.assertFalse( any([sampler.should_validate() for i in range(0,10)]) )
+
+        sampler = OutputSampler(1)
+        self.assertTrue( all([sampler.should_validate() for i in range(0,10)]) )
+
+        sampler = OutputSampler(4)
+        obs = [sampler.should_validate() for i in range(0,12)]
+        self.assertEqual( obs.count(True), 3 )
+
+    def test_aws_id_allocation(self):
+        ids = []
+        for i in range(0,3):
+            resp = self.client.create_qualification_type(
+                Name="ID Test %d" % i,
+                Description="Check the ID allocation",
+                QualificationTypeStatus = "Active",
+            )
+            qualId = resp["QualificationType"]["QualificationTypeId"]
+            self.assertRegex(qualId, r"^A[A-Z2-7]{26}$")
+            ids.append(qualId)
+
+            qual = Qualification.objects.get(aws_id = qualId)
+            self.assertEqual(qual.name, "ID Test %d" % i)
+
+        self.assertEqual(len(set(ids)), 3)
+
+    def test_lru_cache(self):
+        cache = LRUCache(3, maxCost=100)
+        for i in range(0, 3):
+            cache.put(i, "val%d" % i, 10)
+        self.assertEqual( cache.get(0), "val0" )
+        self.assertIsNone( cache.get(5) )
+
+        # 1 is the least recently used entry
+        cache.put(3, "val3", 10)
+        self.assertNotIn( 1, cache )
+        self.assertIn( 0, cache )
+
+        # Evict by cost
+        cache.put(4, "val4", 80)
+        self.assertEqual( len(cache), 3 )
+        self.assertEqual( cache.cost, 100 )
+        self.assertNotIn( 2, cache )
+        cache.put(5, "val5", 101)
+        self.assertNotIn( 5, cache )
+
+        stats = cache.stats()
+        self.assertEqual( stats["Hits"], 1 )
+        self.assertEqual( stats["Misses"], 1 )
+        self.assertEqual( stats["Evictions"], 2 )
+
+    def test_question_cache(self):
+        question_cache.clear()
+        question_cache.reset_stats()
+        content = load_quesform(2)
+
+        q = QuestionValidator()
+        name, form0 = q.extract(content)
+        self.assertEqual( name, "QuestionForm" )
+        name, form1 = q.extract(content)
+        self.assertEqual( question_cache.misses, 1 )
+        self.assertEqual( question_cache.hits, 1 )
+
+        # Each call gets a separate form object for processing
+        # a request but shares the parsed content.
+        self.assertIsNot( form0, form1 )
+        self.assertIs( form0.contents, form1.contents )
+        form0.process({"favorite" : ["blue"], "acceptible" : ["red"]})
+        form1.process({})
+        self.assertTrue( form0.is_valid() )
+        self.assertFalse( form1.is_valid() )
+
+        invalid = "<QuestionForm>"
+        with self.assertRaises(Exception):
+            q.extract(invalid)
+        self.assertEqual( len(question_cache), 1 )
+
+    def test_root_element_sniff(self):
+        q = QuestionValidator()
+        content = load_quesform(2)
+        self.assertEqual( q.determine_type(content), "QuestionForm" )
+        self.assertEqual(
+            q.get_root_element_name(content.encode("utf-8")), "QuestionForm"
+        )
+
+        # The sniff stops at the root element - the document is
+        # validated when it is parsed with the schema.
+        truncated = content[0:content.index("</Question>")]
+        self.assertEqual( q.determine_type(truncated), "QuestionForm" )
+        with self.assertRaises(ValidationError):
+            q.validate("QuestionForm", truncated)
+
+        with self.assertRaises(Exception):
+            q.get_root_element_name("")
+
+    def test_validation_cache(self):
+        validation_cache.clear()
+        validation_cache.reset_stats()
+        q = QuestionValidator()
+        content = load_quesform(2)
+        validTypes = ["QuestionForm"]
+
+        self.assertEqual( q.check(content, validTypes), "QuestionForm" )
+        self.assertEqual( q.check(content, validTypes), "QuestionForm" )
+        self.assertEqual( validation_cache.avoided, 1 )
+
+        # The type is reported without validating content that is
+        # not one of the valid types.
+        self.assertEqual( q.check(content, ["AnswerKey"]), "QuestionForm" )
+
+        # Invalid content raises the same error each time.
+        truncated = content[0:content.index("</Question>")]
+        with self.assertRaises(ValidationError) as first:
+            q.check(truncated, validTypes)
+        with self.assertRaises(ValidationError) as second:
+            q.check(truncated, validTypes)
+        self.assertEqual( str(first.exception), str(second.exception) )
+        self.assertEqual( validation_cache.stats()["Avoided"], 3 )
+
+    def test_lazy_schemas(self):
+        SchemaRegistry.reset()
+        q = QuestionValidator()
+        answerKey = load_answerkey(1)
+
+        # Determining the type does not compile any schemas
+        self.assertEqual( q.determine_type(answerKey), "AnswerKey" )
+        for name in SchemaRegistry.names():
+            self.assertFalse( SchemaRegistry.is_loaded(name) )
+
+        q.validate("AnswerKey", answerKey)
+        self.assertTrue( SchemaRegistry.is_loaded("AnswerKey") )
+        self.assertFalse( SchemaRegistry.is_loaded("FormattedContent") )
+
+        out = StringIO()
+        call_command("EmuStartup", stdout = out)
+        self.assertIn( "Startup Complete", out.getvalue() )
+        for name in SchemaRegistry.names():
+            self.assertTrue( SchemaRegistry.is_loaded(name) )
+
+
+    def test_metrics(self):
+        """
+        Per operation metrics are served at the metrics endpoint
+        """
+        metrics.reset()
+        for i in range(0, 2):
+            self.is_ok( self.client.get_account_balance() )
+        RequestError = self.client._load_exceptions().RequestError
+        with self.assertRaises(RequestError):
+            self.client.get_hit(HITId = "ASDF")
+
+        web = Client()
+        resp = web.get("/metrics", {"format" : "json"})
+        self.assertEqual( resp.status_code, 200 )
+        ops = resp.json()["Operations"]
+        balance = ops["GetAccountBalance"]
+        self.assertEqual( balance["Requests"], 2 )
+        self.assertEqual( balance["Errors"], {} )
+        self.assertTrue( balance["Queries"] >= 2 )
+        for phase in ["validation", "handler", "serialization", "db", "total"]:
+            self.assertEqual( balance["Seconds"][phase]["Count"], 2 )
+        self.assertEqual( ops["GetHIT"]["Errors"], {"DoesNotExistError" : 1} )
+
+        resp = web.get("/metrics")
+        text = resp.content.decode("utf-8")
+        self.assertIn(
+            'mturk_api_requests_total{operation="GetAccountBalance"} 2', text
+        )
+        self.assertIn(
+            'mturk_api_phase_seconds_count{operation="GetHIT",phase="total"} 1', text
+        )
+
+        resp = Client(REMOTE_ADDR = "10.0.0.1").get("/metrics")
+        self.assertEqual( resp.status_code, 403 )
+
+        web.post("/metrics")
+        resp = web.get("/metrics", {"format" : "json"})
+        self.assertEqual( resp.json()["Operations"], {} )
+
+    def test_profiling(self):
+        """
+        Selected requests write a profile of their handler
+        """
+        def add_profile_header(request, **kwargs):
+            request.headers["X-Emu-Profile"] = "1"
+
+        with tempfile.TemporaryDirectory() as tmpDir:
+            with override_settings(MTURK_PROFILE_DIR = tmpDir):
+                resp = self.client.list_hits()
+                self.assertEqual( os.listdir(tmpDir), [] )
+
+                # Only staff may request a profile
+                self.client.meta.events.register(
+                    "before-sign.mturk-requester", add_profile_header
+                )
+                RequestError = self.client._load_exceptions().RequestError
+                with self.assertRaises(RequestError):
+                    self.client.list_hits()
+
+                User.objects.filter(username = "test1").update(is_staff = True)
+                resp = self.client.list_hits()
+                requestId = resp["ResponseMetadata"]["RequestId"]
+                name = "ListHITs-%s" % requestId
+                self.assertEqual(
+                    resp["ResponseMetadata"]["HTTPHeaders"]["x-emu-profile"], name
+                )
+                self.assertEqual(
+                    sorted(os.listdir(tmpDir)),
+                    [ name + ".alloc.txt", name + ".pstats" ]
+                )
+                stats = pstats.Stats(os.path.join(tmpDir, name + ".pstats"))
+                self.assertTrue( stats.total_calls > 0 )
+                with open(os.path.join(tmpDir, name + ".alloc.txt")) as f:
+                    self.assertIn( "Operation: ListHITs", f.read() )
+
+                self.client.meta.events.unregister(
+                    "before-sign.mturk-requester", add_profile_header
+                )
+            with override_settings(MTURK_PROFILE_DIR = tmpDir, MTURK_PROFILE_RATE = 1.0):
+                resp = self.client.get_account_balance()
+                self.assertIn( "x-emu-profile", resp["ResponseMetadata"]["HTTPHeaders"] )
+                self.assertEqual( len(os.listdir(tmpDir)), 4 )
+
+
+class RequesterTransportTests(RequesterLiveTestCase):
+
+    def test_transports(self):
+        """
+        The in-process transport gives the same responses as the
+        live server.
+        """
+        liveClient = self.create_new_client("test2", inProcess=False)
+        localClient = self.create_new_client("test2", inProcess=True)
+
+        for client in [liveClient, localClient]:
+            resp = client.get_account_balance()
+            self.is_ok(resp)
+            self.assertIn( "AvailableBalance", resp )
+
+            RequestError = client._load_exceptions().RequestError
+            with self.assertRaises(RequestError):
+                client.get_hit(HITId = "ASDF")
+
+        for inProcess in [False, True]:
+            emu = self.create_emulator_client("test2", inProcess)
+            with self.assertRaises(EmulatorClientError) as cxt:
+                emu.call("GetClock")
+            self.assertEqual( cxt.exception.status, 400 )
+
+
+class SnapshotTests(RequesterLiveTestCase):
+
+    # Snapshots can't be restored inside the transaction of a
+    #   TestCase but the requests don't need to go over HTTP.
+    in_process = True
+
+    def test_snapshots(self):
+        """
+        Take, restore and reset snapshots of the emulator database
+        """
+        User.objects.filter(username = "test1").update(is_staff = True)
+        emu = self.create_emulator_client("test1")
+
+        with tempfile.TemporaryDirectory() as snapDir:
+            with override_settings(MTURK_SNAPSHOT_DIR = snapDir):
+                resp = emu.call("SnapshotState", Name = "seeded")
+                self.assertEqual( resp["Snapshot"]["Name"], "seeded" )
+                for name in ["../seeded", "pristine"]:
+                    with self.assertRaises(EmulatorClientError):
+                        emu.call("SnapshotState", Name = name)
+
+                resp = self.client.create_hit_type(
+                    AssignmentDurationInSeconds = 3600,
+                    Reward = "0.10",
+                    Title = "Snapshot",
+                    Description = "Removed by the restore",
+                )
+                self.is_ok(resp)
+                self.assertEqual( TaskType.objects.count(), 1 )
+
+                emu.call("RestoreState", Name = "seeded")
+                self.assertEqual( TaskType.objects.count(), 0 )
+                with self.assertRaises(EmulatorClientError):
+                    emu.call("RestoreState", Name = "missing")
+
+                resp = emu.call("ListSnapshots")
+                names = [ snap["Name"] for snap in resp["Snapshots"] ]
+                self.assertEqual( names, ["seeded"] )
+
+                # The reset builds the pristine snapshot and removes
+                #   the requester that made the request.
+                emu.call("ResetState")
+                self.assertEqual(
+                    list(User.objects.values_list("username", flat=True)),
+                    ["mturk"]
+                )
+                numQuals = Qualification.objects.count()
+                self.assertTrue( numQuals > 0 )
+
+                out = StringIO()
+                call_command("EmuSnapshot", "reset", stdout = out)
+                self.assertIn( "Commissioned", out.getvalue() )
+                self.assertEqual( Qualification.objects.count(), numQuals )
+
+                out = StringIO()
+                call_command("EmuSnapshot", "list", stdout = out)
+                names = [ line.split()[0] for line in out.getvalue().splitlines() ]
+                self.assertEqual( names, ["pristine", "seeded"] )
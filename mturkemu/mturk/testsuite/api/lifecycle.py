@@ -0,0 +1,263 @@
+# File: mturk/testsuite/api/lifecycle.py
+# Author: Carl Allendorph
+#
+# Description:
+#   This file contains unit tests for the time based state changes
+# of the tasks and assignments applied by the lifecycle scheduler
+# and the emulator clock that drives them.
+#
+
+from django.utils import timezone
+
+from mturk.models import *
+from mturk.scheduler import LifecycleScheduler
+from mturk.clock import EmulatorClock, clock
+from mturk.extensions import EmulatorClient, EmulatorClientError
+from mturk.testsuite.utils import RequesterTestCase, load_quesform
+from mturk.worker.actor import WorkerActor
+from mturk.worker.TasksActor import InvalidAssignmentStateError
+
+from datetime import timedelta
+
+class LifecycleTests(RequesterTestCase):
+
+    def create_actors(self, count):
+        self.actors = []
+        for i in range(0, count):
+            username = "worker%d" % i
+            self.create_new_client(username)
+            worker = Worker.objects.get(user__username = username)
+            self.actors.append( WorkerActor(worker) )
+
+    def create_task(self, lifetime, assignDur, autoApprove, maxAssigns=2):
+        resp = self.client.create_hit(
+            MaxAssignments = maxAssigns,
+            LifetimeInSeconds = lifetime,
+            AssignmentDurationInSeconds = assignDur,
+            AutoApprovalDelayInSeconds = autoApprove,
+            Reward = "0.13",
+            Title = "Lifecycle",
+            Description = "Little bit of sugar",
+            Question = load_quesform(2),
+        )
+        self.is_ok(resp)
+        return( Task.objects.get(aws_id = resp["HIT"]["HITId"]) )
+
+    def run_scheduler(self, offset):
+        """
+        Run the scheduler as if it were 'offset' seconds from now.
+        """
+        startTime = self.startTime
+        scheduler = LifecycleScheduler(
+            now = lambda: startTime + timedelta(seconds=offset),
+            batchSize = 1
+        )
+        return( scheduler.run_once() )
+
+    def check_counts(self, task, pending, submitted, completed):
+        task.refresh_from_db()
+        self.assertEqual( task.num_pending, pending )
+        self.assertEqual( task.num_submitted, submitted )
+        self.assertEqual( task.num_completed, completed )
+        self.assertEqual( len(task.reconcile_counters(fix=False)), 0 )
+
+    def test_abandon_and_approve(self):
+        self.create_actors(2)
+        self.startTime = timezone.now()
+        task = self.create_task(10000, 1000, 2000)
+
+        assign0 = self.actors[0].accept_task(task)
+        assign1 = self.actors[1].accept_task(task)
+        data = {
+            "favorite" : ["blue"],
+            "acceptible" : ["red", "blue"]
+        }
+        self.actors[1].complete_assignment(assign1, data)
+        self.check_counts(task, 1, 1, 0)
+        self.assertTrue( task.is_unassignable() )
+
+        scheduler = LifecycleScheduler()
+        self.assertEqual( scheduler.next_due(), assign0.deadline )
+
+        # Nothing is due yet
+        stats = self.run_scheduler(10)
+        self.assertEqual( stats, {"expire": 0, "abandon": 0, "approve": 0} )
+
+        # Assignment 0 passes its deadline
+        stats = self.run_scheduler(1500)
+        self.assertEqual( stats, {"expire": 0, "abandon": 1, "approve": 0} )
+        self.check_counts(task, 0, 1, 0)
+        self.assertTrue( task.is_assignable() )
+
+        assign0.refresh_from_db()
+        self.assertTrue( assign0.dispose )
+        self.actors[0].worker.refresh_from_db()
+        self.assertEqual( self.actors[0].worker.abandoned_hits, 1 )
+
+        # Assignment 1 is auto approved
+        stats = self.run_scheduler(2500)
+        self.assertEqual( stats, {"expire": 0, "abandon": 0, "approve": 1} )
+        self.check_counts(task, 0, 0, 1)
+
+        assign1.refresh_from_db()
+        self.assertTrue( assign1.is_approved() )
+        self.assertEqual( assign1.approved, assign1.auto_approve )
+
+        resp = self.client.get_hit( HITId = task.aws_id )
+        self.assertEqual( resp["HIT"]["NumberOfAssignmentsAvailable"], 1 )
+        self.assertEqual( resp["HIT"]["NumberOfAssignmentsCompleted"], 1 )
+
+        # The task expires with no pending assignments
+        stats = self.run_scheduler(10001)
+        self.assertEqual( stats, {"expire": 1, "abandon": 0, "approve": 0} )
+        task.refresh_from_db()
+        self.assertTrue( task.is_reviewable() )
+        self.assertEqual( LifecycleScheduler().next_due(), None )
+
+    def test_expire_with_pending(self):
+        self.create_actors(1)
+        self.startTime = timezone.now()
+        task = self.create_task(500, 1000, 2000)
+        other = self.create_task(500, 1000, 2000)
+
+        assign0 = self.actors[0].accept_task(task)
+
+        stats = self.run_scheduler(600)
+        self.assertEqual( stats, {"expire": 2, "abandon": 0, "approve": 0} )
+
+        # The task with a pending assignment can't be assigned but
+        # it isn't reviewable until the assignment is resolved.
+        task.refresh_from_db()
+        self.assertTrue( task.is_unassignable() )
+        other.refresh_from_db()
+        self.assertTrue( other.is_reviewable() )
+
+        stats = self.run_scheduler(1100)
+        self.assertEqual( stats, {"expire": 0, "abandon": 1, "approve": 0} )
+        self.check_counts(task, 0, 0, 0)
+        self.assertTrue( task.is_reviewable() )
+
+    def test_stale_assignment_transitions(self):
+        """
+        Saving an assignment loaded before the scheduler
+        transitioned it must not undo the transition.
+        """
+        self.create_actors(2)
+        self.startTime = timezone.now()
+        task = self.create_task(10000, 1000, 2000)
+        data = {
+            "favorite" : ["blue"],
+            "acceptible" : ["red", "blue"]
+        }
+
+        # Submit after the assignment was abandoned
+        accepted = self.actors[0].accept_task(task)
+        stale = Assignment.objects.get(pk = accepted.pk)
+        self.run_scheduler(1500)
+        with self.assertRaises(InvalidAssignmentStateError):
+            self.actors[0].complete_assignment(stale, data)
+        stale.refresh_from_db()
+        self.assertTrue( stale.dispose )
+        self.assertTrue( stale.is_accepted() )
+        self.check_counts(task, 0, 0, 0)
+
+        # Approve and reject after the assignment was auto approved
+        accepted = self.actors[1].accept_task(task)
+        self.actors[1].complete_assignment(accepted, data)
+        stale = Assignment.objects.get(pk = accepted.pk)
+        self.run_scheduler(2000 + 1500)
+        self.check_counts(task, 0, 0, 1)
+        RequestError = self.client._load_exceptions().RequestError
+        with self.assertRaises(RequestError):
+            self.client.reject_assignment(AssignmentId = stale.aws_id)
+
+        stale.reject("Too Late")
+        self.assertFalse( stale.save_transition(AssignmentStatusField.SUBMITTED) )
+        stale.refresh_from_db()
+        self.assertTrue( stale.is_approved() )
+        self.check_counts(task, 0, 0, 1)
+
+class ClockTests(RequesterTestCase):
+
+    def tearDown(self):
+        clock.reset()
+        super().tearDown()
+
+    def test_clock(self):
+        realTime = [ timezone.now() ]
+        testClock = EmulatorClock(source = lambda: realTime[0])
+        start = realTime[0]
+
+        self.assertTrue( testClock.is_real_time() )
+        self.assertEqual( testClock.now(), start )
+
+        testClock.freeze()
+        realTime[0] += timedelta(seconds=10)
+        self.assertEqual( testClock.now(), start )
+        self.assertEqual( testClock.real_seconds(10), None )
+
+        testClock.advance(3600)
+        self.assertEqual( testClock.now(), start + timedelta(seconds=3600) )
+
+        testClock.resume()
+        testClock.set_speed(60)
+        realTime[0] += timedelta(seconds=10)
+        self.assertEqual( testClock.now(), start + timedelta(seconds=4200) )
+        self.assertEqual( testClock.real_seconds(60), 1.0 )
+
+        with self.assertRaises(ValueError):
+            testClock.advance(-1)
+        with self.assertRaises(ValueError):
+            testClock.set_speed(0)
+
+        testClock.reset()
+        self.assertEqual( testClock.now(), realTime[0] )
+
+    def test_clock_operations(self):
+        emu = self.create_emulator_client("test1")
+
+        # Only staff accounts can modify the emulator
+        with self.assertRaises(EmulatorClientError):
+            emu.call("UpdateClock", Freeze = True)
+        self.assertTrue( clock.is_real_time() )
+
+        User.objects.filter(username = "test1").update(is_staff = True)
+
+        resp = emu.call("UpdateClock", Freeze = True)
+        self.assertTrue( resp["Clock"]["Frozen"] )
+        frozenAt = clock.now()
+
+        with self.assertRaises(EmulatorClientError):
+            emu.call("UpdateClock", Speed = -1)
+        with self.assertRaises(EmulatorClientError):
+            emu.call("UpdateClock", AdvanceSeconds = "asdf")
+
+        resp = self.client.create_hit(
+            MaxAssignments = 1,
+            LifetimeInSeconds = 3600,
+            AssignmentDurationInSeconds = 1000,
+            Reward = "0.13",
+            Title = "Clock",
+            Description = "Little bit of sugar",
+            Question = load_quesform(2),
+        )
+        self.is_ok(resp)
+        task = Task.objects.get(aws_id = resp["HIT"]["HITId"])
+        self.assertEqual( task.created, frozenAt )
+        self.assertEqual( task.expires, frozenAt + timedelta(seconds=3600) )
+
+        # Simulate the task lifetime
+        resp = emu.call("UpdateClock", AdvanceSeconds = 3601, RunScheduler = True)
+        self.assertEqual( resp["Transitions"]["expire"], 1 )
+        self.assertEqual( clock.now(), frozenAt + timedelta(seconds=3601) )
+
+        task.refresh_from_db()
+        self.assertTrue( task.is_reviewable() )
+
+        resp = emu.call("UpdateClock", Reset = True)
+        self.assertTrue( resp["Clock"]["RealTime"] )
+        resp = emu.call("GetClock")
+        self.assertFalse( resp["Clock"]["Frozen"] )
+
+        resp = emu.call("GetCacheStatistics", Reset = True)
+        self.assertIn( "Hits", resp["Caches"]["Question"] )
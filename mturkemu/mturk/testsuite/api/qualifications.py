@@ -9,13 +9,24 @@
 from django.utils import timezone
 
 from mturk.models import *
-from mturk.testsuite.utils import RequesterLiveTestCase, load_quesform, load_answerkey
+from mturk.testsuite.utils import RequesterTestCase, load_quesform, load_answerkey
 from mturk.worker.actor import WorkerActor
 from mturk.worker.QualsActor import *
 from mturk.xml.quesformanswer import QFormAnswer
+from mturk.population import GrantMatrix, RequirementSpec, eligibility_engine
+from mturk.extensions import EmulatorClient, EmulatorClientError
+from mturk.fields import CompressedTextField
+from mturk.xml.answerkey import get_answer_key, read_stored_answers
 
+from django.db import connection
+from django.core.management import call_command
+from django.test import Client
 
-class QualificationTests(RequesterLiveTestCase):
+from io import StringIO
+import numpy as np
+
+
+class QualificationTests(RequesterTestCase):
 
     def test_duplicate_qual_error(self):
         name = "qwer"
@@ -2066,3 +2077,342 @@ class QualificationTests(RequesterLiveTestCase):
                 Question = question,
                 RequesterAnnotation = "won't happen"
             )
+
+    def test_eligible_workers(self):
+        """
+        Check the eligibility engine against the per worker
+        requirement checks.
+        """
+        quals = []
+        for name in ["Eligible 1", "Eligible 2"]:
+            resp = self.client.create_qualification_type(
+                Name = name,
+                Description = "Some Stuff",
+                QualificationTypeStatus = "Active",
+            )
+            self.is_ok(resp)
+            quals.append(resp["QualificationType"]["QualificationTypeId"])
+
+        # Workers with values 0, 10, ... 70 for the first qual and
+        #   every other worker with the second qual.
+        actors = []
+        for i in range(0, 8):
+            username = "elig%d" % i
+            self.create_new_client(username)
+            worker = Worker.objects.get(user__username = username)
+            actors.append( WorkerActor(worker) )
+            resp = self.client.associate_qualification_with_worker(
+                QualificationTypeId = quals[0],
+                WorkerId = worker.aws_id,
+                IntegerValue = 10 * i,
+                SendNotification = False
+            )
+            self.is_ok(resp)
+            if ( i % 2 == 0 ):
+                resp = self.client.associate_qualification_with_worker(
+                    QualificationTypeId = quals[1],
+                    WorkerId = worker.aws_id,
+                    IntegerValue = 1,
+                    SendNotification = False
+                )
+                self.is_ok(resp)
+
+        qualReqs = [
+            {
+                "QualificationTypeId" : quals[0],
+                "Comparator" : "GreaterThanOrEqualTo",
+                "IntegerValues" : [ 20 ],
+            },
+            {
+                "QualificationTypeId" : quals[0],
+                "Comparator" : "NotIn",
+                "IntegerValues" : [ 40, 50 ],
+            },
+            {
+                "QualificationTypeId" : quals[1],
+                "Comparator" : "Exists",
+            },
+        ]
+        resp = self.client.create_hit_type(
+            AssignmentDurationInSeconds = 100,
+            Reward = "0.13",
+            Title = "Eligible",
+            Description = "Little bit of sugar",
+            QualificationRequirements = qualReqs
+        )
+        self.is_ok(resp)
+        hitTypeId = resp["HITTypeId"]
+        tt = TaskType.objects.get(aws_id = hitTypeId)
+
+        expected = sorted(
+            actor.worker.aws_id for actor in actors
+            if actor.check_prerequisite_quals(tt)
+        )
+        # Workers 2 and 6
+        self.assertEqual( len(expected), 2 )
+
+        numWorkers = Worker.objects.filter(active = True).count()
+        emu = self.create_emulator_client("test1")
+        resp = emu.call(
+            "GetEligibleWorkers", HITTypeId = hitTypeId, ReturnWorkerIds = True
+        )
+        self.assertEqual( resp["NumberOfWorkers"], numWorkers )
+        self.assertEqual( resp["NumberOfEligibleWorkers"], 2 )
+        self.assertEqual( sorted(resp["WorkerIds"]), expected )
+
+        resp = emu.call(
+            "GetEligibleWorkers", QualificationRequirements = qualReqs[0:1]
+        )
+        self.assertEqual( resp["NumberOfEligibleWorkers"], 6 )
+        self.assertNotIn( "WorkerIds", resp )
+
+        # Grant changes are visible to the next request
+        resp = self.client.associate_qualification_with_worker(
+            QualificationTypeId = quals[1],
+            WorkerId = actors[3].worker.aws_id,
+            IntegerValue = 1,
+            SendNotification = False
+        )
+        self.is_ok(resp)
+        resp = emu.call("GetEligibleWorkers", HITTypeId = hitTypeId)
+        self.assertEqual( resp["NumberOfEligibleWorkers"], 3 )
+
+        with self.assertRaises(EmulatorClientError):
+            emu.call("GetEligibleWorkers")
+        with self.assertRaises(EmulatorClientError):
+            emu.call(
+                "GetEligibleWorkers",
+                QualificationRequirements = [
+                    {"QualificationTypeId" : quals[0], "Comparator" : "LessThan"}
+                ]
+            )
+
+    def test_task_info_invalid_requirements(self):
+        """
+        The task info page renders for a HIT with a requirement
+        that the eligibility engine can't evaluate.
+        """
+        resp = self.client.create_qualification_type(
+            Name = "Unevaluable",
+            Description = "Comparator without values",
+            QualificationTypeStatus = "Active",
+        )
+        self.is_ok(resp)
+        qualId = resp["QualificationType"]["QualificationTypeId"]
+
+        resp = self.client.create_hit(
+            MaxAssignments = 1,
+            LifetimeInSeconds = 10000,
+            AssignmentDurationInSeconds = 100,
+            Reward = "0.10",
+            Title = "Task With Invalid Requirement",
+            Description = "Missing integer values",
+            Question = load_quesform(2),
+            QualificationRequirements = [
+                {
+                    "QualificationTypeId" : qualId,
+                    "Comparator" : "GreaterThan",
+                },
+            ],
+        )
+        self.is_ok(resp)
+        task = Task.objects.get(aws_id = resp["HIT"]["HITId"])
+
+        web = Client()
+        self.assertTrue( web.login(username = "test1", password = "test10") )
+        resp = web.get("/requester/tasks/%d/" % task.pk)
+        self.assertEqual( resp.status_code, 200 )
+        self.assertContains( resp, "Eligible Workers: invalid requirements" )
+
+    def test_eligible_workers_deleted_qual(self):
+        """
+        The grants of a deleted qualification are not counted by
+        the eligibility engine.
+        """
+        resp = self.client.create_qualification_type(
+            Name = "Deleted Eligibility",
+            Description = "Some Stuff",
+            QualificationTypeStatus = "Active",
+        )
+        self.is_ok(resp)
+        qualId = resp["QualificationType"]["QualificationTypeId"]
+
+        self.create_new_client("elig0")
+        worker = Worker.objects.get(user__username = "elig0")
+        resp = self.client.associate_qualification_with_worker(
+            QualificationTypeId = qualId,
+            WorkerId = worker.aws_id,
+            IntegerValue = 1,
+            SendNotification = False
+        )
+        self.is_ok(resp)
+
+        qual = Qualification.objects.get(aws_id = qualId)
+        specs = [ RequirementSpec(qual.pk, "S", (), ()) ]
+        self.assertEqual( eligibility_engine.evaluate(specs).num_eligible, 1 )
+
+        resp = self.client.delete_qualification_type(
+            QualificationTypeId = qualId
+        )
+        self.is_ok(resp)
+        qual.refresh_from_db()
+        self.assertTrue( qual.dispose )
+
+        # The cached grants were invalidated by the bulk update
+        self.assertEqual( eligibility_engine.evaluate(specs).num_eligible, 0 )
+
+    def test_eligibility_matrix(self):
+        """
+        Evaluate all of the comparators on a large synthetic
+        population.
+        """
+        numWorkers = 1000000
+        rng = np.random.RandomState(1234)
+        values = rng.randint(0, 100, size=(numWorkers, 2))
+        locales = rng.randint(1, 4, size=(numWorkers, 2))
+        exists = rng.rand(numWorkers, 2) < 0.8
+        matrix = GrantMatrix((7, 9), values, locales, exists)
+
+        v = values[:, 0]
+        e = exists[:, 0]
+        checks = [
+            ("L", (50,), (), e & (v < 50)),
+            ("K", (50,), (), e & (v <= 50)),
+            ("G", (50,), (), e & (v > 50)),
+            ("H", (50,), (), e & (v >= 50)),
+            ("E", (50,), (), e & (v == 50)),
+            ("N", (50,), (), e & (v != 50)),
+            ("S", (), (), e),
+            ("D", (), (), ~e),
+            ("I", (1, 2, 3), (), e & ((v == 1) | (v == 2) | (v == 3))),
+            ("J", (1, 2, 3), (), e & (v != 1) & (v != 2) & (v != 3)),
+            ("E", (), (2,), e & (locales[:, 0] == 2)),
+            ("I", (), (1, 3), e & (locales[:, 0] != 2)),
+        ]
+        for comparator, intValues, localeIds, expected in checks:
+            spec = RequirementSpec(7, comparator, intValues, localeIds)
+            mask = matrix.requirement_mask(spec)
+            self.assertTrue( np.array_equal(mask, expected) )
+
+        specs = [
+            RequirementSpec(7, "G", (50,), ()),
+            RequirementSpec(9, "D", (), ()),
+        ]
+        mask = matrix.eligible_mask(specs)
+        expected = e & (v > 50) & ~exists[:, 1]
+        self.assertEqual( np.count_nonzero(mask), np.count_nonzero(expected) )
+
+        with self.assertRaises(InvalidQualRequirementError):
+            matrix.requirement_mask(RequirementSpec(7, "L", (), ()))
+
+    def test_compressed_payloads(self):
+        test = load_quesform(2)
+        answer = load_answerkey(1)
+        resp = self.client.create_qualification_type(
+            Name = "Compressed",
+            Description = "Qual with a large test",
+            QualificationTypeStatus = "Active",
+            Test = test,
+            TestDurationInSeconds = 100,
+            AnswerKey = answer,
+        )
+        self.is_ok(resp)
+        qualId = resp["QualificationType"]["QualificationTypeId"]
+
+        def stored(field):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT %s FROM mturk_qualification WHERE aws_id = %%s" % field,
+                    [qualId]
+                )
+                return( cursor.fetchone()[0] )
+
+        # Values at least as long as the threshold are stored
+        # compressed but read back unchanged.
+        self.assertGreater( len(test), CompressedTextField.get_threshold() )
+        self.assertTrue( CompressedTextField.is_compressed(stored("test")) )
+        self.assertLess( len(stored("test")), len(test) )
+        qual = Qualification.objects.get(aws_id = qualId)
+        self.assertEqual( qual.test, test )
+        self.assertEqual( qual.answer, answer )
+        resp = self.client.get_qualification_type(QualificationTypeId = qualId)
+        self.assertEqual( resp["QualificationType"]["Test"], test )
+
+        # Raw values (stored before compression was enabled) are
+        # read unchanged and are compressed by 'CompressPayloads'.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE mturk_qualification SET test = %s WHERE aws_id = %s",
+                [test, qualId]
+            )
+        self.assertEqual( Qualification.objects.get(aws_id = qualId).test, test )
+        out = StringIO()
+        call_command("CompressPayloads", stdout = out)
+        self.assertIn( "Qualification.test: Rows: ", out.getvalue() )
+        self.assertTrue( CompressedTextField.is_compressed(stored("test")) )
+        self.assertEqual( Qualification.objects.get(aws_id = qualId).test, test )
+
+        # Raw values that look like compressed values are escaped
+        short = CompressedTextField.PREFIX + "asdf"
+        self.assertNotEqual( CompressedTextField.compress(short), short )
+        self.assertEqual(
+            CompressedTextField.decompress(CompressedTextField.compress(short)),
+            short
+        )
+        self.assertEqual( CompressedTextField.compress("<a/>"), "<a/>" )
+
+    def test_rescore_requests(self):
+        self.create_new_client("test2")
+        worker = Worker.objects.get(user__username = "test2")
+        actor = WorkerActor(worker)
+
+        test = load_quesform(2)
+        resp = self.client.create_qualification_type(
+            Name = "Rescored",
+            Description = "Qual with an updated answer key",
+            QualificationTypeStatus = "Active",
+            Test = test,
+            AnswerKey = load_answerkey(1),
+            TestDurationInSeconds = 100
+        )
+        self.is_ok(resp)
+        qualId = resp["QualificationType"]["QualificationTypeId"]
+        qual = Qualification.objects.get(aws_id = qualId)
+
+        req = actor.create_qual_request(qual)
+        answer = {
+            "favorite" : ["green"],
+            "acceptible" : ["red", "blue"],
+        }
+        actor.submit_test_answer(req, answer)
+        grant = QualificationGrant.objects.get(worker = worker, qualification = qual)
+        self.assertEqual( grant.value, 66 )
+
+        # The compiled answer key scores the stored answers the
+        # same as the submitted form.
+        req.refresh_from_db()
+        stored = read_stored_answers(req.answer)
+        self.assertEqual( stored["acceptible"], ["red", "blue"] )
+        self.assertEqual( get_answer_key(qual.answer).score_answers(stored), 66 )
+        self.assertIs( get_answer_key(qual.answer), get_answer_key(qual.answer) )
+
+        resp = self.client.update_qualification_type(
+            QualificationTypeId = qualId,
+            Test = test,
+            TestDurationInSeconds = 100,
+            AnswerKey = load_answerkey(2)
+        )
+        self.is_ok(resp)
+
+        emu = self.create_emulator_client("test1")
+        resp = emu.call("RescoreQualificationRequests", QualificationTypeId = qualId)
+        self.assertEqual( resp["NumberOfRequests"], 1 )
+        self.assertEqual( resp["NumberOfGrantsUpdated"], 1 )
+        self.assertEqual( resp["NumberOfFailures"], 0 )
+        grant.refresh_from_db()
+        self.assertEqual( grant.value, 10 )
+
+        # Only the owner of the qualification may rescore it
+        other = self.create_emulator_client("test2")
+        with self.assertRaises(EmulatorClientError):
+            other.call("RescoreQualificationRequests", QualificationTypeId = qualId)
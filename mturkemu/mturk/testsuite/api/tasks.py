@@ -7,16 +7,29 @@
 #
 
 from django.utils import timezone
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import Client
 
 from mturk.models import *
-from mturk.testsuite.utils import RequesterLiveTestCase, load_quesform
+from mturk.testsuite.utils import RequesterTestCase, RequesterLiveTestCase, load_quesform
 from mturk.worker.actor import WorkerActor
 from mturk.worker.TasksActor import *
+from mturk.paging import ListPager
+from mturk.handlers import MTurkHandlers
+from mturk.errors import ValidationError
+from mturk.deferred import deferred_work, defer
+from mturk.requirements import get_requirements
+from mturk.swarm import SwarmConfig, SwarmEngine, WorkerProfile
+
+from django.core.management import call_command
+
+from io import StringIO
 
 from datetime import timedelta
 from decimal import Decimal
 
-class TaskTests(RequesterLiveTestCase):
+class TaskTests(RequesterTestCase):
 
     def test_create_hit_type(self):
         """
@@ -584,6 +597,171 @@ class TaskTests(RequesterLiveTestCase):
             )
 
 
+    def test_compiled_requirements(self):
+        """
+        Check that the compiled requirements of a task type match the
+        model checks, use one grant query and are invalidated when
+        the requirements change.
+        """
+        self.create_quals()
+        self.create_workers()
+
+        qualReqs = [
+            {
+                "QualificationTypeId" : self.quals[0],
+                "Comparator" : "GreaterThan",
+                "IntegerValues" : [ 15 ],
+                "RequiredToPreview" : False
+            },
+            {
+                "QualificationTypeId" : self.quals[0],
+                "Comparator" : "NotIn",
+                "IntegerValues" : [ 30, 40 ],
+                "RequiredToPreview" : True
+            },
+            {
+                "QualificationTypeId" : self.quals[1],
+                "Comparator" : "DoesNotExist",
+                "RequiredToPreview" : False
+            },
+        ]
+        resp = self.client.create_hit_type(
+            AutoApprovalDelayInSeconds = 1000,
+            AssignmentDurationInSeconds = 100,
+            Reward = "0.13",
+            Title = "Compiled",
+            Description = "Little bit of sugar",
+            QualificationRequirements = qualReqs
+        )
+        self.is_ok(resp)
+        tt = TaskType.objects.get(aws_id = resp["HITTypeId"])
+
+        expResults = [False, True, False]
+        for i, expResult in enumerate(expResults):
+            worker = self.actors[i].worker
+            expected = True
+            for qualreq in tt.qualifications.all():
+                grant = worker.qualificationgrant_set.filter(
+                    active = True,
+                    qualification = qualreq.qualification,
+                    dispose = False
+                ).first()
+                expected = expected and qualreq.check_grant(grant)
+            self.assertEqual( expected, expResult )
+
+            get_requirements(tt)
+            with CaptureQueriesContext(connection) as ctx:
+                result = self.actors[i].check_prerequisite_quals(tt)
+            self.assertEqual( result, expResult )
+            self.assertEqual( len(ctx.captured_queries), 1 )
+
+        # Only the 'NotIn' requirement applies to the preview
+        self.assertTrue( self.actors[0].check_prerequisite_quals(tt, preview=True) )
+        self.assertFalse( self.actors[2].check_prerequisite_quals(tt, preview=True) )
+
+        reqs = get_requirements(tt)
+        with self.assertRaises(AttributeError):
+            reqs.qual_ids = frozenset()
+
+        # Changing the requirements of the task type invalidates
+        # the compiled requirements
+        tt.qualifications.remove( tt.qualifications.get(
+            comparator = QualComparatorField.GREATER_THAN
+        ) )
+        self.assertIsNot( get_requirements(tt), reqs )
+        self.assertTrue( self.actors[0].check_prerequisite_quals(tt) )
+
+    def test_task_feed(self):
+        """
+        Check the HIT groups and next task available to each worker
+        and that the number of queries doesn't depend on the number
+        of tasks.
+        """
+        self.create_quals()
+        self.create_workers()
+
+        def create_group(reward, lifetime, numTasks, qualReqs):
+            resp = self.client.create_hit_type(
+                AssignmentDurationInSeconds = 1000,
+                Reward = reward,
+                Title = "Feed",
+                Description = "Little bit of sugar",
+                QualificationRequirements = qualReqs
+            )
+            self.is_ok(resp)
+            for i in range(0, numTasks):
+                resp2 = self.client.create_hit_with_hit_type(
+                    HITTypeId = resp["HITTypeId"],
+                    MaxAssignments = 2,
+                    LifetimeInSeconds = lifetime,
+                    Question = load_quesform(2),
+                )
+                self.is_ok(resp2)
+            return( TaskType.objects.get(aws_id = resp["HITTypeId"]) )
+
+        groupA = create_group("0.50", 10000, 5, [])
+        groupB = create_group("0.10", 5000, 3, [
+            {
+                "QualificationTypeId" : self.quals[0],
+                "Comparator" : "GreaterThan",
+                "IntegerValues" : [ 15 ],
+            },
+        ])
+
+        def group_counts(actor, order=None):
+            return([
+                (tt.pk, tt.num_available)
+                for tt in actor.list_task_groups(order)
+            ])
+
+        # Worker 0 doesn't meet the requirements of group B
+        self.assertEqual( group_counts(self.actors[0]), [(groupA.pk, 5)] )
+        self.assertEqual(
+            group_counts(self.actors[1]), [(groupA.pk, 5), (groupB.pk, 3)]
+        )
+        self.assertEqual(
+            group_counts(self.actors[1], "expires"),
+            [(groupB.pk, 3), (groupA.pk, 5)]
+        )
+        self.assertIsNone( self.actors[0].next_task(groupB) )
+
+        # Tasks that the worker has an assignment for are skipped
+        task = self.actors[1].next_task(groupA)
+        self.actors[1].accept_task(task)
+        nextTask = self.actors[1].next_task(groupA)
+        self.assertNotEqual( task.pk, nextTask.pk )
+        self.assertEqual(
+            group_counts(self.actors[1]), [(groupA.pk, 4), (groupB.pk, 3)]
+        )
+        self.assertEqual( group_counts(self.actors[2])[0], (groupA.pk, 5) )
+
+        # The queries don't depend on the number of tasks
+        self.actors[1].next_task(groupB)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertIsNotNone( self.actors[1].next_task(groupB) )
+        self.assertEqual( len(ctx.captured_queries), 2 )
+        with CaptureQueriesContext(connection) as ctx:
+            groups = list(self.actors[1].list_task_groups())
+        self.assertEqual( len(ctx.captured_queries), 3 )
+
+        # Blocked workers don't see the requester's tasks
+        resp = self.client.create_worker_block(
+            WorkerId = self.actors[2].worker.aws_id,
+            Reason = "Feed"
+        )
+        self.is_ok(resp)
+        self.assertEqual( group_counts(self.actors[2]), [] )
+        self.assertIsNone( self.actors[2].next_task(groupA) )
+
+        # Worker pages
+        web = Client()
+        self.assertTrue( web.login(username = "test3", password = "test30") )
+        resp = web.get("/worker/tasks/?order=expires")
+        self.assertEqual( resp.status_code, 200 )
+        resp = web.get("/worker/tasks/next/%d/" % groupB.pk)
+        self.assertEqual( resp.status_code, 302 )
+        self.assertIn( "/worker/tasks/", resp["Location"] )
+
     def test_create_task_with_tasktype(self):
         """
         Create Task with a tasktype Object. This test generally does
@@ -1163,6 +1341,55 @@ class TaskTests(RequesterLiveTestCase):
         self.assertEqual( assignment.worker.aws_id, self.actors[2].worker.aws_id )
 
 
+    def test_question_blobs(self):
+        """
+        Tasks with the same question share one blob.
+        """
+        question = load_quesform(2)
+        taskIds = []
+        for i in range(0, 2):
+            resp = self.client.create_hit(
+                MaxAssignments = 1,
+                LifetimeInSeconds = 10000,
+                AssignmentDurationInSeconds = 1000,
+                Reward = "0.13",
+                Title = "Blob %d" % i,
+                Description = "Little bit of sugar",
+                Question = question,
+            )
+            self.is_ok(resp)
+            self.assertEqual( resp["HIT"]["Question"], question )
+            taskIds.append(resp["HIT"]["HITId"])
+
+        tasks = Task.objects.filter(aws_id__in = taskIds)
+        self.assertEqual( QuestionBlob.objects.count(), 1 )
+        for task in tasks:
+            self.assertEqual( task.question_inline, "" )
+            self.assertEqual( task.question, question )
+            self.assertTrue( task.is_questionform() )
+
+        # Tasks with inline questions are moved to the blob table
+        tasks.update(question_blob = None, question_inline = question)
+        self.assertEqual( QuestionBlob.purge_unused(), 1 )
+
+        out = StringIO()
+        call_command("DedupeQuestions", stdout = out)
+        size = len(question.encode("utf-8"))
+        self.assertIn(
+            "Tasks: 2 New Blobs: 1 Inline Bytes: %d Bytes Saved: %d" % (
+                2*size, size
+            ),
+            out.getvalue()
+        )
+        self.assertEqual( QuestionBlob.objects.count(), 1 )
+        for task in Task.objects.filter(aws_id__in = taskIds):
+            self.assertEqual( task.question_inline, "" )
+            self.assertEqual( task.question, question )
+
+        resp = self.client.get_hit(HITId = taskIds[0])
+        self.is_ok(resp)
+        self.assertEqual( resp["HIT"]["Question"], question )
+
     def test_delete_task(self):
         """
         Test the creation and deletion of a task
@@ -1367,6 +1594,135 @@ class TaskTests(RequesterLiveTestCase):
         self.assertEqual( numResults, 0 )
 
 
+    def test_list_hits_paging(self):
+        """
+        Check the cursor tokens for the list methods including the
+        legacy offset tokens and ties on the creation time.
+        """
+        taskIds = []
+        for i in range(0, 7):
+            resp = self.client.create_hit(
+                MaxAssignments = 1,
+                LifetimeInSeconds = 10000,
+                AssignmentDurationInSeconds = 1000,
+                Reward = "0.13",
+                Title = "Paging",
+                Description = "Little bit of sugar",
+                Question = load_quesform(2),
+            )
+            self.is_ok(resp)
+            taskIds.append( resp["HIT"]["HITId"] )
+
+        def list_all(maxResults, **kwargs):
+            obsIds = []
+            pageSizes = []
+            while ( True ):
+                resp = self.client.list_hits(MaxResults = maxResults, **kwargs)
+                self.is_ok(resp)
+                pageSizes.append( resp["NumResults"] )
+                obsIds.extend([ x["HITId"] for x in resp["HITs"] ])
+                if ( "NextToken" not in resp ):
+                    break
+                kwargs["NextToken"] = resp["NextToken"]
+            return(obsIds, pageSizes)
+
+        # Short final page does not return a next token
+        obsIds, pageSizes = list_all(3)
+        self.assertEqual( pageSizes, [3, 3, 1] )
+        self.assertEqual( obsIds, list(reversed(taskIds)) )
+
+        # Full final page requires one more request
+        obsIds, pageSizes = list_all(7)
+        self.assertEqual( pageSizes, [7, 0] )
+
+        # Legacy Offset Tokens
+        obsIds, pageSizes = list_all(3, NextToken = "A%010d" % 3)
+        self.assertEqual( pageSizes, [3, 1] )
+        self.assertEqual( obsIds, list(reversed(taskIds))[3:] )
+
+        # Ties in the creation time are ordered by primary key
+        Task.objects.all().update(created = timezone.now())
+        obsIds, pageSizes = list_all(2)
+        self.assertEqual( pageSizes, [2, 2, 2, 1] )
+        self.assertEqual( set(obsIds), set(taskIds) )
+        self.assertEqual( len(obsIds), len(taskIds) )
+
+        RequestError = self.client._load_exceptions().RequestError
+        for token in ["asdf", "Cnotbase64!", "C" + "e30"]:
+            with self.assertRaises(RequestError):
+                self.client.list_hits(MaxResults = 3, NextToken = token)
+
+        # Tokens are specific to the ordering of the list
+        pager = ListPager("created", 3)
+        token = pager.encode_cursor(Task.objects.first())
+        with self.assertRaises(ValidationError):
+            ListPager("granted", 3, token)
+
+    def test_list_serialization_queries(self):
+        """
+        Check that the number of queries to serialize a page of a
+        list method does not depend on the size of the page.
+        """
+        self.create_quals()
+        self.create_workers()
+
+        for i in range(0, 6):
+            resp = self.client.create_hit(
+                MaxAssignments = 2,
+                LifetimeInSeconds = 10000,
+                AssignmentDurationInSeconds = 1000,
+                Reward = "0.13",
+                Title = "Serialize %d" % i,
+                Description = "Little bit of sugar",
+                Keywords = "asdf,qwer",
+                Question = load_quesform(2),
+                QualificationRequirements=[
+                    {
+                        "QualificationTypeId" : self.quals[0],
+                        "Comparator" : "GreaterThan",
+                        "IntegerValues" : [ 20 ],
+                    },
+                    {
+                        "QualificationTypeId" : self.quals[1],
+                        "Comparator" : "Exists",
+                    },
+                ],
+            )
+            self.is_ok(resp)
+
+        requester = Requester.objects.get(user__username = "test1")
+        handlers = MTurkHandlers()
+
+        def count_queries(method, **kwargs):
+            with CaptureQueriesContext(connection) as cxt:
+                resp = method(EmuRequester = requester, **kwargs)
+            return( len(cxt.captured_queries), resp )
+
+        smallCnt, resp = count_queries(handlers.ListHITs, MaxResults = 2)
+        self.assertEqual( resp["NumResults"], 2 )
+        largeCnt, resp = count_queries(handlers.ListHITs, MaxResults = 6)
+        self.assertEqual( resp["NumResults"], 6 )
+        self.assertEqual( smallCnt, largeCnt )
+
+        # The batch serialized objects must match the individually
+        # serialized objects.
+        for obj in resp["HITs"]:
+            task = Task.objects.get(aws_id = obj["HITId"])
+            self.assertEqual( obj, task.serialize(includeAnnotation=True) )
+            self.assertEqual( len(obj["QualificationRequirements"]), 2 )
+
+        smallCnt, resp = count_queries(
+            handlers.ListWorkersWithQualificationType,
+            QualificationTypeId = self.quals[0], MaxResults = 1
+        )
+        self.assertEqual( resp["NumResults"], 1 )
+        largeCnt, resp = count_queries(
+            handlers.ListWorkersWithQualificationType,
+            QualificationTypeId = self.quals[0], MaxResults = 3
+        )
+        self.assertEqual( resp["NumResults"], 3 )
+        self.assertEqual( smallCnt, largeCnt )
+
     def test_return_assignment(self):
         """
         This test will check the "return" assignment behavior for
@@ -1438,6 +1794,180 @@ class TaskTests(RequesterLiveTestCase):
         self.actors[0].worker.refresh_from_db()
         self.assertEqual( self.actors[0].worker.returned_hits, 1 )
 
+    def test_assignment_counters(self):
+        """
+        Check that the task's assignment counters track the
+        assignment state changes and that the reconcile command
+        repairs counters that have drifted.
+        """
+        self.create_quals()
+        self.create_workers()
+
+        resp = self.client.create_hit(
+            MaxAssignments = 2,
+            LifetimeInSeconds = 10000,
+            AssignmentDurationInSeconds = 1000,
+            Reward = "0.13",
+            Title = "Counters",
+            Description = "Little bit of sugar",
+            Question = load_quesform(2),
+        )
+        self.is_ok(resp)
+
+        taskId = resp["HIT"]["HITId"]
+        task = Task.objects.get(aws_id = taskId)
+
+        def check_counts(pending, submitted, completed):
+            task.refresh_from_db()
+            self.assertEqual( task.num_pending, pending )
+            self.assertEqual( task.num_submitted, submitted )
+            self.assertEqual( task.num_completed, completed )
+            counts = task.count_assignments()
+            self.assertEqual( counts["num_pending"], pending )
+            self.assertEqual( counts["num_submitted"], submitted )
+            self.assertEqual( counts["num_completed"], completed )
+
+        check_counts(0, 0, 0)
+
+        assign0 = self.actors[0].accept_task(task)
+        assign1 = self.actors[1].accept_task(task)
+        check_counts(2, 0, 0)
+        self.assertTrue( task.is_unassignable() )
+
+        data = {
+            "favorite" : ["blue"],
+            "acceptible" : ["red", "blue"]
+        }
+        self.actors[0].complete_assignment( assign0, data )
+        check_counts(1, 1, 0)
+
+        # A stale task object must not overwrite the counters
+        staleTask = Task.objects.get(aws_id = taskId)
+        self.actors[1].complete_assignment( assign1, data )
+        check_counts(0, 2, 0)
+        self.assertTrue( task.is_reviewable() )
+        staleTask.annotation = "stale"
+        staleTask.status = TaskStatusField.REVIEWABLE
+        staleTask.save()
+        check_counts(0, 2, 0)
+
+        resp = self.client.approve_assignment( AssignmentId = assign0.aws_id )
+        self.is_ok(resp)
+        check_counts(0, 1, 1)
+
+        resp = self.client.get_hit( HITId = taskId )
+        self.assertEqual( resp["HIT"]["NumberOfAssignmentsPending"], 0 )
+        self.assertEqual( resp["HIT"]["NumberOfAssignmentsAvailable"], 0 )
+        self.assertEqual( resp["HIT"]["NumberOfAssignmentsCompleted"], 1 )
+
+        # Introduce drift and then reconcile
+        Task.objects.filter(pk = task.pk).update(
+            num_pending = 3, num_completed = 0
+        )
+        out = StringIO()
+        call_command("ReconcileTaskCounters", stdout=out)
+        self.assertIn("%s: num_pending stored=3 counted=0" % taskId, out.getvalue())
+        self.assertIn("%s: num_completed stored=0 counted=1" % taskId, out.getvalue())
+        task.refresh_from_db()
+        self.assertEqual( task.num_pending, 3 )
+
+        call_command("ReconcileTaskCounters", fix=True, stdout=StringIO())
+        check_counts(0, 1, 1)
+
+    def test_deferred_state_check(self):
+        """
+        Check that the task state check is only run once when
+        many assignments of a task change in one operation.
+        """
+        self.create_quals()
+        self.create_workers()
+
+        resp = self.client.create_hit(
+            MaxAssignments = 2,
+            LifetimeInSeconds = 10000,
+            AssignmentDurationInSeconds = 1000,
+            Reward = "0.13",
+            Title = "Deferred",
+            Description = "Little bit of sugar",
+            Question = load_quesform(2),
+        )
+        self.is_ok(resp)
+        task = Task.objects.get(aws_id = resp["HIT"]["HITId"])
+
+        data = {
+            "favorite" : ["blue"],
+            "acceptible" : ["red", "blue"]
+        }
+        assigns = []
+        for actor in self.actors[0:2]:
+            assign = actor.accept_task(task)
+            actor.complete_assignment(assign, data)
+            assigns.append(assign)
+
+        with deferred_work() as workSet:
+            for assign in assigns:
+                assign.refresh_from_db()
+                assign.approve()
+                assign.save()
+            # Nothing has been run yet
+            self.assertEqual( workSet.num_run, 0 )
+
+        self.assertEqual( workSet.num_deferred, 2 )
+        self.assertEqual( workSet.num_run, 1 )
+
+        task.refresh_from_db()
+        self.assertEqual( task.num_submitted, 0 )
+        self.assertEqual( task.num_completed, 2 )
+        self.assertTrue( task.is_reviewable() )
+
+        # Deferred work is discarded if the block fails
+        with self.assertRaises(ValueError):
+            with deferred_work() as workSet:
+                defer(("fail", 0), lambda: self.fail("Work Ran"))
+                raise ValueError()
+
+    def test_accept_slot_reservation(self):
+        """
+        Check that workers accepting a task with stale task objects
+        can't assign more than the max assignments.
+        """
+        self.create_quals()
+        self.create_workers()
+
+        resp = self.client.create_hit(
+            MaxAssignments = 1,
+            LifetimeInSeconds = 10000,
+            AssignmentDurationInSeconds = 1000,
+            Reward = "0.13",
+            Title = "Slots",
+            Description = "Little bit of sugar",
+            Question = load_quesform(2),
+        )
+        self.is_ok(resp)
+        taskId = resp["HIT"]["HITId"]
+
+        # Both workers load the task while it is assignable
+        task0 = Task.objects.get(aws_id = taskId)
+        task1 = Task.objects.get(aws_id = taskId)
+
+        self.actors[0].accept_task(task0)
+        with self.assertRaises(TaskNotAvailableError):
+            self.actors[1].accept_task(task1)
+
+        task0.refresh_from_db()
+        self.assertEqual( task0.num_pending, 1 )
+        self.assertEqual( task0.assignment_set.count(), 1 )
+        self.assertTrue( task0.is_unassignable() )
+        self.assertEqual( len(task0.reconcile_counters(fix=False)), 0 )
+
+        # Returning the assignment frees the slot
+        self.actors[0].return_task(task0)
+        task1.refresh_from_db()
+        self.assertTrue( task1.is_assignable() )
+        self.actors[1].accept_task(task1)
+        task1.refresh_from_db()
+        self.assertEqual( task1.num_pending, 1 )
+
     def test_award_bonus(self):
         """
         This test will check the functioning of the bonus award to a
@@ -2289,3 +2819,81 @@ class TaskTests(RequesterLiveTestCase):
         # Create HIT Type with requirement for this qual
         # Set Qualification to Inactive
         # Attempt to create HIT with HIT Type - should fail
+
+
+class TaskConcurrencyTests(RequesterLiveTestCase):
+    """
+    Tests with many threads, each with its own database connection,
+    so the changes must be committed.
+    """
+
+    def test_accept_benchmark(self):
+        out = StringIO()
+        call_command(
+            "BenchmarkAccept", workers=12, tasks=2, assignments=3, stdout=out
+        )
+        self.assertIn("Accepted: 6 Full:", out.getvalue())
+        self.assertIn("Overbooked Tasks: 0 Drifted Tasks: 0", out.getvalue())
+        self.assertFalse(
+            User.objects.filter(username__startswith = "bench-").exists()
+        )
+
+    def test_worker_swarm(self):
+        """
+        Virtual workers request a qualification and submit
+        generated answers for all of the assignments.
+        """
+        resp = self.client.create_qualification_type(
+            Name = "Swarm Qual",
+            Description = "Auto granted",
+            QualificationTypeStatus = "Active",
+            AutoGranted = True,
+            AutoGrantedValue = 5,
+        )
+        qualId = resp["QualificationType"]["QualificationTypeId"]
+
+        hitIds = []
+        for index in [1, 2]:
+            resp = self.client.create_hit(
+                MaxAssignments = 3,
+                LifetimeInSeconds = 10000,
+                AssignmentDurationInSeconds = 1000,
+                Reward = "0.05",
+                Title = "Swarm %d" % index,
+                Description = "Generated answers",
+                Question = load_quesform(index),
+                QualificationRequirements = [
+                    {
+                        "QualificationTypeId" : qualId,
+                        "Comparator" : "GreaterThan",
+                        "IntegerValues" : [1],
+                    },
+                ],
+            )
+            hitIds.append(resp["HIT"]["HITId"])
+
+        config = SwarmConfig(
+            5,
+            profiles = [ WorkerProfile(requestQuals = [qualId]) ],
+            seed = 1,
+        )
+        engine = SwarmEngine(config)
+        engine.setup()
+        result = engine.run()
+
+        self.assertEqual( result.num_errors, 0 )
+        self.assertEqual( result.outcomes["Submitted"], 6 )
+        self.assertEqual( result.operations["request_qual"].count, 5 )
+        summary = result.summary()
+        self.assertEqual( summary["Operations"]["submit"]["Count"], 6 )
+
+        for hitId in hitIds:
+            resp = self.client.list_assignments_for_hit(
+                HITId = hitId, AssignmentStatuses = ["Submitted"]
+            )
+            self.assertEqual( resp["NumResults"], 3 )
+
+        engine.cleanup()
+        self.assertFalse(
+            User.objects.filter(username__startswith = engine.prefix).exists()
+        )
@@ -6,9 +6,9 @@
 # worker related API calls.
 
 from mturk.models import *
-from mturk.testsuite.utils import RequesterLiveTestCase
+from mturk.testsuite.utils import RequesterTestCase
 
-class WorkerTests(RequesterLiveTestCase):
+class WorkerTests(RequesterTestCase):
 
     def check_block_list(self, expWorkers, reasons, obsBlocks):
         """
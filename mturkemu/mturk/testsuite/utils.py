@@ -6,10 +6,14 @@
 #
 
 from django.conf import settings
-from django.test import LiveServerTestCase
+from django.test import LiveServerTestCase, TestCase, override_settings
 from django.contrib.auth.models import User
 
 from mturk.models import *
+from mturk.transport import IN_PROCESS_URL, InProcessTransport, install_transport
+from mturk.extensions import EmulatorClient
+from mturk.requirements import requirements_cache
+from mturk.population import eligibility_engine
 
 import boto3
 import os.path
@@ -33,25 +37,46 @@ def load_answerkey(index):
     return(answerKey)
 
 
-class RequesterLiveTestCase(LiveServerTestCase):
+class RequesterClientMixin(object):
     """
-    Live server test case with a requester user
-    configured with credentials and a boto3 client
-    object created and ready.
+    Test case mixin that sets up a requester user configured with
+    credentials and a boto3 client object created and ready.
     """
+
+    # If true, the clients send their requests to the django request
+    #   handler in-process instead of to the live server.
+    in_process = False
+
     def setUp(self):
         super().setUp()
 
+        # The objects of a rolled back test are removed without
+        # signals and their pks are reused by the next test, so
+        # drop the process wide state that is keyed by pk.
+        requirements_cache.invalidate()
+        eligibility_engine.invalidate_workers()
+
         # Setup a requester account and create an
         # access ID / key for the account
         self.client = self.create_new_client("test1")
 
-    def create_new_client(self, username):
+    def get_endpoint_url(self, inProcess):
+        if ( inProcess ):
+            return(IN_PROCESS_URL)
+        return(self.live_server_url)
+
+    def create_new_client(self, username, inProcess=None):
         """
         Create a new client for a user with the passed
         username. If that user does not exist, then a user
         will be created before creating the client.
+        @param inProcess if true, the client sends its requests
+           in-process - see 'mturk/transport.py'. By default, the
+           'in_process' attribute of the test case is used.
         """
+        if ( inProcess is None ):
+            inProcess = self.in_process
+
         # Setup a requester account and create an
         # access ID / key for the account
         try:
@@ -76,7 +101,7 @@ class RequesterLiveTestCase(LiveServerTestCase):
             secret_key = self.secretKey
         )
 
-        url = self.live_server_url
+        url = self.get_endpoint_url(inProcess)
         client = boto3.client(
             "mturk",
             aws_access_key_id = self.accessKey,
@@ -85,8 +110,26 @@ class RequesterLiveTestCase(LiveServerTestCase):
             region_name="us-east-1",
             endpoint_url=url
             )
+        if ( inProcess ):
+            install_transport(client)
         return(client)
 
+    def create_emulator_client(self, username, inProcess=None):
+        """
+        Create a client for the emulator specific operations with
+        the credential of an existing user.
+        """
+        if ( inProcess is None ):
+            inProcess = self.in_process
+        cred = Credential.objects.filter(requester__user__username = username)[0]
+        return(
+            EmulatorClient(
+                self.get_endpoint_url(inProcess),
+                cred.access_key, cred.secret_key,
+                transport = InProcessTransport() if inProcess else None
+            )
+        )
+
     def is_ok(self, resp):
         """
         Check if the response from the service is a valid
@@ -94,3 +137,28 @@ class RequesterLiveTestCase(LiveServerTestCase):
         """
         code = resp["ResponseMetadata"]["HTTPStatusCode"]
         self.assertEqual(code, 200)
+
+
+# The tests create many users - a fast password hasher keeps the
+#   hashing from dominating the run time.
+TEST_PASSWORD_HASHERS = [
+    "django.contrib.auth.hashers.MD5PasswordHasher",
+]
+
+@override_settings(PASSWORD_HASHERS = TEST_PASSWORD_HASHERS)
+class RequesterLiveTestCase(RequesterClientMixin, LiveServerTestCase):
+    """
+    Requester test case with a live server - the clients send
+    their requests over HTTP by default.
+    """
+    pass
+
+
+@override_settings(PASSWORD_HASHERS = TEST_PASSWORD_HASHERS)
+class RequesterTestCase(RequesterClientMixin, TestCase):
+    """
+    Requester test case without a live server - the clients send
+    their requests in-process and the changes made by each test
+    are rolled back.
+    """
+    in_process = True
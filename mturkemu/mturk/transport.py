@@ -0,0 +1,130 @@
+# File: mturk/transport.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of an in-process
+# transport for the API clients. Instead of sending a request over
+# a socket to a live server, the signed request is converted into a
+# WSGI environment and passed straight to the django request
+# handler of this process - the same middleware, url resolution and
+# 'MTurkMockAPI' view as a live server. This allows test suites to
+# use a boto3 client with an ordinary django 'TestCase' (and its
+# transaction rollback) instead of a 'LiveServerTestCase'.
+#
+# Example:
+#    client = boto3.client("mturk", endpoint_url=IN_PROCESS_URL, ...)
+#    install_transport(client)
+#
+
+from django.test.client import ClientHandler, RequestFactory
+
+from botocore.vendored.requests.adapters import BaseAdapter
+from botocore.vendored.requests.models import Response
+from botocore.vendored.requests.structures import CaseInsensitiveDict
+from botocore.vendored.requests.utils import get_encoding_from_headers
+
+from urllib.parse import urlsplit
+import io
+
+# Endpoint url for clients that use the in-process transport - the
+#   host name is the one that django's test client uses.
+IN_PROCESS_URL = "http://testserver"
+
+class EnvironFactory(RequestFactory):
+    """
+    Request factory that creates the WSGI environment of a request
+    instead of a request object.
+    """
+    def request(self, **request):
+        return( self._base_environ(**request) )
+
+class InProcessTransport(object):
+    """
+    Send HTTP requests to the django request handler of this
+    process.
+    """
+    def __init__(self):
+        self._handler = ClientHandler(enforce_csrf_checks=False)
+        self._factory = EnvironFactory()
+
+    def send(self, method, url, headers, body):
+        """
+        @param headers dict of the request headers
+        @param body bytes of the request body
+        @return tuple of the status code, a dict of the response
+           headers and the bytes of the response body.
+        """
+        parts = urlsplit(url)
+        path = parts.path if len(parts.path) > 0 else "/"
+        if ( len(parts.query) > 0 ):
+            path = "%s?%s" % (path, parts.query)
+
+        contentType = "application/octet-stream"
+        extra = {
+            "SERVER_NAME" : parts.hostname,
+            "SERVER_PORT" : str(parts.port or (443 if parts.scheme == "https" else 80)),
+        }
+        for name, value in headers.items():
+            if ( isinstance(value, bytes) ):
+                value = value.decode("utf-8")
+            key = name.upper().replace("-", "_")
+            if ( key == "CONTENT_TYPE" ):
+                contentType = value
+            elif ( key != "CONTENT_LENGTH" ):
+                extra["HTTP_" + key] = value
+
+        environ = self._factory.generic(
+            method, path, data = body, content_type = contentType,
+            secure = (parts.scheme == "https"), **extra
+        )
+        resp = self._handler(environ)
+        return( resp.status_code, dict(resp.items()), resp.content )
+
+
+class InProcessAdapter(BaseAdapter):
+    """
+    Transport adapter for the botocore http session that sends
+    the requests with an InProcessTransport.
+    """
+    def __init__(self, transport=None):
+        super().__init__()
+        if ( transport is None ):
+            transport = InProcessTransport()
+        self.transport = transport
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        body = request.body
+        if ( body is None ):
+            body = b""
+        elif ( isinstance(body, str) ):
+            body = body.encode("utf-8")
+        elif ( hasattr(body, "read") ):
+            body = body.read()
+
+        status, headers, content = self.transport.send(
+            request.method, request.url, request.headers, body
+        )
+
+        resp = Response()
+        resp.status_code = status
+        resp.headers = CaseInsensitiveDict(headers)
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp._content = content
+        resp.raw = io.BytesIO(content)
+        resp.reason = ""
+        resp.url = request.url
+        resp.request = request
+        resp.connection = self
+        return(resp)
+
+    def close(self):
+        pass
+
+def install_transport(client, transport=None):
+    """
+    Send the requests of a boto3/botocore client in-process.
+    @return the client
+    """
+    endpoint = client._endpoint
+    endpoint.http_session.mount(endpoint.host, InProcessAdapter(transport))
+    return(client)
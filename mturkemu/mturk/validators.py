@@ -0,0 +1,278 @@
+# File: mturk/validators.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a compiler that
+# converts the botocore shape models for the mturk operations
+# into validation functions. botocore's 'validate_parameters'
+# walks the shape tree generically on every call, looking up the
+# shape type and metadata for every value. Here we walk the shape
+# tree once and generate a closure for each shape that only
+# contains the checks that the shape actually requires.
+#
+# The error reports generated by these functions are identical to
+# those generated by botocore's ParamValidator.
+#
+
+from botocore.compat import six
+from botocore.exceptions import ParamValidationError
+from botocore.utils import parse_to_aware_datetime
+from botocore.validate import ValidationErrors
+
+from datetime import datetime
+import decimal
+import itertools
+
+STRING_TYPES = six.string_types
+INTEGER_TYPES = six.integer_types
+FLOAT_TYPES = (float, decimal.Decimal) + six.integer_types
+
+def type_names(validTypes):
+    return( [six.text_type(t) for t in validTypes] )
+
+class ShapeCompiler(object):
+    """
+    Convert botocore Shape objects into validation functions
+    with the signature:
+        func(value, errors, name)
+    where errors is a botocore 'ValidationErrors' object.
+    """
+
+    def __init__(self):
+        # Compiled functions are cached by shape name so that shapes
+        # referenced from multiple places are only compiled once.
+        self._compiled = {}
+
+    def compile(self, shape):
+        """
+        @return validation function for the passed shape
+        """
+        name = shape.name
+        try:
+            return( self._compiled[name] )
+        except KeyError:
+            pass
+
+        # Insert a forwarding function before compiling so that
+        # recursive shapes terminate.
+        target = []
+        def forward(value, errors, name):
+            return( target[0](value, errors, name) )
+        self._compiled[name] = forward
+
+        method = getattr(self, "_compile_%s" % shape.type_name)
+        func = method(shape)
+
+        target.append(func)
+        self._compiled[name] = func
+        return(func)
+
+    def _range_check(self, shape, errorType):
+        """
+        Generate a check for the 'min' constraint of a shape or
+        None if the shape does not have one.
+        @note botocore only enforces the minimum value.
+        """
+        if ( "min" not in shape.metadata ):
+            return(None)
+
+        minAllowed = shape.metadata["min"]
+        validRange = [minAllowed, float("inf")]
+        def check(value, errors, name, size):
+            if ( size < minAllowed ):
+                errors.report(
+                    name, errorType, param=size, valid_range=validRange
+                )
+        return(check)
+
+    def _type_error(self, value, errors, name, validNames):
+        errors.report(
+            name, "invalid type", param=value, valid_types=validNames
+        )
+
+    def _compile_structure(self, shape):
+        required = tuple(shape.metadata.get("required", []))
+        members = {}
+        for memberName, memberShape in shape.members.items():
+            members[memberName] = self.compile(memberShape)
+        validNames = list(shape.members)
+        typeNames = type_names((dict,))
+
+        def check(params, errors, name):
+            if ( not isinstance(params, dict) ):
+                self._type_error(params, errors, name, typeNames)
+                return
+
+            for requiredName in required:
+                if ( requiredName not in params ):
+                    errors.report(
+                        name, "missing required field",
+                        required_name=requiredName, user_params=params
+                    )
+
+            known = []
+            for param in params:
+                if ( param not in members ):
+                    errors.report(
+                        name, "unknown field", unknown_param=param,
+                        valid_names=validNames
+                    )
+                else:
+                    known.append(param)
+
+            for param in known:
+                members[param](params[param], errors, "%s.%s" % (name, param))
+        return(check)
+
+    def _compile_string(self, shape):
+        rangeCheck = self._range_check(shape, "invalid length")
+        typeNames = type_names(STRING_TYPES)
+
+        def check(value, errors, name):
+            if ( not isinstance(value, STRING_TYPES) ):
+                self._type_error(value, errors, name, typeNames)
+                return
+            if ( rangeCheck is not None ):
+                rangeCheck(value, errors, name, len(value))
+        return(check)
+
+    def _compile_list(self, shape):
+        memberCheck = self.compile(shape.member)
+        rangeCheck = self._range_check(shape, "invalid length")
+        typeNames = type_names((list, tuple))
+
+        def check(value, errors, name):
+            if ( not isinstance(value, (list, tuple)) ):
+                self._type_error(value, errors, name, typeNames)
+                return
+            if ( rangeCheck is not None ):
+                rangeCheck(value, errors, name, len(value))
+            for i, item in enumerate(value):
+                memberCheck(item, errors, "%s[%s]" % (name, i))
+        return(check)
+
+    def _compile_map(self, shape):
+        keyCheck = self.compile(shape.key)
+        valueCheck = self.compile(shape.value)
+        typeNames = type_names((dict,))
+
+        def check(value, errors, name):
+            if ( not isinstance(value, dict) ):
+                self._type_error(value, errors, name, typeNames)
+                return
+            for k, v in value.items():
+                keyCheck(k, errors, "%s (key: %s)" % (name, k))
+                valueCheck(v, errors, "%s.%s" % (name, k))
+        return(check)
+
+    def _compile_number(self, shape, validTypes):
+        rangeCheck = self._range_check(shape, "invalid range")
+        typeNames = type_names(validTypes)
+
+        def check(value, errors, name):
+            if ( not isinstance(value, validTypes) ):
+                self._type_error(value, errors, name, typeNames)
+                return
+            if ( rangeCheck is not None ):
+                rangeCheck(value, errors, name, value)
+        return(check)
+
+    def _compile_integer(self, shape):
+        return( self._compile_number(shape, INTEGER_TYPES) )
+
+    def _compile_long(self, shape):
+        return( self._compile_number(shape, INTEGER_TYPES) )
+
+    def _compile_double(self, shape):
+        return( self._compile_number(shape, FLOAT_TYPES) )
+
+    def _compile_float(self, shape):
+        return( self._compile_number(shape, FLOAT_TYPES) )
+
+    def _compile_boolean(self, shape):
+        typeNames = type_names((bool,))
+        def check(value, errors, name):
+            if ( not isinstance(value, bool) ):
+                self._type_error(value, errors, name, typeNames)
+        return(check)
+
+    def _compile_blob(self, shape):
+        validNames = [str(bytes), str(bytearray), "file-like object"]
+        def check(value, errors, name):
+            if ( isinstance(value, (bytes, bytearray, six.text_type)) ):
+                return
+            if ( hasattr(value, "read") ):
+                return
+            self._type_error(value, errors, name, validNames)
+        return(check)
+
+    def _compile_timestamp(self, shape):
+        validNames = [six.text_type(datetime), "timestamp-string"]
+        def check(value, errors, name):
+            # The responses from our handlers almost always contain
+            # datetime objects - so avoid the parse in that case.
+            if ( isinstance(value, datetime) ):
+                return
+            try:
+                parse_to_aware_datetime(value)
+            except (TypeError, ValueError, AttributeError):
+                self._type_error(value, errors, name, validNames)
+        return(check)
+
+
+def compile_shape(shape, compiler=None):
+    """
+    Create a function that validates a set of parameters against
+    the passed shape and raises a ParamValidationError on failure.
+    If the shape is None, then no validation is done.
+    """
+    if ( shape is None ):
+        def validate(params):
+            pass
+        return(validate)
+
+    if ( compiler is None ):
+        compiler = ShapeCompiler()
+    check = compiler.compile(shape)
+
+    def validate(params):
+        errors = ValidationErrors()
+        check(params, errors, "")
+        if ( errors.has_errors() ):
+            raise ParamValidationError(report=errors.generate_report())
+    return(validate)
+
+
+class OperationValidator(object):
+    """
+    Compiled input and output validators for a particular
+    mturk API operation.
+    """
+    def __init__(self, opModel, compiler=None):
+        self.name = opModel.name
+        self.validate_input = compile_shape(opModel.input_shape, compiler)
+        self.validate_output = compile_shape(opModel.output_shape, compiler)
+
+
+class OutputSampler(object):
+    """
+    Determine which responses get validated against the output
+    shape of an operation.
+    @param rate integer: 0 = never validate, 1 = validate every
+       response, N = validate 1 out of every N responses.
+    """
+    def __init__(self, rate):
+        rate = int(rate)
+        if ( rate < 0 ):
+            raise Exception("Invalid Output Validation Rate: %d" % rate)
+        self.rate = rate
+        self._counter = itertools.count()
+
+    def should_validate(self):
+        if ( self.rate == 0 ):
+            return(False)
+        elif ( self.rate == 1 ):
+            return(True)
+        # @note - 'next' on a count object is atomic in CPython so
+        #    we don't need a lock here.
+        return( (next(self._counter) % self.rate) == 0 )
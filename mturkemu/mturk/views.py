@@ -3,26 +3,25 @@ from django.conf import settings
 from django.shortcuts import render, redirect
 from django.core.exceptions import MultipleObjectsReturned, PermissionDenied, SuspiciousOperation
 from django.views import View
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseForbidden, Http404
 from django.contrib.auth.models import User
 from django.contrib import messages
+from django.db import transaction
 
-from mturk.loader import Loader
-#try:
-from mturk.handlers import MTurkHandlers
-#except:
-#    pass
-
+from mturk.service import ServiceRegistry
 from mturk.models import *
 from mturk.forms import UserSignupForm
 from mturk.errors import RequestError
+from mturk.extensions import EXTENSION_TARGET_PREFIX
+from mturk.deferred import deferred_work
+from mturk.metrics import metrics
+from mturk.profiling import profiler
 
+from contextlib import ExitStack
 import re
 import json
 import uuid
 import traceback
-from botocore.model import ServiceModel
-from botocore.validate import validate_parameters
 import logging
 logger = logging.getLogger("mturk")
 
@@ -32,21 +31,13 @@ class MTurkMockAPI(View):
 
     def __init__(self, **kwargs):
         """
+        @note - Django constructs a new view object for every
+           request so the service model is not loaded here. It is
+           shared process wide via the ServiceRegistry.
         """
         super().__init__(**kwargs)
 
-        # Load the mturk services model here.
-        serviceFile = None
-        try:
-            serviceFile = settings.MTURK_SERVICE_FILE
-        except:
-            serviceFile = Loader.find_mturk_service_file()
-
-        self._serviceDef = Loader.load_service_defs(serviceFile)
-        self._targetPrefix = self._serviceDef["metadata"]["targetPrefix"]
-        self._model = ServiceModel( self._serviceDef, "mturk" )
-
-        self._handlers = MTurkHandlers()
+        self._service = ServiceRegistry.get()
 
 
     def get_target(self, request):
@@ -113,7 +104,21 @@ class MTurkMockAPI(View):
         """
         POST to this endpoint is processed as an API method
         """
+        recorder = metrics.start_request()
+        try:
+            return( self.process(request, recorder) )
+        except Exception as exc:
+            recorder.error = exc.__class__.__name__
+            raise
+        finally:
+            recorder.finish()
 
+    def process(self, request, recorder):
+        """
+        Process an API request.
+        @param recorder metrics recorder of the request - see
+           'mturk/metrics.py'
+        """
         requester = self.get_requester(request)
         if ( not requester.active ):
             raise PermissionDenied()
@@ -121,10 +126,11 @@ class MTurkMockAPI(View):
         # First let's pull out some of the HTTP header data
         # that we need to process the request.
         prefix,target = self.get_target(request)
-        if ( prefix != self._targetPrefix ):
+        isExtension = ( prefix == EXTENSION_TARGET_PREFIX )
+        if ( prefix != self._service.target_prefix and not isExtension ):
             raise Exception(
                 "Invalid Service Prefix: received='%s', expected='%s'" %
-                (prefix, self._targetPrefix)
+                (prefix, self._service.target_prefix)
             )
         amzDate = request.META["HTTP_X_AMZ_DATE"]
         contentType = request.META["CONTENT_TYPE"]
@@ -134,35 +140,66 @@ class MTurkMockAPI(View):
                 (contentType, EXPECT_CONTENT_TYPE)
             )
 
-        if ( target not in self._model.operation_names ):
+        if ( isExtension ):
+            # Emulator specific operations are not in the service
+            # model - they check their own inputs.
+            validator = None
+        elif ( not self._service.has_operation(target) ):
             raise Exception(
                 "Invalid Target Method: Unknown Target '%s'" % target
             )
+        else:
+            validator = self._service.get_validator(target)
+        # Unknown extension operations are recorded as 'Unknown'
+        if ( not isExtension or self._service.extensions.has_operation(target) ):
+            recorder.operation = target
 
-        # Get the request body and decode it
-        body = str(request.body, "utf-8")
-        reqParams = json.loads(body)
-
-        # Check the inputs into the method
-        opModel = self._model.operation_model(target)
-        inShape = opModel.input_shape
+        with recorder.phase("validation"):
+            # Get the request body and decode it
+            body = str(request.body, "utf-8")
+            reqParams = json.loads(body)
 
-        validate_parameters(reqParams, inShape)
+            # Check the inputs into the method
+            if ( validator is not None ):
+                validator.validate_input(reqParams)
 
         # Insert the requester object into the
         #  params that we will pass to the handler method.
         reqParams["EmuRequester"] = requester
 
-        method = getattr(self._handlers, target)
+        if ( isExtension ):
+            method = self._service.get_extension(target)
+        else:
+            method = self._service.get_handler(target)
+        requestId = uuid.uuid1()
+        profileName = None
         try:
-            respParams = method(**reqParams)
-
-            outShape = opModel.output_shape
-            validate_parameters(respParams, outShape)
-
-            resp = JsonResponse(respParams)
+            # The handler of a selected request is profiled - see
+            # 'mturk/profiling.py'
+            profile = profiler.select(request, requester, target, requestId)
+
+            # Each operation is one transaction - if the handler
+            # fails then none of its changes are kept. The follow
+            # up work from the model signals is coalesced and run
+            # at the end of the operation.
+            atomic = transaction.atomic()
+            if ( isExtension and
+                 not self._service.extensions.is_atomic(target) ):
+                # The operation replaces the database
+                atomic = ExitStack()
+            with recorder.phase("handler"), profile, atomic, deferred_work():
+                profileName = profile.name
+                respParams = method(**reqParams)
+
+            with recorder.phase("serialization"):
+                if ( validator is not None and
+                     self._service.output_sampler.should_validate() ):
+                    validator.validate_output(respParams)
+
+                resp = JsonResponse(respParams)
 
         except RequestError as exc:
+            recorder.error = exc.__class__.__name__
             # We want to return a json response with a
             # status code = 400 (Bad Request)
             respParams = {
@@ -171,6 +208,7 @@ class MTurkMockAPI(View):
             respParams.update( exc.serialize() )
             resp = JsonResponse(respParams, status=400)
         except Exception as exc:
+            recorder.error = "ServiceFault"
             respParams = {
                 "__type" : "ServiceFault",
                 "Message" : "Service Fault: %s" % str(exc),
@@ -178,11 +216,53 @@ class MTurkMockAPI(View):
             }
             resp = JsonResponse(respParams, status=500)
 
-        resp["x-amzn-requestid"] = uuid.uuid1()
+        resp["x-amzn-requestid"] = requestId
+        if ( profileName is not None ):
+            resp["x-emu-profile"] = profileName
         resp["content-type"] = EXPECT_CONTENT_TYPE
         return(resp)
 
 
+class MetricsView(View):
+    """
+    Per operation metrics of the API - see 'mturk/metrics.py'.
+    GET returns the metrics in the Prometheus text format or as
+    JSON if the 'format' parameter is 'json'. POST resets the
+    metrics.
+    """
+
+    PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    LOOPBACK_ADDRS = ["127.0.0.1", "::1"]
+
+    def check_access(self, request):
+        if ( not getattr(settings, "MTURK_METRICS_ENABLED", True) ):
+            raise Http404()
+        if ( getattr(settings, "MTURK_METRICS_LOCAL_ONLY", True) and
+             request.META.get("REMOTE_ADDR") not in self.LOOPBACK_ADDRS ):
+            return( HttpResponseForbidden() )
+        return(None)
+
+    def get(self, request):
+        denied = self.check_access(request)
+        if ( denied is not None ):
+            return(denied)
+        if ( request.GET.get("format", None) == "json" ):
+            return( JsonResponse(metrics.summary()) )
+        return(
+            HttpResponse(
+                metrics.prometheus_text(),
+                content_type = self.PROMETHEUS_CONTENT_TYPE
+            )
+        )
+
+    def post(self, request):
+        denied = self.check_access(request)
+        if ( denied is not None ):
+            return(denied)
+        metrics.reset()
+        return( JsonResponse({}) )
+
+
 class MTurkCreateUser(View):
     """
     Create a new MTurk Emulator User with a requester
@@ -8,8 +8,9 @@
 #
 
 from mturk.models import *
+from mturk.clock import clock
 from mturk.xml.questions import *
-from mturk.xml.answerkey import AnswerKey
+from mturk.xml.answerkey import get_answer_key
 from mturk.xml.quesformanswer import QFormAnswer
 from mturk.errors import InvalidQuestionFormError
 
@@ -113,7 +114,7 @@ class QualsActor(object):
         # Now let's score the answer from the worker if there is an
         # answer key.
         if ( len(req.qualification.answer) > 0 ):
-            ans = AnswerKey(req.qualification.answer)
+            ans = get_answer_key(req.qualification.answer)
 
             grantQual = False
             grantScore = 0
@@ -148,7 +149,7 @@ class QualsActor(object):
         # Save the Worker's answer
         ans = QFormAnswer()
         req.answer = ans.encode(form)
-        req.last_submitted = timezone.now()
+        req.last_submitted = clock.now()
         req.save()
 
 
@@ -225,7 +226,7 @@ class QualsActor(object):
             if ( qual.retry_active ):
                 req = rejects[0]
                 nextReqTime = req.last_request + qual.retry_delay
-                timestamp = timezone.now()
+                timestamp = clock.now()
                 if ( timestamp > nextReqTime ):
                     # Worker is allowed to re-request now
                     req.last_request = timestamp
@@ -261,7 +262,7 @@ class QualsActor(object):
         req = QualificationRequest.objects.create(
             worker = worker,
             qualification = qual,
-            last_request = timezone.now()
+            last_request = clock.now()
             )
 
         return(req)
@@ -0,0 +1,138 @@
+# File: mturk/worker/TaskFeed.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of the worker's task
+# feed - the list of HIT groups (task types) that a worker can
+# work on and the selection of the next task in a group. The tasks
+# available to a worker are selected in the database:
+#    - the task is assignable and has not expired,
+#    - the worker does not already have an assignment for the task
+#      (an anti-join on the worker's assignments),
+#    - the worker is not blocked by the task's requester,
+# so the number of queries does not depend on the number of tasks
+# in a group. The qualification requirements of the groups are
+# checked with the compiled requirements against the worker's
+# grants, which are loaded once.
+#
+
+from django.db.models import Count, Min
+
+from mturk.models import *
+from mturk.fields import *
+from mturk.clock import clock
+from mturk.requirements import get_requirements, load_grant_map
+
+class TaskFeed(object):
+    """
+    Tasks and HIT groups that are available to a worker.
+    """
+
+    # Orderings of the HIT group list
+    ORDERINGS = {
+        "reward" : ["-reward", "pk"],
+        "expires" : ["first_expires", "pk"],
+        "available" : ["-num_available", "pk"],
+    }
+    DEFAULT_ORDER = "reward"
+
+    def __init__(self, worker, now=None):
+        self.worker = worker
+        if ( now is None ):
+            now = clock.now()
+        self.now = now
+        self._grants = None
+
+    def get_grants(self):
+        if ( self._grants is None ):
+            self._grants = load_grant_map(self.worker)
+        return(self._grants)
+
+    def available_tasks(self):
+        """
+        @return queryset of the assignable tasks that this worker
+           has not worked on, from requesters that have not
+           blocked the worker.
+        @note - the qualification requirements are not checked.
+        """
+        workerTasks = Assignment.objects.filter(
+            worker = self.worker,
+            dispose = False
+        ).values("task_id")
+        blockedBy = WorkerBlock.objects.filter(
+            worker = self.worker,
+            active = True
+        ).values("requester_id")
+
+        return(
+            Task.objects.filter(
+                status = TaskStatusField.ASSIGNABLE,
+                dispose = False,
+                expires__gt = self.now,
+            ).exclude(
+                pk__in = workerTasks
+            ).exclude(
+                requester__in = blockedBy
+            )
+        )
+
+    def is_qualified(self, tasktype):
+        reqs = get_requirements(tasktype)
+        if ( len(reqs.qual_ids) == 0 ):
+            return(True)
+        return( reqs.evaluate(self.get_grants()) )
+
+    def next_task(self, tasktype):
+        """
+        @return the next task in the group that the worker can
+           accept or None if there are no more tasks.
+        """
+        if ( not self.is_qualified(tasktype) ):
+            return(None)
+        return(
+            self.available_tasks().filter(
+                tasktype = tasktype
+            ).order_by("expires", "pk").first()
+        )
+
+    def unqualified_groups(self):
+        """
+        @return list of the pks of the groups with available tasks
+           that the worker does not qualify for.
+        """
+        groupsWithQuals = TaskType.objects.filter(
+            dispose = False,
+            qualifications__isnull = False,
+            task__in = self.available_tasks(),
+        ).distinct()
+        return([
+            tasktype.pk for tasktype in groupsWithQuals
+            if not self.is_qualified(tasktype)
+        ])
+
+    def groups(self, order=None):
+        """
+        @param order key of 'ORDERINGS'
+        @return queryset of the HIT groups that the worker can work
+           on, annotated with the number of tasks available to the
+           worker ('num_available') and the earliest expiration of
+           those tasks ('first_expires').
+        """
+        if ( order is None ):
+            order = self.DEFAULT_ORDER
+        if ( order not in self.ORDERINGS ):
+            raise ValueError("Invalid Group Ordering: %s" % order)
+
+        return(
+            TaskType.objects.filter(
+                dispose = False,
+                task__in = self.available_tasks(),
+            ).exclude(
+                pk__in = self.unqualified_groups()
+            ).annotate(
+                num_available = Count("task"),
+                first_expires = Min("task__expires"),
+            ).order_by(
+                *self.ORDERINGS[order]
+            ).select_related("requester__user")
+        )
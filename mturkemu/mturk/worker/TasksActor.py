@@ -5,10 +5,14 @@
 #   This file contains the implementation of methods that handle
 # how a worker interacts with the tasks in the system.
 
-from django.utils import timezone
+from django.db import transaction
 
 from mturk.models import *
 from mturk.fields import *
+from mturk.clock import clock
+from mturk.deferred import defer
+from mturk.requirements import get_requirements
+from mturk.worker.TaskFeed import TaskFeed
 from mturk.errors import InvalidQuestionFormError
 from mturk.xml.quesformanswer import QFormAnswer
 
@@ -21,6 +25,10 @@ class TaskAlreadyHasAssignment(Exception):
         super().__init__("Worker has Already Submitted an Assignment for this Task")
 
 
+class InvalidAssignmentStateError(Exception):
+    def __init__(self):
+        super().__init__("Assignment is no longer accepted - it may have been abandoned or returned")
+
 class TaskPrereqError(Exception):
     def __init__(self):
         super().__init__("Worker does not have qualification grants to meet all of the necessary qualifications for this task.")
@@ -38,53 +46,33 @@ class TasksActor(object):
     def __init__(self, worker):
         self.worker = worker
 
-    def list_task_groups(self):
+    def list_task_groups(self, order=None):
         """
         Generate a queryset for available task groups that the
-        worker can view and begin interacting with.
+        worker can view and begin interacting with. Groups that the
+        worker has already completed, is blocked from or doesn't
+        qualify for are not included.
+        @param order group ordering - see 'TaskFeed.ORDERINGS'
         """
-        # We want to filter for tasks of a particular tasktype
-        # because then we can allow the worker to process tasks from
-        # that group. So we want tasks in a unique tasktype grouping
-        # Note that this is not easy and requires a couple of database
-        # transactions.
-
-        tasktypeIdList = Task.objects.filter(
-            status = TaskStatusField.ASSIGNABLE,
-            expires__gt = timezone.now()
-            ).order_by(
-                "expires"
-            ).values_list("tasktype", flat=True).distinct()
-
-        taskTypeList = TaskType.objects.filter(
-            pk__in = tasktypeIdList
-            )
+        return( TaskFeed(self.worker).groups(order) )
 
-        # @todo - this should also filter out tasks that the
-        #    worker has already submitted an assignment for
-        #    currently - we don't handle this well.
-
-        return(taskTypeList)
+    def next_task(self, tasktype):
+        """
+        Find the next task in a group that the worker can accept.
+        @return Task object or None if there are no more tasks
+        """
+        return( TaskFeed(self.worker).next_task(tasktype) )
 
 
-    def check_prerequisite_quals(self, tasktype):
+    def check_prerequisite_quals(self, tasktype, preview=False):
         """
         Check if the worker has the necessary qualification grants
         that are required for this task.
+        @param preview if true, only check the requirements that
+           must be met to preview the task.
         """
-        for qualreq in tasktype.qualifications.all():
-            try:
-                grant = self.worker.qualificationgrant_set.get(
-                    active = True,
-                    qualification = qualreq.qualification,
-                    dispose=False
-                )
-            except:
-                grant = None
-
-            if not qualreq.check_grant(grant):
-                return(False)
-        return(True)
+        reqs = get_requirements(tasktype)
+        return( reqs.check_worker(self.worker, preview) )
 
 
     def accept_task(self, task):
@@ -112,14 +100,24 @@ class TasksActor(object):
             elif ( task.status != TaskStatusField.ASSIGNABLE ):
                 raise TaskNotAvailableError()
             else:
-                acceptTime = timezone.now()
+                acceptTime = clock.now()
                 deadlineTime = acceptTime + task.tasktype.assignment_duration
-                assignment = Assignment.objects.create(
-                    task = task,
-                    worker = self.worker,
-                    accepted = acceptTime,
-                    deadline = deadlineTime
-                )
+                with transaction.atomic():
+                    # The task object may be stale - the reservation
+                    # checks the state in the database so that
+                    # concurrent accepts can't overbook the task.
+                    if ( not task.reserve_slot(acceptTime) ):
+                        raise TaskNotAvailableError()
+                    assignment = Assignment(
+                        task = task,
+                        worker = self.worker,
+                        accepted = acceptTime,
+                        deadline = deadlineTime
+                    )
+                    assignment.reserved_slot = True
+                    assignment.save()
+                    # The task may be full now
+                    defer(("task_state", task.pk), task.update_state)
                 return(assignment)
 
     def return_task(self, task):
@@ -135,7 +133,8 @@ class TasksActor(object):
             dispose = False,
         )
         assignment.dispose = True
-        assignment.save()
+        if ( not assignment.save_transition(AssignmentStatusField.ACCEPTED) ):
+            raise InvalidAssignmentStateError()
 
         self.worker.returned_hits += 1
         self.worker.save()
@@ -170,9 +169,11 @@ class TasksActor(object):
 
         assignment.answer = ansStr
         assignment.status = AssignmentStatusField.SUBMITTED
-        assignment.submitted = timezone.now()
+        assignment.submitted = clock.now()
         # Set the auto approve time
         aaTS = assignment.submitted + assignment.task.tasktype.auto_approve
         assignment.auto_approve = aaTS
 
-        assignment.save()
+        # The assignment may have been abandoned since it was loaded
+        if ( not assignment.save_transition(AssignmentStatusField.ACCEPTED) ):
+            raise InvalidAssignmentStateError()
@@ -7,21 +7,25 @@
 #
 
 from django.conf import settings
+from django.core.exceptions import SuspiciousOperation
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views import View
 from django.db.models import Q
 from django.urls import reverse
 from django.contrib import messages
-from django.utils import timezone
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import HttpResponse
 
 from mturk.models import *
 from mturk.utils import MTurkBaseView
 from mturk.fields import *
+from mturk.clock import clock
+from mturk.requirements import get_requirements
 
 from mturk.xml.questions import QuestionValidator
 from mturk.worker.actor import WorkerActor
+from mturk.worker.TasksActor import InvalidAssignmentStateError
+from mturk.worker.TaskFeed import TaskFeed
 
 import logging
 logger = logging.getLogger("mturk")
@@ -269,7 +273,11 @@ class WorkerTasksPage(LoginRequiredMixin, MTurkBaseView):
         actor = WorkerActor(worker)
         offset, count = self.get_list_form(request)
 
-        taskTypeList = actor.list_task_groups()
+        order = request.GET.get("order", TaskFeed.DEFAULT_ORDER)
+        if ( order not in TaskFeed.ORDERINGS ):
+            order = TaskFeed.DEFAULT_ORDER
+
+        taskTypeList = actor.list_task_groups(order)
 
         taskTypePage = self.create_page(offset, count, taskTypeList)
 
@@ -277,6 +285,7 @@ class WorkerTasksPage(LoginRequiredMixin, MTurkBaseView):
             "active" : "tasks",
             "worker" : worker,
             "taskTypes" : taskTypePage,
+            "order" : order,
         }
 
         return( render(request, "worker/tasks.html", cxt) )
@@ -291,24 +300,8 @@ class WorkerNextTaskPage(LoginRequiredMixin, MTurkBaseView):
         this worker from this series should be.
         """
         taskType = get_object_or_404(TaskType, pk = int(taskTypeId))
-
-        activeTasks = taskType.task_set.filter(
-            status = TaskStatusField.ASSIGNABLE,
-            expires__gt = timezone.now()
-        )
-
-        # @note - this could probably be better done using
-        #    an aggregate
-        for task in activeTasks:
-            alreadyDone = task.assignment_set.filter(
-                worker = worker,
-                dispose=False
-            ).exists()
-
-            if ( not alreadyDone ):
-                return(task)
-
-        return(None)
+        actor = WorkerActor(worker)
+        return( actor.next_task(taskType) )
 
     def get(self, request, tasktype_id):
         """
@@ -453,20 +446,8 @@ class WorkerTaskAccept(LoginRequiredMixin, MTurkBaseView):
         # @todo - it may be a good idea to include information
         #   here that signals to the user what they failed
         #   qualify for.
-        for qualreq in task.tasktype.qualifications.all():
-            try:
-                grant = worker.qualificationgrant_set.get(
-                    active = True,
-                    qualification = qualreq.qualification,
-                    dispose=False
-                )
-            except:
-                grant = None
-
-            if not qualreq.check_grant(grant):
-                return(False)
-
-        return(True)
+        reqs = get_requirements(task.tasktype)
+        return( reqs.check_worker(worker) )
 
     def get(self, request, task_id):
 
@@ -536,7 +517,10 @@ class WorkerExternalSubmit(View):
             raise SuspiciousOperation("Invalid Assignment ID: %s" % assignmentId)
 
         actor = WorkerActor(assignment.worker)
-        actor.complete_assignment(assignment, request.POST)
+        try:
+            actor.complete_assignment(assignment, request.POST)
+        except InvalidAssignmentStateError as exc:
+            raise SuspiciousOperation(str(exc))
 
         return( render(request, "worker/extques_response.html", {} ) )
 
@@ -587,6 +571,11 @@ class WorkerTaskSubmit(LoginRequiredMixin, MTurkBaseView):
             cxt["url"] = url
             cxt["form"] = exc.form
             return( render(request, "worker/task_view.html", cxt ))
+        except InvalidAssignmentStateError as exc:
+            # The assignment was abandoned while the worker was
+            # working on it.
+            messages.error(request, "Failed to Submit Assignment: %s" % str(exc))
+            return( redirect( "worker-task-info", task_id=task_id) )
 
         # Get the next task in this task group that the
         # worker can work on
@@ -594,7 +583,7 @@ class WorkerTaskSubmit(LoginRequiredMixin, MTurkBaseView):
         taskList = task.tasktype.task_set.filter(
             dispose = False,
             status = TaskStatusField.ASSIGNABLE,
-            expires__gt = timezone.now(),
+            expires__gt = clock.now(),
             )
         # Make sure that we present a task that the worker
         # has not submitted an assignment for already -
@@ -0,0 +1,148 @@
+# File: mturk/xml/answergen.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a generator of random
+# worker answers for question content. The answers for a
+# QuestionForm are generated from the constraints of the free text
+# answers and the selections of the selection answers so that
+# they pass the validation of the form. The answers are in the
+# format of the form data submitted by a worker - see
+# 'QuestionForm.process'.
+#
+
+from mturk.xml.questions import QuestionValidator
+
+import random
+import re
+import string
+
+class AnswerGenerationError(Exception):
+    pass
+
+class AnswerGenerator(object):
+    """
+    Generate random answers for question content.
+    @param rng random.Random object - the answers are reproducible
+       for a seeded generator.
+    """
+
+    # Length of the free text answers without a length constraint
+    TEXT_LENGTH = (4, 32)
+    # Range of the numeric answers without bounds
+    NUMERIC_RANGE = (0, 100)
+    # Max number of random strings tried for an answer with a
+    #   format regex
+    MAX_REGEX_ATTEMPTS = 100
+
+    TEXT_CHARS = string.ascii_letters + string.digits + " "
+
+    def __init__(self, rng=None):
+        if ( rng is None ):
+            rng = random.Random()
+        self.rng = rng
+
+    def generate_content(self, content):
+        """
+        Generate an answer for the question content of a task or a
+        qualification test.
+        @return dict of the form data
+        """
+        name, form = QuestionValidator().extract(content)
+        if ( name == "QuestionForm" ):
+            return( self.generate(form) )
+        # ExternalQuestion and HTMLQuestion answers are free form
+        return({ "answer" : self.random_text(*self.TEXT_LENGTH) })
+
+    def generate(self, form):
+        """
+        @param form QuestionForm object
+        @return dict of the form data
+        """
+        data = {}
+        for ques in form.get_questions():
+            answer = ques.answer
+            if ( answer.type == "FreeTextAnswer" ):
+                data[ques.ques_id] = self.free_text(answer.spec)
+            elif ( answer.type == "SelectionAnswer" ):
+                data[ques.ques_id] = self.selection(
+                    answer.spec, ques.fields[ques.ques_id]
+                )
+                if ( answer.spec.selections.other is not None ):
+                    data["other_" + ques.ques_id] = self.free_text(
+                        answer.spec.selections.other
+                    )
+            else:
+                raise AnswerGenerationError(
+                    "Unsupported Answer Type: %s" % answer.type
+                )
+        return(data)
+
+    def free_text(self, spec):
+        rules = spec.constraint
+        if ( rules is None ):
+            return( self.random_text(*self.TEXT_LENGTH) )
+
+        minVal = rules.bounds["min"]
+        maxVal = rules.bounds["max"]
+        if ( rules.is_numeric ):
+            if ( minVal is None and maxVal is not None ):
+                minVal = maxVal - self.NUMERIC_RANGE[1]
+            elif ( minVal is None ):
+                minVal = self.NUMERIC_RANGE[0]
+            if ( maxVal is None ):
+                maxVal = minVal + self.NUMERIC_RANGE[1]
+            return( str(self.rng.randint(minVal, maxVal)) )
+
+        minLen = max(minVal or 1, 1)
+        maxLen = maxVal if maxVal is not None else max(minLen, self.TEXT_LENGTH[1])
+        if ( minLen > maxLen ):
+            raise AnswerGenerationError("Invalid Length Constraint")
+
+        if ( rules.format_regex is None ):
+            default = spec.default or ""
+            if ( minLen <= len(default) <= maxLen and self.rng.random() < 0.5 ):
+                return(default)
+            return( self.random_text(minLen, maxLen) )
+
+        regex = re.compile(rules.format_regex.regex)
+        candidates = [ spec.default or "" ]
+        for i in range(0, self.MAX_REGEX_ATTEMPTS):
+            candidates.append( self.random_text(minLen, maxLen) )
+        for value in candidates:
+            if ( minLen <= len(value) <= maxLen and regex.search(value) ):
+                return(value)
+        raise AnswerGenerationError(
+            "No Answer Found for Format: %s" % rules.format_regex.regex
+        )
+
+    def selection(self, spec, field):
+        """
+        @param field django field of the selection - a single value
+           is generated for a ChoiceField and a list of values for a
+           MultipleChoiceField.
+        """
+        choices = [ item.sel_id for item in spec.selections.items ]
+        if ( len(choices) == 0 ):
+            raise AnswerGenerationError("Selection Answer without Selections")
+        if ( not hasattr(field, "widget") or
+             not getattr(field.widget, "allow_multiple_selected", False) ):
+            return( self.rng.choice(choices) )
+
+        minCount = spec.counts["min"] or 1
+        maxCount = spec.counts["max"] or len(choices)
+        maxCount = min(maxCount, len(choices))
+        if ( minCount > maxCount ):
+            raise AnswerGenerationError("Invalid Selection Counts")
+        count = self.rng.randint(minCount, maxCount)
+        return( self.rng.sample(choices, count) )
+
+    def random_text(self, minLen, maxLen):
+        length = self.rng.randint(minLen, maxLen)
+        text = "".join( self.rng.choice(self.TEXT_CHARS) for i in range(0, length) )
+        # Leading or trailing spaces are stripped by the form fields
+        if ( length > 0 ):
+            text = self.rng.choice(string.ascii_letters) + text[1:-1] + (
+                self.rng.choice(string.ascii_letters) if length > 1 else ""
+            )
+        return(text)
@@ -6,10 +6,19 @@
 # is more easily usable in python.
 
 
-from mturk.xml.questions import QuestionValidator
+from django.conf import settings
+
+from mturk.xml.questions import QuestionValidator, content_digest
 from mturk.errors import *
+from mturk.cache import LRUCache, register_cache
 from lxml import etree
 
+# Compiled answer keys keyed by a hash of the answer key content, so
+#   an update of a qualification's answer key uses a new entry.
+answerkey_cache = register_cache("AnswerKey", LRUCache(
+    getattr(settings, "MTURK_ANSWERKEY_CACHE_SIZE", 128)
+))
+
 class AnswerOption(object):
     """
     """
@@ -208,3 +217,90 @@ class AnswerKey(object):
             total = self.qualmap.map_score(total)
 
         return(total)
+
+
+class CompiledAnswerKey(object):
+    """
+    Scoring form of an AnswerKey - the options of each question
+    are compiled into a map of the set of selection ids to the
+    score, so that scoring an answer is one lookup per question.
+    Objects of this type are shared by the answer key cache so
+    they must be treated as read-only.
+    """
+    def __init__(self, answerKey):
+        questions = []
+        for answer in answerKey.answers:
+            scores = {}
+            for opt in answer.opts:
+                # Every option that matches adds its score
+                key = frozenset(opt.sel_id_list)
+                scores[key] = scores.get(key, 0) + opt.score
+            questions.append( (answer.ques_id, scores, answer.defaultScore) )
+        self.questions = tuple(questions)
+
+        self.map_score = None
+        if ( answerKey.qualmap is not None ):
+            self.map_score = answerKey.qualmap.map_score
+
+    @classmethod
+    def from_content(cls, content):
+        return( cls(AnswerKey(content)) )
+
+    def score_answers(self, answers):
+        """
+        Score the answers of a worker with a qualification value.
+        @param answers dict of question id to the list of selection
+           ids (or the text) that the worker submitted.
+        """
+        total = 0
+        for quesId, scores, defaultScore in self.questions:
+            try:
+                obsVal = answers[quesId]
+            except KeyError:
+                raise Exception("Missing Answer for Question: %s" % quesId)
+            total += scores.get(frozenset(obsVal), defaultScore)
+
+        if ( self.map_score is not None ):
+            total = self.map_score(total)
+        return(total)
+
+    def score(self, form):
+        return( self.score_answers(form.cleaned_data) )
+
+def get_answer_key(content):
+    """
+    @return CompiledAnswerKey for the answer key content
+    """
+    key, length = content_digest(content)
+    return(
+        answerkey_cache.get_or_create(
+            key, lambda: CompiledAnswerKey.from_content(content)
+        )
+    )
+
+def read_stored_answers(content):
+    """
+    Read the answers of a QuestionFormAnswers document written by
+    'QFormAnswer.encode' in the form that is passed to
+    'CompiledAnswerKey.score_answers'.
+    @note - the document is not validated - it was generated by the
+       emulator.
+    """
+    if ( isinstance(content, str) ):
+        content = content.encode("utf-8")
+    root = etree.fromstring(content)
+    answers = {}
+    for answer in root:
+        quesId = None
+        selIds = []
+        text = None
+        for child in answer:
+            tag = etree.QName(child.tag).localname
+            if ( tag == "QuestionIdentifier" ):
+                quesId = child.text
+            elif ( tag == "SelectionIdentifier" ):
+                selIds.append(child.text)
+            elif ( tag == "FreeText" ):
+                text = child.text if child.text is not None else ""
+        answers[quesId] = text if text is not None else selIds
+    return(answers)
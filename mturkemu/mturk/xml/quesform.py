@@ -8,7 +8,7 @@
 #
 
 from django import forms
-from django.core.exceptions import ValidationError
+from django.core import exceptions
 
 from mturk.errors import *
 
@@ -415,6 +415,18 @@ class QuestionForm(object):
             else:
                 raise InvalidTagError(tag)
 
+    def clone(self):
+        """
+        Create a new form object for processing a request. The
+        parsed contents (including the django fields, which don't
+        hold any per request state) are shared with this object.
+        """
+        ret = QuestionForm.__new__(QuestionForm)
+        ret.contents = self.contents
+        ret.cleaned_data = None
+        ret.errors = None
+        return(ret)
+
     def get_questions(self):
         return( [x for x in self.contents if x.type == "Question" ] )
 
@@ -438,7 +450,7 @@ class QuestionForm(object):
                 value = field.widget.value_from_datadict(data, [], name)
                 value = field.clean(value)
                 cleaned_data[name] = value
-            except ValidationError as exc:
+            except exceptions.ValidationError as exc:
                 namedErrors = errors.get(name, [])
                 namedErrors.append(exc)
                 errors[name] = namedErrors
@@ -12,33 +12,47 @@ from django.conf import settings
 
 from mturk.errors import *
 from mturk.xml.quesform import *
+from mturk.cache import LRUCache, register_cache
+from mturk.xml.schemas import SchemaRegistry
 
 from lxml import etree
+import hashlib
+import copy
+import io
+
+# Parsed question objects keyed by a hash of the question content.
+#   The cost of an entry is the length of its content.
+question_cache = register_cache("Question", LRUCache(
+    getattr(settings, "MTURK_QUESTION_CACHE_SIZE", 256),
+    getattr(settings, "MTURK_QUESTION_CACHE_MAX_BYTES", 32*1024*1024),
+))
+
+class ValidationCache(LRUCache):
+    """
+    Cache of the outcome of validating content against its schema,
+    keyed by a hash of the content. Each hit is a schema validation
+    that was avoided.
+    """
+    @property
+    def avoided(self):
+        return(self.hits)
 
-try:
-    SCHEMA_FILES = settings.SCHEMAS
-except:
-    raise Exception("SCHEMAS Dict is not Defined in Settings")
-
+    def stats(self):
+        ret = super().stats()
+        ret["Avoided"] = self.avoided
+        return(ret)
 
-# Load the schemas and cache locally at startup so that
-# we can have good response time later
+validation_cache = register_cache("Validation", ValidationCache(
+    getattr(settings, "MTURK_VALIDATION_CACHE_SIZE", 4096)
+))
 
-def cache_schemas():
+def content_digest(content):
     """
-    Parse and cache the XML schemas for the
-    various object types.
+    @return tuple of the hash of the content and the length of
+       the content in bytes
     """
-    ret = {}
-    for name in SCHEMA_FILES.keys():
-        filepath = SCHEMA_FILES[name]
-        with open(filepath, "rb") as f:
-            schemaXml = etree.parse(f)
-            schema = etree.XMLSchema(schemaXml)
-            ret[name] = etree.XMLParser(schema=schema)
-    return(ret)
-
-SCHEMAS = cache_schemas()
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    return( hashlib.sha1(data).hexdigest(), len(data) )
 
 
 class HTMLQuestion(object):
@@ -64,6 +78,9 @@ class HTMLQuestion(object):
             else:
                 raise InvalidTagError(tag)
 
+    def clone(self):
+        return( copy.copy(self) )
+
 class ExternalQuestion(object):
     """
     ExternalQuestion XML object for questions in HITs
@@ -85,29 +102,39 @@ class ExternalQuestion(object):
             else:
                 raise InvalidTagError(tag)
 
+    def clone(self):
+        return( copy.copy(self) )
+
 
 class QuestionValidator(object):
     """
     """
 
     def get_root_element_name(self, content):
-        # @todo - I want to replace this with a sax parser
-        #   so that we don't have to parse the tree twice
-        #   to determine the root node name
-        root = etree.fromstring(content)
-        tag = etree.QName(root.tag)
-        return(tag.localname)
+        """
+        Determine the name of the root element without parsing the
+        whole document - the parse stops at the first start tag.
+        The document is parsed and validated against the schema
+        for this root element in 'parse'.
+        """
+        if ( isinstance(content, str) ):
+            content = content.encode("utf-8")
+        events = etree.iterparse(io.BytesIO(content), events=("start",))
+        for event, elem in events:
+            tag = etree.QName(elem.tag)
+            return(tag.localname)
+        raise Exception("No Root Element")
 
     def determine_type(self, content):
         name = self.get_root_element_name(content)
-        if ( name not in SCHEMAS.keys() ):
+        if ( not SchemaRegistry.has_schema(name) ):
             raise Exception("Unknown Question Type: %s" % name)
         return(name)
 
     def parse(self, name, content):
         """
         """
-        parser = SCHEMAS[name]
+        parser = SchemaRegistry.get_parser(name)
         root = etree.fromstring(content, parser)
         return(root)
 
@@ -140,7 +167,50 @@ class QuestionValidator(object):
         except Exception as exc:
             raise ValidationError(["Invalid XML: %s" % str(exc)])
 
+    def check(self, content, validTypes):
+        """
+        Determine the type of the content and, if it is one of
+        'validTypes', validate it. The outcome of the validation is
+        cached so that identical content is only validated once.
+        @return name of the root element - the caller must check
+           that it is one of 'validTypes'.
+        @throws ValidationError with the same message as 'validate'
+           if the content is not valid.
+        """
+        key, length = content_digest(content)
+        outcome = validation_cache.get(key)
+        if ( outcome is None ):
+            name = self.determine_type(content)
+            if ( name not in validTypes ):
+                return(name)
+            try:
+                self._validate(name, content)
+                error = None
+            except Exception as exc:
+                error = "Invalid XML: %s" % str(exc)
+            outcome = (name, error)
+            validation_cache.put(key, outcome)
+
+        name, error = outcome
+        if ( name in validTypes and error is not None ):
+            raise ValidationError([error])
+        return(name)
+
     def extract(self, content):
+        """
+        Parse question content.
+        @return tuple of the name of the root element and the
+           ExternalQuestion, HTMLQuestion or QuestionForm object.
+           The object is a new instance for each call so that it
+           can be used to process a request.
+        """
+        key, length = content_digest(content)
+        name, parsed = question_cache.get_or_create(
+            key, lambda: self._extract(content), length
+        )
+        return( name, parsed.clone() )
+
+    def _extract(self, content):
         name = self.determine_type(content)
         root = self.parse(name, content)
 
@@ -0,0 +1,102 @@
+# File: mturk/xml/schemas.py
+# Author: Carl Allendorph
+#
+# Description:
+#    This file contains the implementation of a process wide
+# registry of the compiled XML schemas of the question and answer
+# content of the MTurk API. Compiling the schemas (in particular the
+# FormattedContent XHTML subset) is expensive and most processes
+# that import the models - management commands, migrations, test
+# runs - never validate any content, so each schema is compiled on
+# first use. Servers compile all of the schemas at startup with the
+# 'warmup' method.
+#
+
+from django.conf import settings
+
+from lxml import etree
+import threading
+import time
+import logging
+logger = logging.getLogger("mturk")
+
+class SchemaRegistry(object):
+    """
+    Lazily compiled, validating parsers for the schemas in the
+    'SCHEMAS' setting. The keys of the setting are the root
+    element names of the content.
+    """
+
+    _lock = threading.Lock()
+    _parsers = {}
+    # Time in seconds to compile each schema
+    load_times = {}
+
+    @staticmethod
+    def get_schema_files():
+        try:
+            return(settings.SCHEMAS)
+        except AttributeError:
+            raise Exception("SCHEMAS Dict is not Defined in Settings")
+
+    @classmethod
+    def names(cls):
+        """
+        @return list of the root element names with a schema - this
+           does not compile any schemas.
+        """
+        return( list(cls.get_schema_files().keys()) )
+
+    @classmethod
+    def has_schema(cls, name):
+        return( name in cls.get_schema_files() )
+
+    @classmethod
+    def is_loaded(cls, name):
+        return( name in cls._parsers )
+
+    @classmethod
+    def get_parser(cls, name):
+        """
+        @return validating XMLParser for content with the root
+           element 'name'
+        """
+        parser = cls._parsers.get(name)
+        if ( parser is not None ):
+            return(parser)
+
+        with cls._lock:
+            # Another thread may have compiled the schema while
+            # we were waiting for the lock.
+            parser = cls._parsers.get(name)
+            if ( parser is None ):
+                filepath = cls.get_schema_files()[name]
+                start = time.perf_counter()
+                with open(filepath, "rb") as f:
+                    schemaXml = etree.parse(f)
+                    schema = etree.XMLSchema(schemaXml)
+                parser = etree.XMLParser(schema=schema)
+                cls.load_times[name] = time.perf_counter() - start
+                cls._parsers[name] = parser
+                logger.info("Compiled XML Schema: %s" % name)
+            return(parser)
+
+    @classmethod
+    def warmup(cls):
+        """
+        Compile all of the schemas now - this is intended to be
+        called at server startup so that preforked worker
+        processes inherit the compiled schemas.
+        """
+        for name in cls.names():
+            cls.get_parser(name)
+
+    @classmethod
+    def reset(cls):
+        """
+        Drop the compiled schemas - they are compiled again on
+        next use.
+        """
+        with cls._lock:
+            cls._parsers.clear()
+            cls.load_times.clear()
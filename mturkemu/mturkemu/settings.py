@@ -88,9 +88,11 @@ MESSAGE_TAGS = {
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
 
+# The emulator's sqlite backend reports the time of each query to
+# the API metrics - see 'mturk/backends/sqlite3'.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'mturk.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
     }
 }
@@ -138,6 +140,76 @@ SCHEMAS = {
 }
 
 
+##############################
+# MTurk API
+##############################
+# Responses from the API handlers are validated against the output
+# shape of the operation in the service model. This is useful for
+# catching bugs in the handlers but is not free for large responses.
+#   0 = Never validate responses
+#   1 = Validate every response
+#   N = Validate 1 out of every N responses (load testing)
+MTURK_OUTPUT_VALIDATION_RATE = 1
+
+# The lifecycle scheduler applies the time based state changes
+# (HIT expiration, assignment abandonment and auto approval). When
+# enabled, the scheduler runs in a thread of the server process.
+# Otherwise, it can be run with 'manage.py RunScheduler'.
+# @note - threads are not inherited by forked worker processes, so
+#    with a preforking server use the command instead.
+MTURK_SCHEDULER_ENABLED = False
+# Max number of seconds between scheduler runs
+MTURK_SCHEDULER_INTERVAL = 5
+# Max number of objects transitioned in one database transaction
+MTURK_SCHEDULER_BATCH_SIZE = 500
+
+# The eligibility engine caches the grants of each qualification in
+# memory. Grant changes made with the API invalidate the cache but
+# bulk updates do not, so the cached grants are reloaded after this
+# many seconds.
+MTURK_ELIGIBILITY_CACHE_SECONDS = 60
+
+# Parsed question content is cached by a hash of the content. The
+# cache is limited to this number of entries and total length of
+# the cached content.
+MTURK_QUESTION_CACHE_SIZE = 256
+MTURK_QUESTION_CACHE_MAX_BYTES = 32*1024*1024
+
+# The outcome of validating Question, Test and AnswerKey content
+# against its schema is cached by a hash of the content. Max number
+# of cached outcomes.
+MTURK_VALIDATION_CACHE_SIZE = 4096
+
+# Max number of compiled qualification answer keys in the cache.
+MTURK_ANSWERKEY_CACHE_SIZE = 128
+
+# Qualification tests, answer keys and the answers of assignments and
+# qualification requests at least this many bytes long are stored
+# zlib compressed. Set to None to store new values uncompressed - the
+# 'CompressPayloads' command rewrites the existing values.
+MTURK_COMPRESS_THRESHOLD = 1024
+
+# Per operation metrics of the API are recorded and served at
+# '/metrics'. If 'MTURK_METRICS_LOCAL_ONLY' is true, the metrics are
+# only served to requests from the loopback address.
+MTURK_METRICS_ENABLED = True
+MTURK_METRICS_LOCAL_ONLY = True
+
+# The handlers of selected API requests are profiled with cProfile
+# and tracemalloc and the profiles are written to
+# 'MTURK_PROFILE_DIR' - see 'mturk/profiling.py'. A request is
+# selected if a staff requester sends the 'X-Emu-Profile: 1' header
+# or it is sampled at 'MTURK_PROFILE_RATE', the fraction of requests
+# that are profiled.
+MTURK_PROFILE_DIR = os.path.join(BASE_DIR, "profiles")
+MTURK_PROFILE_RATE = 0.0
+# Number of allocation sites in the allocation report of a profile
+MTURK_PROFILE_TOP_ALLOCATIONS = 25
+
+# Directory of the named snapshots of the emulator database - see
+# the 'EmuSnapshot' command.
+MTURK_SNAPSHOT_DIR = os.path.join(BASE_DIR, "snapshots")
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.10/topics/i18n/
 
@@ -11,7 +11,7 @@ from django.contrib import admin
 from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
 
-from mturk.views import MTurkMockAPI, MTurkCreateUser
+from mturk.views import MTurkMockAPI, MTurkCreateUser, MetricsView
 from mturk.worker.views import WorkerExternalSubmit
 from mturk.urls import workerPatterns, requesterPatterns
 
@@ -26,6 +26,8 @@ urlpatterns = [
     # GET = Index Webapp Page
     # POST = MTurk API Endpoint
     url(r'^$', MTurkMockAPI.as_view(), name="index"),
+    # API Metrics in the Prometheus text format
+    url(r'^metrics$', MetricsView.as_view(), name="metrics"),
     # UI for the MTurk Emulator
     url(r'^worker/', include(workerPatterns)),
     url(r'^requester/', include(requesterPatterns)),
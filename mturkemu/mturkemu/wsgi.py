@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mturkemu.settings")
 
 application = get_wsgi_application()
+
+# Load the service model and other process wide state before
+# the first request - and before a preforking server forks.
+from mturk.startup import server_startup
+server_startup()
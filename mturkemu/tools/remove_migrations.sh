@@ -14,6 +14,7 @@ python manage.py makemigrations
 
 echo ">> Adding Data Initialization Migration"
 ln -s ../datamigrations/0002_init_data.py mturk/migrations/
+ln -s ../datamigrations/0003_dedupe_questions.py mturk/migrations/
 
 echo ">> Running manage.py migrate"
 python manage.py migrate